@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Thread against asyncio transport of the BrainVisionListener.
+
+A fake Vision recorder, in a subprocess, streams RDA blocks of 10 samples at
+1 kHz to every client. NB_LISTENER listeners read it for 10 s with each
+transport, in a subprocess. Reported: the number of threads of the process,
+its CPU (user + system time) and the blocks received.
+"""
+
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+HOST = '127.0.0.1'
+PORT = 51299
+NB_CHANNEL = 32
+SAMPLE_RATE = 1000.
+CHUNKSIZE = 10
+NB_LISTENER = 8
+DURATION = 10.
+
+
+def rda_message(msgtype, payload):
+    # the GUID of the RDA messages is not checked by the listener
+    return struct.pack('<llllLL', 0, 0, 0, 0, 24 + len(payload), msgtype) + payload
+
+
+def rda_header():
+    names = b''.join(b'Ch%d\x00' % i for i in range(NB_CHANNEL))
+    payload = struct.pack('<Ld', NB_CHANNEL, 1e6 / SAMPLE_RATE)
+    payload += struct.pack('<' + 'd' * NB_CHANNEL, *([0.1] * NB_CHANNEL)) + names
+    return rda_message(1, payload)
+
+
+def serve_client(conn):
+    sigs = np.random.randn(CHUNKSIZE, NB_CHANNEL).astype('float32').tobytes()
+    conn.sendall(rda_header())
+    t0 = time.perf_counter()
+    block = 0
+    try:
+        while True:
+            conn.sendall(rda_message(4, struct.pack('<LLL', block, CHUNKSIZE, 0) + sigs))
+            block += 1
+            delay = t0 + block * CHUNKSIZE / SAMPLE_RATE - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    except OSError:
+        conn.close()
+
+
+def run_server():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((HOST, PORT))
+    server.listen()
+    while True:
+        conn, addr = server.accept()
+        threading.Thread(target=serve_client, args=(conn, ), daemon=True).start()
+
+
+def run_listeners(transport):
+    from pyacq_ext.brainvisionlistener import BrainVisionListener
+    from pyacq_ext.metrics import get_registry
+
+    listeners = []
+    for i in range(NB_LISTENER):
+        dev = BrainVisionListener(name='listener{}'.format(i))
+        dev.configure(brainamp_host=HOST, brainamp_port=PORT, transport=transport)
+        dev.outputs['signals'].configure(protocol='tcp', interface='127.0.0.1', transfermode='plaindata')
+        dev.outputs['triggers'].configure(protocol='tcp', interface='127.0.0.1', transfermode='plaindata')
+        dev.initialize()
+        listeners.append(dev)
+
+    cpu0 = time.process_time()
+    for dev in listeners:
+        dev.start()
+    time.sleep(DURATION / 2)
+    nb_thread = threading.active_count()
+    time.sleep(DURATION / 2)
+    for dev in listeners:
+        dev.stop()
+    cpu = time.process_time() - cpu0
+
+    nb_block = sum(item['value'] for item in
+                   get_registry().to_dict()['pyacq_ext_brainamp_blocks_total'])
+    print('{:>7}: {} listeners, {} threads, {} blocks, CPU {:.1f}%'.format(
+        transport, NB_LISTENER, nb_thread, nb_block, cpu / DURATION * 100))
+
+
+def test_asyncio_transport():
+    server = subprocess.Popen([sys.executable, __file__, 'server'])
+    try:
+        time.sleep(1.)
+        for transport in ('thread', 'asyncio'):
+            env = dict(os.environ, PYACQ_EXT_BACKEND='thread')
+            subprocess.run([sys.executable, __file__, 'run', transport], env=env, check=True)
+    finally:
+        server.kill()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['server']:
+        run_server()
+    elif sys.argv[1:2] == ['run']:
+        run_listeners(sys.argv[2])
+    else:
+        test_asyncio_transport()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Latency of the ClassifierPool with a slow model.
+
+Stocks are submitted at 10 Hz to a pool of 2 workers running a model taking
+about 50 ms, the script prints the result counters and the latency
+percentiles.
+"""
+
+import time
+
+import numpy as np
+from pyqtgraph.Qt import QtCore, QtGui
+
+from pyacq_ext.classifierpool import ClassifierPool
+
+
+def predict(stock):
+    # stands for a heavy model
+    time.sleep(0.05)
+    return int(np.argmax(stock.mean(axis=(1, 2))))
+
+
+def test_classifierpool():
+    app = QtGui.QApplication([])
+
+    pool = ClassifierPool()
+    pool.configure(predict=predict, nb_worker=2, timeout=0.5, max_pending=8)
+    pool.initialize()
+
+    results = []
+    pool.new_result.connect(lambda label, info, result: results.append(result))
+    pool.start()
+
+    rng = np.random.default_rng(0)
+    stocks = rng.standard_normal((10, 5, 32, 500), dtype='float32')
+    nb_stock = [0]
+
+    def send_stock():
+        pool.on_new_chunk('S  1', '', stocks[nb_stock[0] % stocks.shape[0]])
+        nb_stock[0] += 1
+
+    timer = QtCore.QTimer(interval=100)
+    timer.timeout.connect(send_stock)
+    timer.start()
+
+    def terminate():
+        timer.stop()
+        pool.stop()
+        print(pool.get_stats())
+        pool.close()
+        app.quit()
+
+    QtCore.QTimer.singleShot(5000, terminate)
+    app.exec_()
+
+
+if __name__ == '__main__':
+    test_classifierpool()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Latency benchmark of the EventPoller protocol.
+
+A GameSimulator sends events at EVENT_RATE Hz to an EventPoller fed by a
+NoiseGenerator. The script reports the game round-trip times, the
+event-to-trigger-stream latency and the dropped messages, use it to size
+stimulation rates before lab sessions.
+"""
+
+import threading
+import time
+
+import numpy as np
+from pyqtgraph.Qt import QtCore, QtGui
+
+from pyacq.core import InputStream, ThreadPollInput
+from pyacq_ext.commandbus import ResultRequest
+from pyacq_ext.eventpoller import EventPoller
+from pyacq_ext.gamesimulator import GameSimulator
+from pyacq_ext.noisegenerator import NoiseGenerator
+
+NB_EVENT = 2000
+EVENT_RATE = 100.
+RESULT_EVERY = 50
+HOST, PORT = '127.0.0.1', 5557
+
+
+def test_eventpoller_latency():
+    app = QtGui.QApplication([])
+
+    ng = NoiseGenerator()
+    ng.configure(chunksize=10, sample_rate=1000.)
+    ng.outputs['signals'].configure(protocol='tcp', transfermode='plaindata')
+    ng.initialize()
+
+    poller = EventPoller()
+    poller.configure(host=HOST, port=PORT)
+    poller.inputs['signals'].connect(ng.outputs['signals'])
+    poller.outputs['triggers'].configure(protocol='tcp', transfermode='plaindata')
+    poller.initialize()
+    poller.bus.subscribe(ResultRequest, lambda command: poller.send_result('0/0'))
+
+    # arrival time of each trigger, indexed by event sequence number
+    arrivals = np.full(NB_EVENT, np.nan)
+
+    def on_new_trig(ptr, data):
+        arrivals[data['additionalInformation'].astype(int)] = time.time() * 1000
+
+    triggers = InputStream()
+    triggers.connect(poller.outputs['triggers'])
+    trig_poller = ThreadPollInput(triggers, return_data=True)
+    trig_poller.new_data.connect(on_new_trig, QtCore.Qt.DirectConnection)
+
+    game = GameSimulator(host=HOST, port=PORT)
+
+    def play():
+        game.connect()
+        game.start()
+        game.run(NB_EVENT, EVENT_RATE, result_every=RESULT_EVERY)
+        game.quit()
+        # let the last triggers reach the poller
+        time.sleep(0.2)
+        app.quit()
+
+    ng.start()
+    poller.start()
+    trig_poller.start()
+    player = threading.Thread(target=play)
+    player.start()
+
+    app.exec_()
+    player.join()
+
+    for request, stat in game.stats().items():
+        print('{:>12} sent {nb_sent:6d} dropped {nb_dropped:4d} rtt (ms) '
+              'mean {rtt_mean:.3f} p50 {rtt_p50:.3f} p99 {rtt_p99:.3f} '
+              'max {rtt_max:.3f}'.format(request, **stat))
+
+    latency = arrivals - game.event_times()
+    received = latency[~np.isnan(latency)]
+    print('event to trigger stream (ms): mean {:.3f} p50 {:.3f} p99 {:.3f} max {:.3f}'.format(
+        received.mean(), np.percentile(received, 50), np.percentile(received, 99), received.max()))
+    print('triggers lost {} / {}, late replies {}'.format(
+        NB_EVENT - received.size, NB_EVENT, game.nb_late))
+
+    trig_poller.stop()
+    trig_poller.wait()
+    poller.stop()
+    ng.stop()
+    poller.close()
+    ng.close()
+    game.close()
+
+
+if __name__ == '__main__':
+    test_eventpoller_latency()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Load test of EventPoller in 'router' mode.
+
+NB_CLIENT simulated games connect with DEALER sockets and each send
+NB_EVENT events followed by a result request. The script reports the
+acknowledge throughput and checks every session got its own triggers.
+"""
+
+import threading
+import time
+
+import numpy as np
+import zmq
+from pyqtgraph.Qt import QtCore, QtGui
+
+from pyacq.core import InputStream, ThreadPollInput
+from pyacq_ext.commandbus import ResultRequest
+from pyacq_ext.eventpoller import EventPoller
+from pyacq_ext.noisegenerator import NoiseGenerator
+
+NB_CLIENT = 50
+NB_EVENT = 200
+HOST, PORT = '127.0.0.1', 5556
+
+
+def run_client(num, context, replies):
+    socket = context.socket(zmq.DEALER)
+    socket.setsockopt(zmq.IDENTITY, 'game{}'.format(num).encode())
+    socket.connect('tcp://{}:{}'.format(HOST, PORT))
+
+    socket.send_string('START_ZMQ|')
+    socket.recv_string()
+    for e in range(NB_EVENT):
+        socket.send_string('EVENT_ZMQ|{}/S  1'.format(time.time() * 1000))
+        socket.recv_string()
+    socket.send_string('RESULT_ZMQ|{}'.format(NB_EVENT))
+    replies[num] = socket.recv_string()
+    socket.send_string('QUIT_ZMQ|')
+    socket.recv_string()
+    socket.close()
+
+
+def test_eventpoller_router():
+    app = QtGui.QApplication([])
+
+    ng = NoiseGenerator()
+    ng.configure()
+    ng.outputs['signals'].configure(protocol='tcp', transfermode='plaindata')
+    ng.initialize()
+
+    poller = EventPoller()
+    poller.configure(host=HOST, port=PORT, mode='router')
+    poller.inputs['signals'].connect(ng.outputs['signals'])
+    poller.outputs['triggers'].configure(protocol='tcp', transfermode='plaindata')
+    poller.initialize()
+    poller.bus.subscribe(ResultRequest, lambda command: poller.send_result('RESULT_ZMQ|ok'))
+
+    channels = []
+    triggers = InputStream()
+    triggers.connect(poller.outputs['triggers'])
+    trig_poller = ThreadPollInput(triggers, return_data=True)
+    trig_poller.new_data.connect(lambda ptr, data: channels.extend(data['channel']),
+                                 QtCore.Qt.DirectConnection)
+
+    ng.start()
+    poller.start()
+    trig_poller.start()
+
+    context = zmq.Context()
+    replies = {}
+    clients = [threading.Thread(target=run_client, args=(num, context, replies))
+               for num in range(NB_CLIENT)]
+
+    t0 = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    duration = time.perf_counter() - t0
+
+    # let the last triggers reach the poller
+    time.sleep(0.2)
+
+    nb_request = NB_CLIENT * (NB_EVENT + 3)
+    print('{} clients, {} requests in {:.3f}s ({:.0f} req/s)'.format(
+        NB_CLIENT, nb_request, duration, nb_request / duration))
+
+    assert len(replies) == NB_CLIENT
+    assert np.unique(channels).size == NB_CLIENT
+    assert len(channels) == NB_CLIENT * NB_EVENT
+
+    trig_poller.stop()
+    trig_poller.wait()
+    poller.stop()
+    ng.stop()
+    poller.close()
+    ng.close()
+
+
+if __name__ == '__main__':
+    test_eventpoller_router()
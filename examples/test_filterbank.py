@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+
+import scipy.signal
+from pyqtgraph.Qt import QtCore, QtGui
+
+from pyacq.viewers.qoscilloscope import QOscilloscope
+from pyacq_ext.filterbank import FilterBank
+from pyacq_ext.noisegenerator import NoiseGenerator
+
+
+def test_filterbank():
+    # in main App
+    app = QtGui.QApplication([])
+
+    """
+    Noise Generator Node
+    """
+    ng = NoiseGenerator()
+    ng.configure(nb_channel=32, sample_rate=2000., chunksize=50, color='pink')
+    ng.outputs['signals'].configure(protocol='tcp', interface='127.0.0.1', transfermode='plaindata')
+    ng.initialize()
+
+    """
+    Filter Bank Node : CAR, notch 50Hz, bandpass 1-40Hz and decimation by 4
+    """
+    sample_rate = 2000.
+    notch = scipy.signal.tf2sos(*scipy.signal.iirnotch(50., 30., fs=sample_rate))
+    bandpass = scipy.signal.iirfilter(2, [1., 40.], btype='bandpass', ftype='butter',
+                                      fs=sample_rate, output='sos')
+
+    fb = FilterBank()
+    fb.configure(stages=[notch, bandpass], reference='car', decimate=4)
+    fb.inputs['signals'].connect(ng.outputs['signals'])
+    fb.outputs['signals'].configure(protocol='tcp', interface='127.0.0.1', transfermode='plaindata')
+    fb.initialize()
+
+    """
+    Oscilloscope Node
+    """
+    viewer = QOscilloscope()
+    viewer.configure()
+    viewer.input.connect(fb.outputs['signals'])
+    viewer.initialize()
+    viewer.show()
+
+    ng.start()
+    fb.start()
+    viewer.start()
+
+    def terminate():
+        viewer.stop()
+        fb.stop()
+        ng.stop()
+
+        viewer.close()
+        fb.close()
+        ng.close()
+
+        app.quit()
+
+    # start for a while
+    timer = QtCore.QTimer(singleShot=True, interval=5000)
+    timer.timeout.connect(terminate)
+    #~ timer.start()
+
+    app.exec_()
+
+
+if __name__ == '__main__':
+    test_filterbank()
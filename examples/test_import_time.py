@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Cold import time of pyacq_ext and of its node modules.
+
+Each import runs in a fresh interpreter with `-X importtime`. The import of
+the package itself must stay below IMPORT_BUDGET s. For each node module the
+time beyond `pyacq.core`, which every node needs, is printed with the heavy
+dependencies it loaded, which should only be loaded when a node using them
+is configured.
+"""
+
+import subprocess
+import sys
+
+IMPORT_BUDGET = 0.02
+NB_RUN = 5
+
+modules = ['brainvisionlistener', 'classifierpool', 'eeg_openBCIListener', 'epochermultilabel',
+           'eventpoller', 'filterbank', 'noisegenerator', 'rawbufferdevice', 'recorder',
+           'spatialfilter', 'streammerger']
+heavy = ['h5py', 'hdf5plugin', 'mne', 'scipy', 'pdb']
+
+
+def cold_import(statement):
+    """Import times in s of the top-level imports of `statement`, and the modules loaded"""
+    code = 'import sys; {}; print(" ".join(sys.modules))'.format(statement)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        # the nested imports are indented
+        if not fields[2][1:].startswith(' '):
+            times[fields[2].strip()] = int(fields[1]) * 1e-6
+    return times, set(proc.stdout.split())
+
+
+def best_of(statement, name=None):
+    """Shortest time over NB_RUN of `name`, of all the imports by default"""
+    durations = []
+    for _ in range(NB_RUN):
+        times, loaded = cold_import(statement)
+        durations.append(times.get(name, 0.) if name else sum(times.values()))
+    return min(durations), loaded
+
+
+def test_import_time():
+    duration, loaded = best_of('import pyacq_ext', name='pyacq_ext')
+    print('import pyacq_ext: {:.1f} ms (budget {:.0f} ms)'.format(duration * 1e3, IMPORT_BUDGET * 1e3))
+    assert duration < IMPORT_BUDGET, 'import pyacq_ext takes {:.1f} ms'.format(duration * 1e3)
+
+    base, base_loaded = best_of('import pyacq.core')
+    print('import pyacq.core: {:.1f} ms'.format(base * 1e3))
+    for module in modules:
+        duration, loaded = best_of('import pyacq.core; import pyacq_ext.{}'.format(module))
+        extra = sorted(name for name in set(loaded) - base_loaded if name in heavy)
+        print('  {:22s} +{:6.1f} ms {}'.format(module, (duration - base) * 1e3, ' '.join(extra)))
+
+
+if __name__ == '__main__':
+    test_import_time()
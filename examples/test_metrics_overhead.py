@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Overhead of the metrics on a BrainAmp block.
+
+A 32 channels x 20 samples block with 1 marker is decoded as in
+BrainAmpThread, with and without recording its metrics, and the registry is
+then served on http://127.0.0.1:9100/metrics for a few seconds.
+"""
+
+import struct
+import time
+
+import numpy as np
+
+from pyacq_ext.metrics import MetricsServer, get_registry, perf_counter_ns
+from pyacq_ext.triggers import empty_triggers
+
+NB_CHANNEL = 32
+POINTS = 20
+SAMPLE_RATE = 1000.
+NB_BLOCK = 20000
+
+
+def make_block():
+    sigs = np.random.default_rng(0).standard_normal((POINTS, NB_CHANNEL)).astype('float32')
+    marker = struct.pack('<LLl', 5, 1, -1) + b'Stimulus\x00S  1\x00'
+    return (struct.pack('<LLL', 1, POINTS, 1) + sigs.tobytes() +
+            struct.pack('<L', len(marker) + 4) + marker)
+
+
+def decode(rawdata, resolutions):
+    block, points, nb_marker = struct.unpack('<LLL', rawdata[:12])
+    sigsize = 4 * points * NB_CHANNEL
+    sigs = np.frombuffer(rawdata[12:12 + sigsize], dtype='float32').reshape(points, NB_CHANNEL)
+    sigs = sigs * resolutions[np.newaxis, :]
+    markers = empty_triggers(nb_marker)
+    index = 12 + sigsize
+    for m in range(nb_marker):
+        markersize, = struct.unpack('<L', rawdata[index:index + 4])
+        markers['pos'][m], markers['points'][m], markers['channel'][m] = \
+            struct.unpack('<LLl', rawdata[index + 4:index + 16])
+        markers['type'][m], markers['description'][m] = \
+            rawdata[index + 16:index + markersize].split(b'\x00')[:2]
+        index += markersize
+    return points, nb_marker
+
+
+def test_metrics_overhead():
+    rawdata = make_block()
+    resolutions = np.ones(NB_CHANNEL, dtype='float32')
+    registry = get_registry()
+    nb_block = registry.counter('pyacq_ext_brainamp_blocks_total', node='bench')
+    nb_sample = registry.counter('pyacq_ext_brainamp_samples_total', node='bench')
+    latency = registry.histogram('pyacq_ext_brainamp_block_seconds', node='bench')
+
+    def bare():
+        for _ in range(NB_BLOCK):
+            decode(rawdata, resolutions)
+
+    def instrumented():
+        for _ in range(NB_BLOCK):
+            t0 = perf_counter_ns()
+            points, nb_marker = decode(rawdata, resolutions)
+            nb_block.inc()
+            nb_sample.inc(points)
+            latency.record_since(t0)
+
+    timings = {}
+    for name, func in (('bare', bare), ('instrumented', instrumented)):
+        best = []
+        for _ in range(5):
+            t0 = time.perf_counter()
+            func()
+            best.append(time.perf_counter() - t0)
+        timings[name] = min(best) / NB_BLOCK
+    overhead = timings['instrumented'] - timings['bare']
+    # a block of POINTS samples at 1 kHz is received every POINTS ms
+    period = POINTS / SAMPLE_RATE
+    print('block decode {:.2f} us, with metrics {:.2f} us'.format(
+        timings['bare'] * 1e6, timings['instrumented'] * 1e6))
+    print('metrics cost {:.2f} us per block, {:.3f}% of the block period'.format(
+        overhead * 1e6, overhead / period * 100))
+
+    server = MetricsServer(port=9100)
+    server.start()
+    print('metrics on http://127.0.0.1:{}/metrics'.format(server.port))
+    time.sleep(5.)
+    server.stop()
+
+
+if __name__ == '__main__':
+    test_metrics_overhead()
@@ -37,7 +37,7 @@ def test_brainampsocket():
     """
     ng = NoiseGenerator()
     ng.configure()
-    ng.output.configure(protocol='tcp', transfermode='plaindata')
+    ng.outputs['signals'].configure(protocol='tcp', transfermode='plaindata')
     ng.initialize()
 
     """
@@ -45,7 +45,7 @@ def test_brainampsocket():
     """
     viewer = QOscilloscope()
     viewer.configure()
-    viewer.input.connect(ng.output)
+    viewer.input.connect(ng.outputs['signals'])
     viewer.initialize()
     viewer.show()
 
@@ -60,7 +60,7 @@ def test_brainampsocket():
 
     epocher = EpocherMultiLabel()
     epocher.configure(parameters=params)
-    epocher.inputs['signals'].connect(ng.output)
+    epocher.inputs['signals'].connect(ng.outputs['signals'])
     epocher.inputs['triggers'].connect(te.output)
     epocher.initialize()
 
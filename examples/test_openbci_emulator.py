@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+OpenBCIListener against the emulated board.
+
+For each configuration the listener reads an OpenBCIEmulator for a few
+seconds. The packet rate, the CPU time of the process and the losses
+counted by the listener are printed next to the errors injected by the
+emulator. The throughput of the packet decoder alone is measured apart.
+"""
+
+import time
+
+from pyqtgraph.Qt import QtCore
+
+from pyacq_ext.eeg_openBCIListener import OpenBCIListener, PacketDecoder, board_profiles
+from pyacq_ext.metrics import get_registry, node_label
+from pyacq_ext.openbciemulator import OpenBCIEmulator
+
+DURATION = 5.
+
+configs = [
+    dict(board='cyton', sample_rate=250, baud=115200),
+    dict(board='cyton', sample_rate=1000, baud=921600),
+    dict(board='daisy', sample_rate=125, baud=115200),
+    dict(board='cyton', sample_rate=250, baud=115200, corrupt_rate=0.01, drop_byte_rate=0.01,
+         id_gap_rate=0.01),
+]
+
+
+def run_config(app, board, sample_rate, baud, **errors):
+    emulator = OpenBCIEmulator(board=board, seed=0, **errors)
+    emulator.start()
+
+    dev = OpenBCIListener()
+    dev.configure(device_handle=emulator.port, board=board, sample_rate=sample_rate, baud=baud)
+    for name in ('signals', 'aux', 'triggers'):
+        dev.outputs[name].configure(protocol='tcp', interface='127.0.0.1', transfermode='plaindata')
+    dev.initialize()
+
+    cpu0 = time.process_time()
+    dev.start()
+    QtCore.QTimer.singleShot(int(DURATION * 1000), app.quit)
+    app.exec_()
+    dev.stop()
+    cpu = time.process_time() - cpu0
+    stats = emulator.stats()
+    emulator.stop()
+    dev.close()
+
+    registry = get_registry()
+    node = node_label(dev)
+    counts = {name: registry.counter('pyacq_ext_openbci_{}_total'.format(name), node=node).value
+              for name in ('packets', 'wrong_packets', 'lost_bytes', 'gaps', 'lost_samples')}
+    print('{} {} Hz {} baud {}'.format(board, sample_rate, baud, errors or ''))
+    print('  {:.0f} packets/s, CPU {:.1f} %'.format(counts['packets'] / DURATION,
+                                                  cpu / DURATION * 100))
+    print('  emulator: {packets} packets, {skipped} skipped, {corrupted} corrupted, '
+          '{dropped_bytes} dropped bytes, {overflow} overflow'.format(**stats))
+    print('  listener: {packets} packets, {wrong_packets} wrong, {lost_bytes} lost bytes, '
+          '{gaps} gaps, {lost_samples} lost samples'.format(**counts))
+
+
+def bench_decoder(board, nb_packet=100000):
+    emulator = OpenBCIEmulator(board=board)
+    emulator.sample_index = emulator.sample_id = 0
+    data = emulator.make_packets(nb_packet).tobytes()
+    decoder = PacketDecoder(board_profiles[board])
+    t0 = time.perf_counter()
+    # chunks of 10 ms at 250 packets/s
+    for i in range(0, len(data), 33 * 25):
+        decoder.feed(data[i:i + 33 * 25])
+    duration = time.perf_counter() - t0
+    print('decoder {}: {:.2f} us/packet'.format(board, duration / nb_packet * 1e6))
+
+
+def test_openbci_emulator():
+    app = QtCore.QCoreApplication([])
+    for config in configs:
+        run_config(app, **config)
+    for board in ('cyton', 'ganglion'):
+        bench_decoder(board)
+
+
+if __name__ == '__main__':
+    test_openbci_emulator()
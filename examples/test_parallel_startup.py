@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Sequential against parallel startup of the acquisition nodes.
+
+NB_RECORDER fake Vision recorders answer the connection after
+HEADER_DELAY s, as a busy recorder does, and the OpenBCI BOARDS are
+emulated on ptys (POSIX only). The nodes are configured and initialized one
+after the other, then with :mod:`startup`, and the time of each node is
+printed.
+"""
+
+import socket
+import threading
+import time
+
+from pyacq_ext.brainvisionlistener import BrainVisionListener
+from pyacq_ext.eeg_openBCIListener import OpenBCIListener
+from pyacq_ext.openbciemulator import OpenBCIEmulator
+from pyacq_ext.startup import configure_nodes, initialize_nodes
+
+from test_asyncio_transport import HOST, rda_header
+
+PORT = 51320
+NB_RECORDER = 4
+BOARDS = ('cyton', 'daisy')
+HEADER_DELAY = 0.5
+
+
+def run_recorder(port):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((HOST, port))
+    server.listen()
+    while True:
+        conn, addr = server.accept()
+        time.sleep(HEADER_DELAY)
+        conn.sendall(rda_header())
+
+
+def make_nodes(emulators):
+    nodes = {}
+    for i in range(NB_RECORDER):
+        dev = BrainVisionListener(name='brainvision{}'.format(i))
+        nodes[dev] = dict(brainamp_host=HOST, brainamp_port=PORT + i)
+    for i, (board, emulator) in enumerate(zip(BOARDS, emulators)):
+        dev = OpenBCIListener(name='openbci{}'.format(i))
+        nodes[dev] = dict(device_handle=emulator.port, board=board)
+    return nodes
+
+
+def configure_outputs(node):
+    for output in node.outputs.values():
+        output.configure(protocol='tcp', interface='127.0.0.1', transfermode='plaindata')
+
+
+def test_parallel_startup():
+    for i in range(NB_RECORDER):
+        threading.Thread(target=run_recorder, args=(PORT + i, ), daemon=True).start()
+    emulators = [OpenBCIEmulator(board=board) for board in BOARDS]
+    for emulator in emulators:
+        emulator.start()
+    time.sleep(0.2)
+
+    nodes = make_nodes(emulators)
+    t0 = time.perf_counter()
+    for node, kargs in nodes.items():
+        t1 = time.perf_counter()
+        node.configure(**kargs)
+        configure_outputs(node)
+        node.initialize()
+        print('  {}: {:.3f} s'.format(node.name, time.perf_counter() - t1))
+        node.close()
+    print('sequential: {:.3f} s'.format(time.perf_counter() - t0))
+
+    nodes = make_nodes(emulators)
+    t0 = time.perf_counter()
+    configured = configure_nodes(nodes)
+    for node in nodes:
+        configure_outputs(node)
+    initialized = initialize_nodes(list(nodes))
+    for name in configured:
+        print('  {}: configure {:.3f} s, initialize {:.3f} s'.format(
+            name, configured[name], initialized[name]))
+    print('parallel: {:.3f} s'.format(time.perf_counter() - t0))
+    for node in nodes:
+        node.close()
+
+    for emulator in emulators:
+        emulator.stop()
+
+
+if __name__ == '__main__':
+    test_parallel_startup()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Sustained write throughput of the Recorder at 256 channels x 10 kHz.
+
+Chunks are put to a RecorderWriter as fast as possible, the script reports
+the throughput for each compression and how it compares to the realtime
+data rate.
+"""
+
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from pyacq_ext.recorder import RecorderWriter
+from pyacq_ext.triggers import make_triggers
+
+NB_CHANNEL = 256
+SAMPLE_RATE = 10000.
+CHUNKSIZE = 100
+DURATION = 20.
+
+
+def bench(compression, filename):
+    rng = np.random.default_rng(0)
+    # pink-ish signal so compression is not only on white noise
+    chunks = np.cumsum(rng.standard_normal((50, CHUNKSIZE, NB_CHANNEL), dtype='float32'), axis=1)
+
+    writer = RecorderWriter(filename, NB_CHANNEL, dtype='float32', sample_rate=SAMPLE_RATE,
+                            compression=compression)
+    writer.start()
+    nb_chunk = int(DURATION * SAMPLE_RATE / CHUNKSIZE)
+    t0 = time.perf_counter()
+    for i in range(nb_chunk):
+        pos = (i + 1) * CHUNKSIZE
+        writer.put('signals', pos, chunks[i % chunks.shape[0]])
+        if i % 10 == 0:
+            writer.put('triggers', 1, make_triggers(pos - CHUNKSIZE // 2, description=b'S  1'))
+    writer.stop()
+    duration = time.perf_counter() - t0
+
+    size = os.path.getsize(filename)
+    raw_size = nb_chunk * CHUNKSIZE * NB_CHANNEL * 4
+    print('{:>6}: {:6.1f} MB/s, {:5.1f}x realtime, file {:5.1f}% of raw'.format(
+        str(compression), raw_size / duration / 1e6, DURATION / duration, 100. * size / raw_size))
+    assert writer.nb_gap == 0
+    return DURATION / duration
+
+
+def test_recorder_throughput():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for compression in (None, 'lzf', 'gzip', 'blosc'):
+            try:
+                speed = bench(compression, os.path.join(tmpdir, 'rec.h5'))
+            except ImportError as e:
+                print('{:>6}: skipped, {}'.format(compression, e))
+                continue
+            if compression in (None, 'blosc'):
+                assert speed > 1., '{} can not sustain realtime'.format(compression)
+
+
+if __name__ == '__main__':
+    test_recorder_throughput()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Qt backend against the headless 'thread' backend.
+
+The same NoiseGenerator -> EpocherMultiLabel pipeline runs 10 s with each
+backend, in a subprocess. The latency is the time between the moment the
+last sample of an epoch is due and its stock being emitted, CPU is the
+process user + system time.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+SAMPLE_RATE = 1000.
+CHUNKSIZE = 10
+TRIGGER_INTERVAL = 0.1
+RIGHT_SWEEP = 0.05
+DURATION = 10.
+
+
+def run_pipeline():
+    from pyacq_ext.runtime import get_backend
+    from pyacq_ext.epochermultilabel import EpocherMultiLabel
+    from pyacq_ext.noisegenerator import NoiseGenerator
+
+    if get_backend() == 'qt':
+        from pyqtgraph.Qt import QtCore
+        app = QtCore.QCoreApplication([])
+
+    template = np.hanning(100).astype('float32') * 5.
+    ng = NoiseGenerator()
+    ng.configure(nb_channel=32, sample_rate=SAMPLE_RATE, chunksize=CHUNKSIZE,
+                 templates={'S  1': template}, trigger_interval=TRIGGER_INTERVAL)
+    ng.outputs['signals'].configure(protocol='tcp', interface='127.0.0.1', transfermode='plaindata')
+    ng.outputs['triggers'].configure(protocol='tcp', interface='127.0.0.1', transfermode='plaindata')
+    ng.initialize()
+
+    epocher = EpocherMultiLabel()
+    epocher.configure(parameters={'S  1': {'left_sweep': 0.05, 'right_sweep': RIGHT_SWEEP,
+                                           'max_stock': 1}})
+    epocher.inputs['signals'].connect(ng.outputs['signals'])
+    epocher.inputs['triggers'].connect(ng.outputs['triggers'])
+    epocher.initialize()
+
+    trigger_step = int(TRIGGER_INTERVAL * SAMPLE_RATE)
+    right_limit = int(RIGHT_SWEEP * SAMPLE_RATE)
+    latencies = []
+
+    def on_new_chunk(label, additionalInformation, stock):
+        # stocks come in the trigger order, the k-th epoch ends at this pos
+        pos = (len(latencies) + 1) * trigger_step + right_limit
+        due = ng.pacer.t0 + np.ceil(pos / CHUNKSIZE) * CHUNKSIZE / SAMPLE_RATE
+        latencies.append(time.perf_counter() - due)
+
+    epocher.new_chunk.connect(on_new_chunk)
+
+    cpu0 = time.process_time()
+    epocher.start()
+    ng.start()
+    if get_backend() == 'qt':
+        QtCore.QTimer.singleShot(int(DURATION * 1000), app.quit)
+        app.exec_()
+    else:
+        time.sleep(DURATION)
+    ng.stop()
+    epocher.stop()
+    cpu = time.process_time() - cpu0
+
+    latencies = np.array(latencies[1:]) * 1e3
+    print('{:>6}: {} stocks, latency p50 {:.2f} ms p99 {:.2f} ms max {:.2f} ms, CPU {:.1f}%'.format(
+        get_backend(), latencies.size, np.percentile(latencies, 50),
+        np.percentile(latencies, 99), latencies.max(), cpu / DURATION * 100))
+
+
+def test_runtime_backend():
+    for backend in ('qt', 'thread'):
+        env = dict(os.environ, PYACQ_EXT_BACKEND=backend)
+        subprocess.run([sys.executable, __file__, 'run'], env=env, check=True)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['run']:
+        run_pipeline()
+    else:
+        test_runtime_backend()
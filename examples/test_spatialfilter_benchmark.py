@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Batched projection of a stock against a per epoch loop.
+
+A stock of 64 channels x 1 s epochs is projected on 4 xDAWN components
+with decimation, once with :func:`project_epochs` on the whole stock and
+once epoch by epoch.
+"""
+
+import time
+
+import numpy as np
+
+from pyacq_ext.spatialfilter import project_epochs, xdawn_filters
+
+NB_CHANNEL = 64
+SIZE = 1000
+NB_COMPONENT = 4
+DECIMATE = 10
+NB_REPEAT = 50
+
+
+def per_epoch(stock, filters, decimate):
+    features = []
+    for epoch in stock:
+        projected = filters.T @ epoch
+        size = projected.shape[1] - projected.shape[1] % decimate
+        projected = projected[:, :size].reshape(projected.shape[0], -1, decimate).mean(axis=2)
+        features.append(projected.ravel())
+    return np.array(features)
+
+
+def bench(func, stock, filters):
+    func(stock, filters, DECIMATE)
+    t0 = time.perf_counter()
+    for _ in range(NB_REPEAT):
+        features = func(stock, filters, DECIMATE)
+    return (time.perf_counter() - t0) / NB_REPEAT, features
+
+
+def test_spatialfilter_benchmark():
+    rng = np.random.default_rng(0)
+    evoked = np.sin(np.linspace(0, np.pi, SIZE)) * rng.standard_normal((NB_CHANNEL, 1))
+    signal_cov = np.cov(rng.standard_normal((NB_CHANNEL, 10 * SIZE)))
+    filters = xdawn_filters(evoked, signal_cov, NB_COMPONENT).astype('float32')
+
+    for max_stock in (1, 10, 50, 200):
+        stock = rng.standard_normal((max_stock, NB_CHANNEL, SIZE), dtype='float32')
+        t_batch, f_batch = bench(project_epochs, stock, filters)
+        t_loop, f_loop = bench(per_epoch, stock, filters)
+        assert np.allclose(f_batch, f_loop, atol=1e-4)
+        print('max_stock {:4d}: batched {:7.3f} ms, per epoch {:7.3f} ms, x{:4.1f}, '
+              '{} -> {} values per epoch'.format(
+                  max_stock, t_batch * 1e3, t_loop * 1e3, t_loop / t_batch,
+                  NB_CHANNEL * SIZE, f_batch.shape[1]))
+
+
+if __name__ == '__main__':
+    test_spatialfilter_benchmark()
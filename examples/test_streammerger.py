@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Merge of two amplifiers with different rates and a drifting clock.
+
+Two NoiseGenerators stand for the amplifiers: 32 channels at 1 kHz (the
+master) and 8 channels at 500 Hz running 200 ppm fast. The StreamMerger
+output is checked for its rate and the drift estimated is printed every
+5 s. The cost of the fractional-delay interpolation is measured apart.
+"""
+
+import time
+
+import numpy as np
+from pyqtgraph.Qt import QtCore
+
+from pyacq_ext.noisegenerator import NoiseGenerator
+from pyacq_ext.streammerger import StreamMerger, interpolate
+
+DURATION = 30.
+DRIFT = 200e-6
+
+
+def test_streammerger():
+    app = QtCore.QCoreApplication([])
+
+    amps = []
+    for sample_rate, nb_channel, speed in ((1000., 32, 1.), (500., 8, 1. + DRIFT)):
+        ng = NoiseGenerator()
+        ng.configure(nb_channel=nb_channel, sample_rate=sample_rate, chunksize=int(sample_rate / 50),
+                     templates={'S  1': np.hanning(50)}, trigger_interval=0.5, speed=speed)
+        for name in ('signals', 'triggers'):
+            ng.outputs[name].configure(protocol='tcp', interface='127.0.0.1', transfermode='plaindata')
+        ng.initialize()
+        amps.append(ng)
+
+    merger = StreamMerger()
+    merger.configure(nb_stream=2, drift_tau=10., warmup=2.)
+    for i, ng in enumerate(amps):
+        merger.inputs['signals{}'.format(i)].connect(ng.outputs['signals'])
+        merger.inputs['triggers{}'.format(i)].connect(ng.outputs['triggers'])
+    for name in ('signals', 'triggers'):
+        merger.outputs[name].configure(protocol='tcp', interface='127.0.0.1', transfermode='plaindata')
+    merger.initialize()
+
+    def report():
+        drift = merger.get_drift()[1]
+        print('{:5.1f} s: drift {:7.1f} ppm (true {:.0f}), {} samples out'.format(
+            time.perf_counter() - t_start, drift, DRIFT * 1e6, merger.head))
+
+    timer = QtCore.QTimer(interval=5000)
+    timer.timeout.connect(report)
+
+    merger.start()
+    for ng in amps:
+        ng.start()
+    t_start = time.perf_counter()
+    timer.start()
+    QtCore.QTimer.singleShot(int(DURATION * 1000), app.quit)
+    app.exec_()
+    for ng in amps:
+        ng.stop()
+    merger.stop()
+    report()
+    print('output shape (-1, {}), {:.1f} samples/s'.format(
+        merger.outputs['signals'].spec['nb_channel'], merger.head / DURATION))
+
+    data = np.random.randn(10000, 40).astype('float32')
+    x = np.linspace(1, 9990, 20) + 0.37
+    t0 = time.perf_counter()
+    for _ in range(1000):
+        interpolate(data, x)
+    print('interpolation of a 20 samples x 40 channels chunk: {:.1f} us'.format(
+        (time.perf_counter() - t0) * 1e3))
+
+
+if __name__ == '__main__':
+    test_streammerger()
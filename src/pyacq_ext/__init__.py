@@ -1,11 +1,27 @@
 # -*- coding: utf-8 -*-
-from pkg_resources import get_distribution, DistributionNotFound
+# The nodes are in submodules, import them as `pyacq_ext.<module>`. Importing
+# the package itself loads nothing, the version is looked up on first access.
 
-try:
-    # Change here if project is renamed and does not equal the package name
-    dist_name = __name__
-    __version__ = get_distribution(dist_name).version
-except DistributionNotFound:
-    __version__ = 'unknown'
-finally:
-    del get_distribution, DistributionNotFound
+
+def __getattr__(name):
+    if name == '__version__':
+        try:
+            from importlib.metadata import version, PackageNotFoundError
+        except ImportError:
+            # Python < 3.8
+            try:
+                from importlib_metadata import version, PackageNotFoundError
+            except ImportError:
+                version = None
+        if version is None:
+            value = 'unknown'
+        else:
+            try:
+                # Change here if project is renamed and does not equal the package name
+                dist_name = __name__
+                value = version(dist_name)
+            except PackageNotFoundError:
+                value = 'unknown'
+        globals()['__version__'] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
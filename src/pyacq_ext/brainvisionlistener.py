@@ -2,66 +2,298 @@
 # Copyright (c) 2016, French National Center for Scientific Research (CNRS)
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
+import asyncio
+import logging
 import socket
 import struct
+import threading
 import time
 
 import numpy as np
-from pyqtgraph.Qt import QtCore, QtGui
-from pyqtgraph.util.mutex import Mutex
 
 from pyacq.core import Node, register_node_type
 
-_dtype_trigger = [('pos', 'int64'),
-                ('points', 'int64'),
-                ('channel', 'int64'),
-                ('type', 'S16'),  # TODO check size
-                ('description', 'S16'),  # TODO check size
-                ]
+from .metrics import get_registry, node_label, perf_counter_ns
+from .runtime import AsyncTask, Mutex, QThread, pyqtSignal
+from .triggers import empty_triggers, make_gap_trigger, trigger_output_spec
+
+logger = logging.getLogger(__name__)
 
 
 def recv_brainamp_frame(brainamp_socket, reqsize):
     buf =b''
-    n = 0
     while len(buf) < reqsize:
-        newbytes = brainamp_socket.recv(reqsize - n)
-        if newbytes == '':
-            raise RuntimeError('connection broken')
+        newbytes = brainamp_socket.recv(reqsize - len(buf))
+        if newbytes == b'':
+            raise ConnectionError('connection broken')
         buf = buf+newbytes
-        n += len(buf)
-
-    if len(buf)>=reqsize:
-        buf = buf[:reqsize]
     return buf
 
 
-class BrainAmpThread(QtCore.QThread):
-
-    sig_new_chunk = QtCore.pyqtSignal(int)
+def drain_rda_messages(brainamp_socket, timeout=1.):
+    """Read and discard the messages waiting in the socket, return their number.
 
-    def __init__(self, outputs, brainamp_host, brainamp_port, nb_channel, resolutions, parent=None):
-        QtCore.QThread.__init__(self)
+    A message cut by the end of the socket buffer is read up to its end,
+    waiting at most `timeout` s for it. A message size shorter than its
+    header raises ValueError, the stream is then out of sync.
+    """
+    buf = bytearray()
+    brainamp_socket.setblocking(False)
+    try:
+        while True:
+            try:
+                data = brainamp_socket.recv(65536)
+            except BlockingIOError:
+                break
+            if not data:
+                raise ConnectionError('connection broken')
+            buf += data
+    finally:
+        brainamp_socket.settimeout(timeout)
+    try:
+        nb_message = 0
+        pos = 0
+        while pos < len(buf):
+            if len(buf) - pos < 24:
+                buf += recv_brainamp_frame(brainamp_socket, pos + 24 - len(buf))
+            msgsize, = struct.unpack('<L', buf[pos + 16:pos + 20])
+            if msgsize < 24:
+                raise ValueError('Invalid BrainAmp message size {}'.format(msgsize))
+            if len(buf) - pos < msgsize:
+                buf += recv_brainamp_frame(brainamp_socket, pos + msgsize - len(buf))
+            pos += msgsize
+            nb_message += 1
+    finally:
+        brainamp_socket.settimeout(None)
+    return nb_message
+
+
+def parse_rda_header(rawdata):
+    """Return nb_channel, sample_rate, resolutions and channel_names of a header message"""
+    nb_channel, sample_interval = struct.unpack('<Ld', rawdata[:12])
+    n = nb_channel
+    sample_rate = 1./(sample_interval*1e-6)
+    resolutions = np.array(struct.unpack('<'+'d'*n, rawdata[12:12+8*n]), dtype='f')
+    channel_names = rawdata[12+8*n:].decode().split('\x00')[:-1]
+    return nb_channel, sample_rate, resolutions, channel_names
+
+
+class RDADecoder:
+    """Decode the RDA messages of the Vision recorder and send them on the outputs.
+
+    Shared by the transports reading the socket, which call
+    :meth:`process_message` for each message.
+
+    A header (sent again when the recorder restarts or on a reconnection)
+    must match the configured layout. Blocks missing according to the
+    `block` counter, or to the time elapsed when the counter restarted, are
+    filled with `gap_fill` ('nan' or 'zero') so the sample index of the
+    outputs stays in time with the amplifier, and announced by a gap
+    trigger (see :func:`triggers.make_gap_trigger`).
+
+    At most `max_gap` samples are filled for one gap, 10 s of signal by
+    default, sent in chunks of at most `gap_chunksize` samples. Beyond that,
+    after a long outage for instance, the rest of the gap is skipped and the
+    sample index of the outputs falls behind the amplifier by it.
+    """
+    hs = 12
+    fill_values = {'nan': np.nan, 'zero': 0.}
+    gap_chunksize = 4096
+
+    def init_decoder(self, outputs, nb_channel, resolutions, sample_rate=None, channel_names=None,
+                     gap_fill='zero', parent=None, max_gap=None):
+        if gap_fill not in self.fill_values:
+            raise ValueError('Unknown gap_fill {}'.format(gap_fill))
+        if max_gap is None:
+            max_gap = int(10. * sample_rate) if sample_rate else 10000
         self.outputs = outputs
-        self.brainamp_host= brainamp_host
-        self.brainamp_port= brainamp_port
         self.nb_channel = nb_channel
         self.resolutions = resolutions
+        self.sample_rate = sample_rate
+        self.channel_names = channel_names
+        self.gap_fill = gap_fill
+        self.max_gap = max_gap
+        self.dt = np.dtype('float32')
+        self.head = 0
+        self.head_marker = 0
+        self.last_block = None
+        self.last_points = 0
+        self.t_last_block = None
+
+        registry = get_registry()
+        node = node_label(parent)
+        self.nb_block = registry.counter('pyacq_ext_brainamp_blocks_total', node=node)
+        self.nb_sample = registry.counter('pyacq_ext_brainamp_samples_total', node=node)
+        self.nb_marker = registry.counter('pyacq_ext_brainamp_markers_total', node=node)
+        self.block_latency = registry.histogram('pyacq_ext_brainamp_block_seconds', node=node)
+        self.nb_gap = registry.counter('pyacq_ext_brainamp_gaps_total', node=node)
+        self.nb_lost_sample = registry.counter('pyacq_ext_brainamp_lost_samples_total', node=node)
+
+    def process_message(self, msgtype, rawdata):
+        # msgtype == 2 (int16 data) is not sent by the recorder in float mode
+        if msgtype == 4:
+            self.process_block(rawdata)
+        elif msgtype == 1:
+            self.process_header(rawdata)
+        elif msgtype == 3:
+            logger.info('BrainAmp recording stopped')
+
+    def process_header(self, rawdata):
+        nb_channel, sample_rate, resolutions, channel_names = parse_rda_header(rawdata)
+        if nb_channel != self.nb_channel or \
+                (self.sample_rate is not None and sample_rate != self.sample_rate) or \
+                (self.channel_names is not None and channel_names != self.channel_names):
+            raise ValueError('BrainAmp header ({} channels at {} Hz) does not match the configured '
+                             'layout ({} channels at {} Hz)'.format(nb_channel, sample_rate,
+                                                                    self.nb_channel, self.sample_rate))
+        self.resolutions = resolutions
+
+    def process_block(self, rawdata):
+        t0 = perf_counter_ns()
+        hs = self.hs
+
+        # Extract numerical data
+        block, points, nb_marker = struct.unpack('<LLL', rawdata[:hs])
+        if self.last_block is not None and block != self.last_block + 1:
+            self.fill_gap(self.count_missing(block))
+        self.last_block = block
+        self.last_points = points
+        self.t_last_block = time.perf_counter()
+
+        sigsize = self.dt.itemsize * points * self.nb_channel
+        sigs = np.frombuffer(rawdata[hs:hs+sigsize], dtype=self.dt)
+        sigs = sigs.reshape(points, self.nb_channel)
+        self.head += points
+        sigs = sigs * self.resolutions[np.newaxis,:]
+        self.outputs['signals'].send(sigs, index=self.head)
+
+        # Extract markers
+        markers = empty_triggers(nb_marker)
+        index = hs + sigsize
+        for m in range(nb_marker):
+            markersize, = struct.unpack('<L', rawdata[index:index+4])
+            markers['pos'][m], markers['points'][m],markers['channel'][m] = struct.unpack('<LLl', rawdata[index+4:index+16])
+            markers['type'][m], markers['description'][m] = rawdata[index+16:index+markersize].split(b'\x00')[:2]
+            index = index + markersize
+        self.head_marker += nb_marker
+        markers['pos'] += (self.head - points)
+        self.outputs['triggers'].send(markers, index=nb_marker)
+
+        self.nb_block.inc()
+        self.nb_sample.inc(points)
+        self.nb_marker.inc(nb_marker)
+        self.block_latency.record_since(t0)
+
+    def count_missing(self, block):
+        """Number of samples lost before `block`"""
+        if block > self.last_block:
+            return (block - self.last_block - 1) * self.last_points
+        # the counter restarted with the recording, estimate from the time
+        if self.sample_rate is None:
+            return 0
+        elapsed = time.perf_counter() - self.t_last_block
+        return max(int(round(elapsed * self.sample_rate)) - self.last_points, 0)
+
+    def fill_gap(self, nb_sample):
+        if nb_sample <= 0:
+            return
+        self.nb_gap.inc()
+        self.nb_lost_sample.inc(nb_sample)
+        nb_fill = min(nb_sample, self.max_gap)
+        if nb_fill < nb_sample:
+            logger.warning('BrainAmp: %i samples lost after block %i, %i filled with %s, the '
+                           'stream is %i samples behind', nb_sample, self.last_block, nb_fill,
+                           self.gap_fill, nb_sample - nb_fill)
+        else:
+            logger.warning('BrainAmp: %i samples lost after block %i, filled with %s',
+                           nb_sample, self.last_block, self.gap_fill)
+        if nb_fill == 0:
+            return
+        # the trigger goes first, so the epochs overlapping the gap are known lost
+        self.outputs['triggers'].send(make_gap_trigger(self.head, nb_fill), index=1)
+        for i in range(0, nb_fill, self.gap_chunksize):
+            size = min(self.gap_chunksize, nb_fill - i)
+            # a new array per send, the outputs may not copy it
+            sigs = np.full((size, self.nb_channel), self.fill_values[self.gap_fill], dtype=self.dt)
+            self.head += size
+            self.outputs['signals'].send(sigs, index=self.head)
+
+
+class BrainAmpThread(QThread, RDADecoder):
+    """Read the RDA stream in a thread.
+
+    `brainamp_socket`, a connection whose header was already read, is
+    streamed first. When the connection breaks it is opened again, waiting
+    from `backoff_min` s up to `backoff_max` s between the attempts. A
+    header which does not match the configured layout stops the thread.
+    """
+    sig_new_chunk = pyqtSignal(int)
+
+    def __init__(self, outputs, brainamp_host, brainamp_port, nb_channel, resolutions, parent=None,
+                 sample_rate=None, channel_names=None, gap_fill='zero', reconnect=True,
+                 backoff_min=0.1, backoff_max=10., brainamp_socket=None, max_gap=None):
+        QThread.__init__(self)
+        self.init_decoder(outputs, nb_channel, resolutions, sample_rate=sample_rate,
+                          channel_names=channel_names, gap_fill=gap_fill, parent=parent,
+                          max_gap=max_gap)
+        self.brainamp_host= brainamp_host
+        self.brainamp_port= brainamp_port
+        self.reconnect = reconnect
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+
+        self.initial_socket = brainamp_socket
 
         self.lock = Mutex()
         self.running = False
+        self.brainamp_socket = None
+        self.stop_event = threading.Event()
 
         self.parent = parent
 
     def run(self):
-        brainamp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        brainamp_socket.connect((self.brainamp_host, self.brainamp_port))
         with self.lock:
             self.running = True
+        self.stop_event.clear()
 
-        dt = np.dtype('float32')
+        backoff = self.backoff_min
+        while True:
+            with self.lock:
+                if not self.running:
+                    break
+            if self.initial_socket is not None:
+                brainamp_socket, self.initial_socket = self.initial_socket, None
+            else:
+                try:
+                    brainamp_socket = socket.create_connection((self.brainamp_host, self.brainamp_port))
+                except OSError as e:
+                    logger.warning('BrainAmp connection failed (%s), retry in %.1f s', e, backoff)
+                    if not self.reconnect or self.stop_event.wait(backoff):
+                        break
+                    backoff = min(backoff * 2, self.backoff_max)
+                    continue
 
-        head = 0
-        head_marker = 0
+            with self.lock:
+                self.brainamp_socket = brainamp_socket
+            backoff = self.backoff_min
+            try:
+                self.read_messages(brainamp_socket)
+            except OSError as e:
+                with self.lock:
+                    if not self.running:
+                        break
+                logger.warning('BrainAmp connection lost (%s), reconnecting', e)
+                if not self.reconnect:
+                    break
+            except ValueError:
+                logger.exception('BrainAmp stream stopped')
+                break
+            finally:
+                with self.lock:
+                    self.brainamp_socket = None
+                brainamp_socket.close()
+
+    def read_messages(self, brainamp_socket):
         while True:
             with self.lock:
                     if not self.running:
@@ -71,38 +303,83 @@ class BrainAmpThread(QtCore.QThread):
             (id1, id2, id3, id4, msgsize, msgtype) = struct.unpack('<llllLL', buf_header)
 
             rawdata = recv_brainamp_frame(brainamp_socket, msgsize - 24)
-           
-            # TODO  msgtype == 3 (msgtype == 1 is header done in Node.configure)
-            if msgtype == 4:
-                #~ block, chunk, markers = get_signal_and_markers(rawdata, self.nb_channel)
-                hs = 12
-
-                # Extract numerical data
-                block, points, nb_marker = struct.unpack('<LLL', rawdata[:hs])
-                sigsize = dt.itemsize * points * self.nb_channel
-                sigs = np.frombuffer(rawdata[hs:hs+sigsize], dtype=dt)
-                sigs = sigs.reshape(points, self.nb_channel)
-                head += points
-                sigs = sigs * self.resolutions[np.newaxis,:]
-                self.outputs['signals'].send(sigs, index=head)
-                
-                # Extract markers
-                markers = np.empty((nb_marker,), dtype=_dtype_trigger)
-                index = hs + sigsize
-                for m in range(nb_marker):
-                    markersize, = struct.unpack('<L', rawdata[index:index+4])
-                    markers['pos'][m], markers['points'][m],markers['channel'][m] = struct.unpack('<LLl', rawdata[index+4:index+16])
-                    markers['type'][m], markers['description'][m] = rawdata[index+16:index+markersize].split(b'\x00')[:2]
-                    index = index + markersize
-                head_marker += nb_marker
-                markers['pos'] += (head - points)
-                self.outputs['triggers'].send(markers, index=nb_marker)
-
-        brainamp_socket.close()
+            self.process_message(msgtype, rawdata)
 
     def stop(self):
         with self.lock:
             self.running = False
+            self.stop_event.set()
+            # unblock recv
+            if self.brainamp_socket is not None:
+                try:
+                    self.brainamp_socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class AsyncBrainAmpReader(AsyncTask, RDADecoder):
+    """Read the RDA stream with asyncio streams on the shared event loop.
+
+    Same decoding and reconnection as :class:`BrainAmpThread`, but the
+    socket is served by the loop of :func:`runtime.get_event_loop_thread`,
+    so several listeners need no thread each.
+    """
+    def __init__(self, outputs, brainamp_host, brainamp_port, nb_channel, resolutions, parent=None,
+                 sample_rate=None, channel_names=None, gap_fill='zero', reconnect=True,
+                 backoff_min=0.1, backoff_max=10., brainamp_socket=None, max_gap=None):
+        AsyncTask.__init__(self)
+        self.init_decoder(outputs, nb_channel, resolutions, sample_rate=sample_rate,
+                          channel_names=channel_names, gap_fill=gap_fill, parent=parent,
+                          max_gap=max_gap)
+        self.brainamp_host = brainamp_host
+        self.brainamp_port = brainamp_port
+        self.initial_socket = brainamp_socket
+        self.reconnect = reconnect
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.running = False
+
+    async def serve(self):
+        self.running = True
+        backoff = self.backoff_min
+        try:
+            while True:
+                try:
+                    if self.initial_socket is not None:
+                        brainamp_socket, self.initial_socket = self.initial_socket, None
+                        reader, writer = await asyncio.open_connection(sock=brainamp_socket)
+                    else:
+                        reader, writer = await asyncio.open_connection(self.brainamp_host,
+                                                                       self.brainamp_port)
+                except OSError as e:
+                    logger.warning('BrainAmp connection failed (%s), retry in %.1f s', e, backoff)
+                    if not self.reconnect:
+                        break
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, self.backoff_max)
+                    continue
+
+                backoff = self.backoff_min
+                try:
+                    await self.read_messages(reader)
+                except (asyncio.IncompleteReadError, OSError) as e:
+                    logger.warning('BrainAmp connection lost (%s), reconnecting', e)
+                    if not self.reconnect:
+                        break
+                except ValueError:
+                    logger.exception('BrainAmp stream stopped')
+                    break
+                finally:
+                    writer.close()
+        finally:
+            self.running = False
+
+    async def read_messages(self, reader):
+        while True:
+            buf_header = await reader.readexactly(24)
+            (id1, id2, id3, id4, msgsize, msgtype) = struct.unpack('<llllLL', buf_header)
+            rawdata = await reader.readexactly(msgsize - 24)
+            self.process_message(msgtype, rawdata)
 
 
 class BrainVisionListener(Node):
@@ -111,19 +388,23 @@ class BrainVisionListener(Node):
 
     This class is a bridge between pyacq and the socket-based data streaming
     provided by the Vision recorder acquisition software.
+
+    The `signals` output can be configured with `transfermode='sharedmemory'`
+    so local consumers read the ring buffer without a copy per consumer.
     """
     _output_specs = {'signals': dict(streamtype='analogsignal',dtype='float32',
                                                 shape=(-1, 32), compression ='', timeaxis=0,
                                                 sample_rate = 512.),
-                                'triggers': dict(streamtype = 'event', dtype = _dtype_trigger,
-                                                shape = (-1,)),
+                                'triggers': trigger_output_spec(),
                                 }
 
 
     def __init__(self, **kargs):
         Node.__init__(self, **kargs)
 
-    def _configure(self, brainamp_host='localhost', brainamp_port=51244):
+    def _configure(self, brainamp_host='localhost', brainamp_port=51244, buffer_duration=10.,
+                   transport='thread', reconnect=True, backoff_max=10., gap_fill='zero',
+                   connect_timeout=5.):
         '''
         Parameters
         ----------
@@ -131,34 +412,74 @@ class BrainVisionListener(Node):
             address used by Vision recorder to send data. Default is 'localhost'.
         brainamp_port : int
             port used by Brain Vision recorder. Default is 51244.
+        buffer_duration : float
+            Duration in s of the shared memory ring buffer of `signals`.
+        transport : str
+            'thread' reads the socket in a thread of the node, 'asyncio' on
+            the event loop shared by the asyncio transports of the process,
+            see :class:`AsyncBrainAmpReader`. Default is 'thread'.
+        reconnect : bool
+            Open the connection again when it breaks, for instance when the
+            recorder restarts. Default is True.
+        backoff_max : float
+            Maximum delay in s between two connection attempts, the delay
+            doubles from 0.1 s. Default is 10.
+        gap_fill : str
+            Value of the samples lost in a dropped connection or block,
+            'zero' or 'nan'. NaN marks them clearly but stays in the state
+            of the IIR filters downstream. At most `buffer_duration` s are
+            filled for one gap. Default is 'zero'.
+        connect_timeout : float
+            Time in s allowed to connect and receive the header. The
+            connection is kept and streamed by the node, the blocks sent
+            before `start` are discarded. Default is 5.
         '''
+        assert transport in ('thread', 'asyncio'), 'Unknown transport {}'.format(transport)
+        assert gap_fill in RDADecoder.fill_values, 'Unknown gap_fill {}'.format(gap_fill)
+        self.transport = transport
+        self.reconnect = reconnect
+        self.backoff_max = backoff_max
+        self.gap_fill = gap_fill
+        self.buffer_duration = buffer_duration
         self.brainamp_host = brainamp_host
         self.brainamp_port = brainamp_port
 
-        # recv header from brain amp
-        brainamp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        brainamp_socket.connect((self.brainamp_host, self.brainamp_port))
-        buf_header = recv_brainamp_frame(brainamp_socket, 24)
-        id1, id2, id3, id4, msgsize, msgtype = struct.unpack('<llllLL', buf_header)
-        rawdata = recv_brainamp_frame(brainamp_socket, msgsize - 24)
-        assert msgtype == 1, 'First message from brainamp is not type 1'
-        self.nb_channel, sample_interval = struct.unpack('<Ld', rawdata[:12])
-        n = self.nb_channel
-        sample_interval = sample_interval*1e-6
-        self.sample_rate = 1./sample_interval
-        self.resolutions = np.array(struct.unpack('<'+'d'*n, rawdata[12:12+8*n]), dtype='f')
-        self.channel_names = rawdata[12+8*n:].decode().split('\x00')[:-1]
+        # connection of a previous configure
+        self._close()
+        # recv header from brain amp, the connection is then used for the stream
+        brainamp_socket = socket.create_connection((self.brainamp_host, self.brainamp_port),
+                                                   timeout=connect_timeout)
+        try:
+            buf_header = recv_brainamp_frame(brainamp_socket, 24)
+            id1, id2, id3, id4, msgsize, msgtype = struct.unpack('<llllLL', buf_header)
+            rawdata = recv_brainamp_frame(brainamp_socket, msgsize - 24)
+            assert msgtype == 1, 'First message from brainamp is not type 1'
+        except BaseException:
+            brainamp_socket.close()
+            raise
+        brainamp_socket.settimeout(None)
+        self.brainamp_socket = brainamp_socket
+        self.nb_channel, self.sample_rate, self.resolutions, self.channel_names = \
+            parse_rda_header(rawdata)
         #~ self.channel_indexes = range(nb_channel)
-        brainamp_socket.close()
 
         self.outputs['signals'].spec['shape'] = (-1, self.nb_channel)
         self.outputs['signals'].spec['sample_rate'] = self.sample_rate
         self.outputs['signals'].spec['nb_channel'] = self.nb_channel
+        self.outputs['signals'].spec['buffer_size'] = int(buffer_duration * self.sample_rate)
+        self.outputs['signals'].spec['double'] = True
 
     def _initialize(self):
-        self._thread = BrainAmpThread(self.outputs, self.brainamp_host, self.brainamp_port,
-                             self.nb_channel, self.resolutions, parent=self)
-        
+        reader_class = AsyncBrainAmpReader if self.transport == 'asyncio' else BrainAmpThread
+        self._thread = reader_class(self.outputs, self.brainamp_host, self.brainamp_port,
+                                    self.nb_channel, self.resolutions, parent=self,
+                                    sample_rate=self.sample_rate,
+                                    channel_names=self.channel_names, gap_fill=self.gap_fill,
+                                    reconnect=self.reconnect, backoff_max=self.backoff_max,
+                                    brainamp_socket=self.brainamp_socket,
+                                    max_gap=int(self.buffer_duration * self.sample_rate))
+        # the reader owns the header connection now
+        self.brainamp_socket = None
 
     def after_output_configure(self, outputname):
         if outputname == 'signals':
@@ -167,6 +488,16 @@ class BrainVisionListener(Node):
 
     def _start(self):
         self.chunkIndex = 0
+        brainamp_socket = self._thread.initial_socket
+        if brainamp_socket is not None:
+            # the blocks sent since configure are stale, not live
+            try:
+                nb_message = drain_rda_messages(brainamp_socket)
+                logger.info('BrainAmp: %i messages sent before start discarded', nb_message)
+            except (OSError, ValueError) as e:
+                logger.warning('BrainAmp connection lost before start (%s), reconnecting', e)
+                brainamp_socket.close()
+                self._thread.initial_socket = None
         self._thread.start()
 
     def _stop(self):
@@ -174,7 +505,13 @@ class BrainVisionListener(Node):
         self._thread.wait()
 
     def _close(self):
-        pass
+        # the header connection, of configure or of a reader never started
+        if getattr(self, 'brainamp_socket', None) is not None:
+            self.brainamp_socket.close()
+            self.brainamp_socket = None
+        if getattr(self, '_thread', None) is not None and self._thread.initial_socket is not None:
+            self._thread.initial_socket.close()
+            self._thread.initial_socket = None
 
     
 
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Classifier pool node
+
+Runs a user supplied `predict(stock)` function in a pool of processes so a
+heavy model never blocks the Qt thread hosting the epocher. Each stock is
+copied once into a shared memory slot and the worker maps the same memory,
+only the slot name and the shape travel through the pool pipe. Before
+Python 3.8, which has no `multiprocessing.shared_memory`, the stocks are
+pickled through the pipe instead.
+
+Results are delivered in submission order by a thread, which waits at most
+`timeout` s for each one, and can be routed to
+:meth:`eventpoller.EventPoller.send_result`.
+
+"""
+import concurrent.futures
+import logging
+import multiprocessing
+import queue
+import threading
+from collections import deque
+
+import numpy as np
+
+from pyacq.core import Node, register_node_type
+
+from .metrics import get_registry, node_label, perf_counter_ns
+from .runtime import QObject, pyqtSignal
+
+logger = logging.getLogger(__name__)
+
+try:
+    from multiprocessing import shared_memory
+    HAVE_SHARED_MEMORY = True
+except ImportError:
+    HAVE_SHARED_MEMORY = False
+
+_predict = None
+
+
+def _init_worker(predict):
+    global _predict
+    _predict = predict
+
+
+def _ready():
+    return True
+
+
+def _run_predict(shm_name, shape, dtype):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    stock = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    try:
+        return _predict(stock)
+    finally:
+        del stock
+        shm.close()
+
+
+def _run_predict_copy(stock):
+    return _predict(stock)
+
+
+class SharedSlot:
+    """Shared memory block reused for the stocks sent to the workers."""
+    def __init__(self):
+        self.shm = None
+
+    def write(self, stock):
+        if self.shm is None or self.shm.size < stock.nbytes:
+            self.release()
+            self.shm = shared_memory.SharedMemory(create=True, size=max(stock.nbytes, 1))
+        np.ndarray(stock.shape, dtype=stock.dtype, buffer=self.shm.buf)[...] = stock
+        return self.shm.name
+
+    def release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class ClassifierPool(Node, QObject):
+    """Node running a classifier on the stocks of an EpocherMultiLabel.
+
+    This Node have no stream input or output, connect it to an epocher (or a
+    :class:`spatialfilter.SpatialFilter`) with :meth:`connect_epocher`. For
+    each stock, `new_result` is emitted with the label, the
+    additionalInformation and the value returned by `predict`, in the order
+    the stocks were received. The result is None if predict failed or timed
+    out.
+    """
+    _input_specs = {}
+    _output_specs = {}
+
+    new_result = pyqtSignal(str, str, object)
+
+    def __init__(self, parent=None, **kargs):
+        QObject.__init__(self, parent)
+        Node.__init__(self, **kargs)
+
+    def _configure(self, predict, nb_worker=2, timeout=1., max_pending=16, start_method='spawn'):
+        """
+        Parameters
+        ----------
+        predict : callable
+            Picklable function (defined at module level) called in a worker
+            process with a stock array (max_stock, ...), its return value is
+            the result. The array is only valid during the call.
+        nb_worker : int
+            Number of worker processes.
+        timeout : float
+            Maximum time in s between the reception of a stock and its
+            result, a late result is dropped.
+        max_pending : int
+            Maximum number of stocks in the pool, new stocks are dropped
+            when it is reached.
+        start_method : str
+            multiprocessing start method of the workers. 'spawn' is safe
+            with the threads of the Qt process.
+        """
+        self.predict = predict
+        self.nb_worker = nb_worker
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.start_method = start_method
+
+    def _initialize(self):
+        self.executor = None
+        self.free_slots = queue.Queue()
+        self.slots = [SharedSlot() for _ in range(self.max_pending)]
+        for slot in self.slots:
+            self.free_slots.put(slot)
+        self.pending = deque()
+        self.pending_event = threading.Event()
+        self.result_sink = None
+
+        registry = get_registry()
+        node = node_label(self)
+        self.latency = registry.histogram('pyacq_ext_classifier_latency_seconds', node=node)
+        self.nb_submitted = registry.counter('pyacq_ext_classifier_submitted_total', node=node)
+        self.nb_result = registry.counter('pyacq_ext_classifier_results_total', node=node)
+        self.nb_dropped = registry.counter('pyacq_ext_classifier_dropped_total', node=node)
+        self.nb_timeout = registry.counter('pyacq_ext_classifier_timeouts_total', node=node)
+        self.nb_error = registry.counter('pyacq_ext_classifier_errors_total', node=node)
+        self.nb_pending = registry.gauge('pyacq_ext_classifier_pending', node=node)
+
+    def _start(self):
+        context = multiprocessing.get_context(self.start_method)
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.nb_worker, mp_context=context,
+            initializer=_init_worker, initargs=(self.predict, ))
+        # start the workers now, not on the first stock
+        for future in [self.executor.submit(_ready) for _ in range(self.nb_worker)]:
+            future.result()
+        self.running = True
+        self.thread = threading.Thread(target=self._deliver, name='ClassifierPool', daemon=True)
+        self.thread.start()
+
+    def _stop(self):
+        self.running = False
+        self.pending_event.set()
+        self.thread.join()
+        executor, self.executor = self.executor, None
+        # shutdown(cancel_futures=True) needs Python 3.9
+        for future, label, additionalInformation, t_start in self.pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        self.pending.clear()
+
+    def _close(self):
+        for slot in self.slots:
+            slot.release()
+
+    def connect_epocher(self, epocher):
+        epocher.new_chunk.connect(self.on_new_chunk)
+
+    def connect_eventpoller(self, eventpoller, format_result=str, timeout_frame=None):
+        """Send each result to the game with `eventpoller.send_result`.
+
+        `format_result(result)` returns the frame sent. When predict returns
+        None, fails or is too late, `timeout_frame` is sent instead if it is
+        not None, so the game does not wait for a result forever.
+        """
+        def sink(label, additionalInformation, result):
+            if result is not None:
+                eventpoller.send_result(format_result(result))
+            elif timeout_frame is not None:
+                eventpoller.send_result(timeout_frame)
+        self.result_sink = sink
+
+    def on_new_chunk(self, label, additionalInformation, stock):
+        t_start = perf_counter_ns()
+        executor = self.executor
+        if executor is None:
+            # stopped, the epocher may still emit
+            return
+        try:
+            slot = self.free_slots.get_nowait()
+        except queue.Empty:
+            self.nb_dropped.inc()
+            logger.warning("ClassifierPool: %i stocks pending, stock of %s dropped",
+                           self.max_pending, label)
+            return
+
+        try:
+            if HAVE_SHARED_MEMORY:
+                name = slot.write(stock)
+                future = executor.submit(_run_predict, name, stock.shape, stock.dtype.str)
+            else:
+                # pickled later by the pool thread, the epocher reuses its stock
+                future = executor.submit(_run_predict_copy, stock.copy())
+        except RuntimeError:
+            # shut down meanwhile
+            self.free_slots.put(slot)
+            return
+        # the slot is only reused once its worker is done, even after a timeout
+        future.add_done_callback(lambda f, slot=slot: self.free_slots.put(slot))
+        self.pending.append((future, label, additionalInformation, t_start))
+        self.nb_submitted.inc()
+        self.nb_pending.set(len(self.pending))
+        self.pending_event.set()
+
+    def _deliver(self):
+        while self.running:
+            if not self.pending:
+                self.pending_event.wait()
+                self.pending_event.clear()
+                continue
+
+            future, label, additionalInformation, t_start = self.pending[0]
+            remaining = (t_start - perf_counter_ns()) * 1e-9 + self.timeout
+            try:
+                result = future.result(timeout=max(remaining, 0.))
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                self.nb_timeout.inc()
+                logger.warning("ClassifierPool: result of %s later than %.3f s", label, self.timeout)
+                result = None
+            except Exception:
+                self.nb_error.inc()
+                logger.exception("ClassifierPool: predict failed on %s", label)
+                result = None
+            else:
+                self.latency.record_since(t_start)
+                self.nb_result.inc()
+            self.pending.popleft()
+            self.nb_pending.set(len(self.pending))
+
+            if self.result_sink is not None:
+                self.result_sink(label, additionalInformation, result)
+            self.new_result.emit(label, additionalInformation, result)
+
+    def get_stats(self):
+        """Return the counters and the latency percentiles (s) of the pool"""
+        return {
+            'submitted': self.nb_submitted.value,
+            'result': self.nb_result.value,
+            'dropped': self.nb_dropped.value,
+            'timeout': self.nb_timeout.value,
+            'error': self.nb_error.value,
+            'pending': len(self.pending),
+            'latency': self.latency.to_dict(),
+        }
+
+
+register_node_type(ClassifierPool)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Command bus
+
+Carries the control messages of the game (reset, session start, trigger
+setup...) out of the EventPoller thread. Publishing only puts a command in
+a bounded queue, subscribers run on the bus worker threads, so a slow
+subscriber never delays the trigger path. The bus does not depend on Qt.
+
+"""
+import logging
+import queue
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+
+class Reset(namedtuple('Reset', ['session'])):
+    """The game asked to reset the pipeline"""
+
+
+class StartSession(namedtuple('StartSession', ['session', 'content'])):
+    """The game started a new session"""
+
+
+class TriggerSetup(namedtuple('TriggerSetup', ['session', 'content'])):
+    """The game sent its trigger setup"""
+
+
+class Setting(namedtuple('Setting', ['session', 'content'])):
+    """The game sent a setting"""
+
+
+class ResultRequest(namedtuple('ResultRequest', ['session'])):
+    """The game waits a result"""
+
+
+class Stop(namedtuple('Stop', ['session'])):
+    """The game quit"""
+
+
+_STOP_WORKER = object()
+
+
+class CommandBus:
+    """Bounded queue of commands dispatched to subscribers by worker threads.
+
+    Subscribers are registered per command type. With a single worker
+    (the default) commands are delivered in publish order.
+    """
+    def __init__(self, maxsize=256, nb_worker=1):
+        self._queue = queue.Queue(maxsize)
+        self._subscribers = {}
+        self.nb_worker = nb_worker
+        self._workers = []
+        self.nb_dropped = 0
+
+    def subscribe(self, command_type, callback):
+        """Call `callback(command)` for each published `command_type`"""
+        self._subscribers.setdefault(command_type, []).append(callback)
+
+    def unsubscribe(self, command_type, callback):
+        self._subscribers.get(command_type, []).remove(callback)
+
+    def publish(self, command):
+        """Queue `command`, never blocks.
+
+        Return False if the command was dropped because the queue is full.
+        """
+        try:
+            self._queue.put_nowait(command)
+        except queue.Full:
+            self.nb_dropped += 1
+            logger.warning("Command bus full, %s dropped", type(command).__name__)
+            return False
+        return True
+
+    def start(self):
+        if self._workers:
+            return
+        for i in range(self.nb_worker):
+            worker = threading.Thread(target=self._run, name='CommandBus-{}'.format(i),
+                                      daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        """Stop the workers once the already queued commands are dispatched"""
+        for worker in self._workers:
+            self._queue.put(_STOP_WORKER)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def _run(self):
+        while True:
+            command = self._queue.get()
+            if command is _STOP_WORKER:
+                break
+            for callback in self._subscribers.get(type(command), ()):
+                try:
+                    callback(command)
+                except Exception:
+                    logger.exception("Subscriber failed on %s", command)
@@ -5,15 +5,16 @@
 import numpy as np
 
 from pyacq.core import Node, register_node_type
-from pyqtgraph.Qt import QtCore, QtGui
-from pyqtgraph.util.mutex import Mutex
 
-import struct
 import time
 
 import logging
 logger = logging.getLogger(__name__)
 
+from .metrics import get_registry, node_label, perf_counter_ns
+from .runtime import Mutex, QThread
+from .triggers import make_gap_trigger, trigger_output_spec
+
 try:
     import serial
     HAVE_PYSERIAL = True
@@ -22,30 +23,160 @@ except ImportError:
 
 SAMPLE_RATE = 250.0  # Hz
 _START_BYTE = 0xA0  # start of data packet
-_END_BYTE = 0xC0  # end of data packet
+_END_BYTE = 0xC0  # end of data packet, 0xC0 to 0xCF with the aux formats
+_PACKET_SIZE = 33
 ADS1299_Vref = 4.5  #reference voltage for ADC in ADS1299.  set by its hardware
 ADS1299_gain = 24.0  #assumed gain setting for ADS1299.  set by its Arduino code
 scale_fac_uVolts_per_count = ADS1299_Vref/float((pow(2,23)-1))/ADS1299_gain*1000000.
 scale_fac_accel_G_per_count = 0.002 /(pow(2,4)) #assume set to +/4G, so 2 mG
+MCP3912_Vref = 1.2  # Ganglion ADC
+scale_fac_uVolts_per_count_ganglion = MCP3912_Vref/float((pow(2,23)-1))/1.5/51.*1000000.
+
+# Cyton sample rate commands '~<code>', the dongle radio only carries 250 Hz
+_CYTON_RATE_CODES = {16000.: '0', 8000.: '1', 4000.: '2', 2000.: '3', 1000.: '4', 500.: '5',
+                     250.: '6'}
+_GANGLION_RATE_CODES = {25600.: '0', 12800.: '1', 6400.: '2', 3200.: '3', 1600.: '4', 800.: '5',
+                        400.: '6', 200.: '7'}
+# firmware 3 baud rate commands
+_BAUD_CODES = {115200: b'\xf0\x00', 230400: b'\xf0\x05', 921600: b'\xf0\x06'}
+_CHANNEL_OFF_CODES = '12345678qwertyui'
+_CHANNEL_ON_CODES = '!@#$%^&*QWERTYUI'
+
+
+class BoardProfile:
+    """Packet layout and commands of an OpenBCI board.
+
+    Every board streams 33 bytes packets: start byte, sample ID, 8 slots of
+    3 bytes channel data, 3 aux int16 and end byte. `packet_channel` slots
+    are used, and with `daisy` the odd sample IDs carry the channels 1-8
+    and the next even ones the channels 9-16 of the same sample.
+    """
+    def __init__(self, name, packet_channel, packet_rate, scale, rate_codes, daisy=False):
+        self.name = name
+        self.packet_channel = packet_channel
+        self.packet_rate = packet_rate
+        self.scale = scale
+        self.rate_codes = rate_codes
+        self.daisy = daisy
+        self.packets_per_sample = 2 if daisy else 1
+        self.nb_channel = packet_channel * self.packets_per_sample
+        self.nb_aux = 3
+
+    @property
+    def sample_rate(self):
+        return self.packet_rate / self.packets_per_sample
+
+    def sample_rates(self):
+        return sorted(rate / self.packets_per_sample for rate in self.rate_codes)
+
 
+board_profiles = {
+    'cyton': BoardProfile('Cyton', 8, 250., scale_fac_uVolts_per_count, _CYTON_RATE_CODES),
+    'daisy': BoardProfile('Daisy', 8, 250., scale_fac_uVolts_per_count, _CYTON_RATE_CODES,
+                          daisy=True),
+    'ganglion': BoardProfile('Ganglion', 4, 200., scale_fac_uVolts_per_count_ganglion,
+                             _GANGLION_RATE_CODES),
+}
 
 
-class OpenBCIThread(QtCore.QThread):
-    def __init__(self, outputs, serial_port, nb_channel, nb_aux):
-        QtCore.QThread.__init__(self)
+class PacketDecoder:
+    """Frame and decode the packets of a byte stream, vectorized.
+
+    :meth:`feed` takes the bytes read and returns the complete packets: a
+    run of well framed packets is decoded with a few numpy operations, the
+    stream is only scanned byte per byte to resynchronize after lost bytes.
+    """
+    def __init__(self, profile):
+        self.profile = profile
+        self.buffer = bytearray()
+        self.nb_lost_byte = 0
+
+    def feed(self, data):
+        """Return sample_ids, channels (n, packet_channel), aux (n, 3) and wrong (n,)
+
+        `wrong` flags the packets with a start byte but a wrong end byte,
+        their values are not valid.
+        """
+        self.buffer += data
+        # a copy, the buffer is resized below
+        arr = np.frombuffer(bytes(self.buffer), dtype=np.uint8)
+        pos = 0
+        blocks = []
+        wrong = []
+        while len(arr) - pos >= _PACKET_SIZE:
+            if arr[pos] != _START_BYTE:
+                # resync on the next start byte
+                nxt = np.flatnonzero(arr[pos + 1:] == _START_BYTE)
+                skip = int(nxt[0]) + 1 if nxt.size else len(arr) - pos
+                self.nb_lost_byte += skip
+                pos += skip
+                continue
+            n = (len(arr) - pos) // _PACKET_SIZE
+            packets = arr[pos:pos + n * _PACKET_SIZE].reshape(n, _PACKET_SIZE)
+            bad = np.flatnonzero((packets[:, 0] != _START_BYTE) |
+                                 ((packets[:, -1] & 0xF0) != _END_BYTE))
+            nb_good = bad[0] if bad.size else n
+            if nb_good:
+                blocks.append(packets[:nb_good])
+                wrong.append(np.zeros(nb_good, dtype=bool))
+                pos += nb_good * _PACKET_SIZE
+            if nb_good < n and packets[nb_good, 0] == _START_BYTE:
+                blocks.append(packets[nb_good:nb_good + 1])
+                wrong.append(np.ones(1, dtype=bool))
+                pos += _PACKET_SIZE
+        rows = np.concatenate(blocks) if blocks else np.zeros((0, _PACKET_SIZE), dtype=np.uint8)
+        wrong = np.concatenate(wrong) if wrong else np.zeros(0, dtype=bool)
+        del self.buffer[:pos]
+        return self.decode(rows) + (wrong, )
+
+    def decode(self, rows):
+        """Decode packets (n, 33) to sample_ids, channels and aux"""
+        nb_slot = self.profile.packet_channel
+        raw = rows[:, 2:2 + 3 * nb_slot].reshape(-1, nb_slot, 3).astype(np.int32)
+        # 3 bytes big endian ints in 2s complement
+        values = (raw[:, :, 0] << 16) | (raw[:, :, 1] << 8) | raw[:, :, 2]
+        values = (values ^ 0x800000) - 0x800000
+        chans = (values * self.profile.scale).astype(np.float32)
+        aux = np.ascontiguousarray(rows[:, 26:32]).view('>i2').astype(np.float32)
+        return rows[:, 1].astype(np.int64), chans, aux
+
+
+class OpenBCIThread(QThread):
+    """Read the packets of the board.
+
+    The bytes available are read at once and decoded by a
+    :class:`PacketDecoder`. The sample ID of the packets (0-255) is checked:
+    the samples of missing packets, and of packets with a wrong end byte,
+    are sent as `fill_value` and announced by a gap trigger (see
+    :func:`triggers.make_gap_trigger`), unless `gap_triggers` is False.
+    """
+    def __init__(self, outputs, serial_port, profile, channels=None, parent=None, fill_value=0.,
+                 gap_triggers=True):
+        QThread.__init__(self)
         self.outputs = outputs
         self.n = 0
         self.serial_port = serial_port
-        self.packet_bsize = 3 +(8*3)+(nb_aux*2)
-        self.chan_values = np.zeros((1, nb_channel), dtype=np.float32)
-        self.aux_values = np.zeros((1, nb_aux), dtype=np.float32)
-        self.count_lost_bytes = 0
-        self.nb_channel = nb_channel
-        self.nb_aux = nb_aux
+        self.profile = profile
+        self.decoder = PacketDecoder(profile)
+        self.channels = np.arange(profile.nb_channel) if channels is None else np.asarray(channels)
+        self.fill_value = fill_value
+        self.gap_triggers = gap_triggers
+        self.last_sample_id = None
+        # channels 1-8 of a Daisy sample waiting for its even packet
+        self.pending = None
 
         self.lock = Mutex()
         self.running = False
 
+        registry = get_registry()
+        node = node_label(parent)
+        self.nb_packet = registry.counter('pyacq_ext_openbci_packets_total', node=node)
+        self.nb_wrong_packet = registry.counter('pyacq_ext_openbci_wrong_packets_total', node=node)
+        self.nb_lost_byte = registry.counter('pyacq_ext_openbci_lost_bytes_total', node=node)
+        self.packet_latency = registry.histogram('pyacq_ext_openbci_packet_seconds', node=node)
+        self.nb_gap = registry.counter('pyacq_ext_openbci_gaps_total', node=node)
+        self.nb_lost_sample = registry.counter('pyacq_ext_openbci_lost_samples_total', node=node)
+
     def run(self):
         with self.lock:
             self.running = True
@@ -56,54 +187,114 @@ class OpenBCIThread(QtCore.QThread):
                     if not self.running:
                         break
 
-            message = self.serial_port.read()
-            unpacked = struct.unpack('B', message)[0]
-
-            if unpacked == _START_BYTE:
-                if self.count_lost_bytes!=0:
-                    logger.debug("Lost %i bytes before reading the begining of a packet"%self.count_lost_bytes)
-                    self.count_lost_bytes=0
-                # self.data[0] = unpacked
-                data = self.serial_port.read(self.packet_bsize-2)
-                last_byte = struct.unpack('B', self.serial_port.read())[0]
-                if last_byte == _END_BYTE:
-                    self.decode(data)
-                else:
-                    logger.debug("Wrong packet")
-                    self.chan_values[0,:] = 0
-                    self.aux_values[0,:] = 0
-                self.n += 1
-                self.outputs['signals'].send(self.chan_values, index=self.n)
-                self.outputs['aux'].send(self.aux_values, index=self.n)
-            else:
-                self.count_lost_bytes+=1
-
-    def decode(self, data):
+            data = self.serial_port.read(max(1, self.serial_port.in_waiting))
+            if not data:
+                continue
+            self.process(data)
+
+    def process(self, data):
+        t0 = perf_counter_ns()
+        lost_byte = self.decoder.nb_lost_byte
+        sample_ids, chans, aux, wrong = self.decoder.feed(data)
+        if self.decoder.nb_lost_byte != lost_byte:
+            logger.debug("Lost %i bytes before reading the begining of a packet",
+                         self.decoder.nb_lost_byte - lost_byte)
+            self.nb_lost_byte.inc(self.decoder.nb_lost_byte - lost_byte)
+        if sample_ids.size == 0:
+            return
+        self.nb_packet.inc(sample_ids.size)
+        self.nb_wrong_packet.inc(int(wrong.sum()))
+
+        rows, gap_start, gap_size, first_id = self.fill_gaps(sample_ids, wrong)
+        nb_row = rows[-1] + 1
+        packet_chans = np.full((nb_row, self.profile.packet_channel), self.fill_value, dtype=np.float32)
+        packet_aux = np.full((nb_row, self.profile.nb_aux), self.fill_value, dtype=np.float32)
+        valid = rows[~wrong]
+        packet_chans[valid] = chans[~wrong]
+        packet_aux[valid] = aux[~wrong]
+
+        if self.profile.daisy:
+            sigs, aux_values, gap_start, gap_size = self.pair_daisy(packet_chans, packet_aux,
+                                                                    first_id, gap_start, gap_size)
+        else:
+            sigs, aux_values = packet_chans, packet_aux
+
+        # the triggers go first, so the epochs overlapping the gaps are known lost
+        for start, size in zip(gap_start, gap_size):
+            logger.debug("%i samples lost", size)
+            self.nb_gap.inc()
+            self.nb_lost_sample.inc(int(size))
+            if self.gap_triggers:
+                self.outputs['triggers'].send(make_gap_trigger(self.n + start, size), index=1)
+
+        if sigs.shape[0]:
+            self.n += sigs.shape[0]
+            self.outputs['signals'].send(sigs[:, self.channels], index=self.n)
+            self.outputs['aux'].send(aux_values, index=self.n)
+        self.packet_latency.record_since(t0)
+
+    def fill_gaps(self, sample_ids, wrong):
+        """Place the packets in a run of consecutive sample IDs.
+
+        Return the row of each packet, the first row and size of each gap
+        (missing packets and wrong packets) and the sample ID of row 0.
         """
-        Parses incoming data packet into node outputs.
-        Incoming Packet Structure:
-        Sample ID(1)|Channel Data(24)|Aux Data(6)
-        0-255|8, 3-byte signed ints|3 2-byte signed ints
+        sample_ids = sample_ids.copy()
+        # the sample ID of a corrupted packet is not trusted
+        for j in np.flatnonzero(wrong):
+            previous = sample_ids[j - 1] if j else self.last_sample_id
+            sample_ids[j] = 0 if previous is None else (previous + 1) % 256
+        previous = np.empty_like(sample_ids)
+        previous[1:] = sample_ids[:-1]
+        previous[0] = (sample_ids[0] - 1) % 256 if self.last_sample_id is None else self.last_sample_id
+        missing = (sample_ids - previous - 1) % 256
+        self.last_sample_id = int(sample_ids[-1])
+
+        rows = np.arange(sample_ids.size) + np.cumsum(missing)
+        gap_size = missing + wrong
+        has_gap = gap_size > 0
+        gap_start = (rows - missing)[has_gap]
+        first_id = int(sample_ids[0] - missing[0]) % 256
+        return rows, gap_start, gap_size[has_gap], first_id
+
+    def pair_daisy(self, chans, aux, first_id, gap_start, gap_size):
+        """Join the odd (channels 1-8) and even (channels 9-16) packets
+
+        The gaps are converted from packet rows to sample rows, a sample is
+        lost if any of its packets is.
         """
-        jj=1 # First byte is Sample ID..
-        for ii in range(self.nb_channel):
-            data_chan = data[jj:jj+3]
-            unpacked = struct.unpack('3B', data_chan)
-            #3byte int in 2s compliment
-            if (unpacked[0] >= 127):
-                pre_fix = b'\xFF'
-            else:
-                pre_fix = b'\x00'
-            data_chan = pre_fix + data_chan
-            self.chan_values[0,ii] = struct.unpack('>i', data_chan)[0] * scale_fac_uVolts_per_count
-            jj=jj+3
-
-        jj=25
-        for ii in range(self.nb_aux):
-            acc = struct.unpack('>h', data[jj:jj+2])[0]
-            self.aux_values[0,ii]=acc
-            jj=jj+2
-
+        if self.pending is not None:
+            pending_chans, pending_aux, pending_gap = self.pending
+            chans = np.concatenate([pending_chans, chans])
+            aux = np.concatenate([pending_aux, aux])
+            first_id = (first_id - 1) % 256
+            gap_start = gap_start + 1
+            if pending_gap:
+                # announced with the sample it belongs to, which starts here
+                gap_start = np.concatenate([[0], gap_start])
+                gap_size = np.concatenate([[1], gap_size])
+            self.pending = None
+        # a sample starts on an odd sample ID, a leading even packet is dropped
+        first = 1 - first_id % 2
+        nb_sample = (chans.shape[0] - first) // 2
+        end = first + 2 * nb_sample
+        if end < chans.shape[0]:
+            pending_gap = bool(np.any((gap_start <= end) & (end < gap_start + gap_size)))
+            self.pending = (chans[end:], aux[end:], pending_gap)
+        sigs = np.concatenate([chans[first:end:2], chans[first + 1:end:2]], axis=1)
+        gap_stop = np.minimum((gap_start + gap_size - first + 1) // 2, nb_sample)
+        gap_start = np.maximum((gap_start - first) // 2, 0)
+        keep = gap_stop > gap_start
+        gap_start, gap_stop = gap_start[keep], gap_stop[keep]
+        if gap_start.size > 1:
+            # the two packets of a sample can be in two gaps, merge the overlaps
+            stop_max = np.maximum.accumulate(gap_stop)
+            new = np.ones(gap_start.size, dtype=bool)
+            new[1:] = gap_start[1:] >= stop_max[:-1]
+            first_gap = np.flatnonzero(new)
+            gap_start = gap_start[first_gap]
+            gap_stop = np.maximum.reduceat(gap_stop, first_gap)
+        return sigs, aux[first:end:2], gap_start, gap_stop - gap_start
 
     def stop(self):
         self.serial_port.write('s'.encode('utf-8'))
@@ -115,22 +306,31 @@ class OpenBCIListener(Node):
     """
     This class is a bridge between Pyacq and the 32bit board OpenBCI
     amplifier from the open source project http://openbci.com.
-    Daisy board version for now
 
-    #TODO : this is a very basic code to grab data from 8 channel Daisy OpenBCI board.
-    # next version will improve dialog with the board and auto-initialisation
+    The board is given by a profile of `board_profiles`: 'cyton' (8
+    channels), 'daisy' (Cyton with the Daisy module, 16 channels at half the
+    packet rate) or 'ganglion' (4 channels, with a serial bridge or the WiFi
+    shield streaming the same 33 bytes packets; the compressed BLE packets
+    are not supported).
 
+    The `signals` output can be configured with `transfermode='sharedmemory'`
+    so local consumers read the ring buffer without a copy per consumer.
+
+    The `triggers` output, which announces the lost samples, is optional: the
+    gap triggers are only sent if it is configured before `initialize`.
 
     """
     _output_specs = {'signals' : dict(streamtype='analogsignal',dtype='float32'),
-                     'aux'   : dict(streamtype='analogsignal', dtype='float32')}
+                     'aux'   : dict(streamtype='analogsignal', dtype='float32'),
+                     'triggers': trigger_output_spec()}
 
 
     def __init__(self, **kargs):
         Node.__init__(self, **kargs)
         assert HAVE_PYSERIAL, "OpenBCI node depends on the `pyserial` package, but it could not be imported."
 
-    def _configure(self, device_handle='/dev/ttyUSB0'):
+    def _configure(self, device_handle='/dev/ttyUSB0', buffer_duration=10., gap_fill='zero',
+                   board='cyton', sample_rate=None, baud=115200, channels=None, reset_timeout=5.):
         """
         Parameters
         ----------
@@ -138,35 +338,84 @@ class OpenBCIListener(Node):
             Path to the device. Linux   : '/dev/ttyUSB0'
                                 Mac     : '/dev/tty.usbserial-DN0096XA'
                                 Windows : 'COM3'
+        buffer_duration : float
+            Duration in s of the shared memory ring buffers.
+        gap_fill : str
+            Value of the lost samples, 'zero' or 'nan'. Default is 'zero'.
+        board : str
+            'cyton', 'daisy' or 'ganglion'. Default is 'cyton'.
+        sample_rate : float or None
+            Sample rate in Hz, one of `profile.sample_rates()`. Default is
+            the board default. The rates above 250 Hz need the WiFi shield
+            or a wired link, and a baud rate carrying 33 bytes per packet.
+        baud : int
+            Serial baud rate: 115200, 230400 or 921600. Default is 115200.
+        channels : list of int or None
+            Indexes of the channels sent on `signals`, all by default.
+        reset_timeout : float
+            Time in s allowed to the board to answer the reset with its
+            banner. Default is 5.
         """
-        #"Daisy" board params
-        self.board_name = "Daisy"
+        assert gap_fill in ('zero', 'nan'), 'Unknown gap_fill {}'.format(gap_fill)
+        assert board in board_profiles, 'Unknown board {}'.format(board)
+        assert baud in _BAUD_CODES, 'Unsupported baud rate {}'.format(baud)
+        self.gap_fill = gap_fill
+        self.profile = board_profiles[board]
+        self.board_name = self.profile.name
         self.device_handle = device_handle
-        self.device_baud = 115200
-        self.packet_bsize = 33
-        self.nb_channel = 6
-        self.nb_aux = 3
+        self.device_baud = baud
+        self.reset_timeout = reset_timeout
+        self.packet_bsize = _PACKET_SIZE
+
+        if sample_rate is None:
+            sample_rate = self.profile.sample_rate
+        assert sample_rate in self.profile.sample_rates(), \
+            'Sample rate of the {} must be one of {}'.format(self.board_name, self.profile.sample_rates())
+        self.sample_rate = float(sample_rate)
+        packet_rate = self.sample_rate * self.profile.packets_per_sample
+        # 10 bits per byte on the serial line
+        assert packet_rate * _PACKET_SIZE * 10 <= baud, \
+            '{} Hz needs more than {} baud'.format(self.sample_rate, baud)
+
+        self.channels = list(range(self.profile.nb_channel)) if channels is None else list(channels)
+        self.nb_channel = len(self.channels)
+        self.nb_aux = self.profile.nb_aux
 
         self.outputs['signals'].spec['shape'] = (-1, self.nb_channel)
-        self.outputs['signals'].spec['sample_rate'] = 250.
+        self.outputs['signals'].spec['sample_rate'] = self.sample_rate
         self.outputs['signals'].spec['nb_channel'] = self.nb_channel
+        self.outputs['signals'].spec['buffer_size'] = int(buffer_duration * self.sample_rate)
+        self.outputs['signals'].spec['double'] = True
 
         self.outputs['aux'].spec['shape'] = (-1, self.nb_aux)
-        self.outputs['aux'].spec['sample_rate'] = 250
+        self.outputs['aux'].spec['sample_rate'] = self.sample_rate
         self.outputs['aux'].spec['nb_channel'] = self.nb_aux
+        self.outputs['aux'].spec['buffer_size'] = int(buffer_duration * self.sample_rate)
+        self.outputs['aux'].spec['double'] = True
 
     def after_output_configure(self, outputname):
         if outputname == 'signals':
-            channel_info = [ {'name': 'ch{}'.format(c)} for c in range(self.nb_channel) ]
+            channel_info = [ {'name': 'ch{}'.format(c + 1)} for c in self.channels ]
         elif outputname == 'aux':
             channel_info = [ {'name': 'aux{}'.format(c)} for c in range(self.nb_aux) ]
+        else:
+            return
         self.outputs[outputname].params['channel_info'] = channel_info
 
     def _initialize(self):
-        self.serial_port = serial.Serial(port=self.device_handle, baudrate=self.device_baud)
+        # the board always starts at 115200 baud
+        self.serial_port = serial.Serial(port=self.device_handle, baudrate=115200, timeout=0.1)
         self.reset_port()
-        self.check_response()
-        self._thread = OpenBCIThread(self.outputs, self.serial_port, self.nb_channel, self.nb_aux)
+        if self.device_baud != 115200:
+            self.send_command(_BAUD_CODES[self.device_baud])
+            self.serial_port.baudrate = self.device_baud
+        packet_rate = self.sample_rate * self.profile.packets_per_sample
+        if packet_rate != self.profile.packet_rate:
+            self.send_command('~{}'.format(self.profile.rate_codes[packet_rate]).encode('utf-8'))
+        self._thread = OpenBCIThread(self.outputs, self.serial_port, self.profile,
+                                     channels=self.channels, parent=self,
+                                     fill_value=np.nan if self.gap_fill == 'nan' else 0.,
+                                     gap_triggers=self.outputs['triggers'].configured)
 
     def _start(self):
         self._thread.start()
@@ -177,43 +426,54 @@ class OpenBCIListener(Node):
 
     def _close(self):
         self.serial_port.close()
-        pass
 
     def reset_port(self):
+        """Reset the board and wait for its banner, at most `reset_timeout` s"""
+        self.serial_port.reset_input_buffer()
         self.serial_port.write('v'.encode('utf-8'))
-        #wait for device to be ready
-        time.sleep(2)
-
-    def check_response(self):
-        if self.serial_port.inWaiting():
-            message = ''
-            #Look for end sequence $$$
-            while '$$$' not in message:
-                message += self.serial_port.read().decode("utf-8")
-            logger.debug("recv message %s", message)
-        else:
+        message = self.read_response(self.reset_timeout)
+        if message is None:
+            self.serial_port.close()
+            raise TimeoutError('No answer of the {} on {} after {} s'.format(
+                self.board_name, self.device_handle, self.reset_timeout))
+        logger.debug("recv message %s", message)
+
+    def read_response(self, timeout=1.):
+        """Read an answer of the board up to its '$$$' end, None after `timeout` s"""
+        deadline = time.perf_counter() + timeout
+        message = b''
+        while b'$$$' not in message:
+            if time.perf_counter() > deadline:
+                return None
+            # returns at the serial timeout when nothing comes
+            message += self.serial_port.read(max(1, self.serial_port.in_waiting))
+        return message.decode('utf-8', 'replace')
+
+    def check_response(self, timeout=1.):
+        message = self.read_response(timeout)
+        if message is None:
             logger.debug("no message recv")
-
-    # def print_register_settings(self):
-    #     self.serial_port.write('?'.encode('utf-8'))
-    #     time.sleep(0.5)
-    #     self.check_response()
-
-    # def set_channel(self, channel, toggle_position):
-    #     #Commands switch channel ON or OFF (1/0)
-    #     if toggle_position == 1:
-    #         if self.board_name == 'Daisy':
-    #             code = ['!', '@', '#', '$', '%', '^', '&', '*']
-    #         else:
-    #             code = ['!', '@', '#', '$', '%', '^', '&', '*', 'Q', 'W', 'E', 'R', 'T', 'Y', 'U', 'I']
-
-    #     if toggle_position == 0:
-    #         if self.board_name == 'Daisy':
-    #             code = ['1', '2', '3', '4', '5', '6', '7', '8']
-    #         else:
-    #             code = ['1', '2', '3', '4', '5', '6', '7', '8', 'q', 'w', 'e', 'r', 't', 'y', 'u', 'i']
-
-    #     self.serial_port.write(code[channel].encode('utf-8'))
+        else:
+            logger.debug("recv message %s", message)
+        return message
+
+    def send_command(self, command, timeout=1.):
+        """Write `command` and check the answer of the board"""
+        self.serial_port.write(command)
+        message = self.check_response(timeout)
+        if message is not None and message.startswith('Failure'):
+            raise ValueError('{} refused {!r}: {}'.format(self.board_name, command, message))
+        return message
+
+    def print_register_settings(self):
+        self.serial_port.write('?'.encode('utf-8'))
+        return self.check_response()
+
+    def set_channel(self, channel, toggle_position):
+        """Switch the channel (0 to 15) ON or OFF (1/0)"""
+        assert 0 <= channel < self.profile.nb_channel, 'No channel {} on the {}'.format(channel, self.board_name)
+        codes = _CHANNEL_ON_CODES if toggle_position == 1 else _CHANNEL_OFF_CODES
+        self.serial_port.write(codes[channel].encode('utf-8'))
 
 
 register_node_type(OpenBCIListener)
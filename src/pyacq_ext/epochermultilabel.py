@@ -1,25 +1,33 @@
-import pdb
+from collections import deque
 
 import numpy as np
-import pyqtgraph as pg
-from pyacq.core import Node, ThreadPollInput
-from pyqtgraph.Qt import QtCore
-from pyqtgraph.util.mutex import Mutex
+from pyacq.core import Node
+
+from .metrics import get_registry, node_label, perf_counter_ns
+from .runtime import Mutex, QObject, ThreadPollInput, pyqtSignal
+from .tracing import get_tracer
+from .triggers import GAP_TYPE, convert_triggers
 
 
 class ThreadPollInputUntilPosWaited(ThreadPollInput):
     """Thread waiting a futur pos in a stream."""
     
-    pos_reached = QtCore.pyqtSignal(int, str, str)
+    pos_reached = pyqtSignal(int, str, str)
 
-    def __init__(self, input_stream,  **kargs):
+    def __init__(self, input_stream, node=None, **kargs):
         ThreadPollInput.__init__(self, input_stream, **kargs)
 
         self.locker = Mutex()
         self.pos_waited_list = []
 
-    def append_limit(self, label, additionalInformation, pos_waited):
-        self.pos_waited_list.append((label, additionalInformation, pos_waited))
+        registry = get_registry()
+        self.nb_reached = registry.counter('pyacq_ext_epocher_pos_reached_total', node=node)
+        self.nb_waited = registry.gauge('pyacq_ext_epocher_pos_waited', node=node)
+        self.tracer = get_tracer()
+
+    def append_limit(self, pos_waited, label, additionalInformation, trace=None):
+        with self.locker:
+            self.pos_waited_list.append((pos_waited, label, additionalInformation, trace))
 
     def reset(self):
         with self.locker:
@@ -31,15 +39,102 @@ class ThreadPollInputUntilPosWaited(ThreadPollInput):
             if len(self.pos_waited_list) == 0:
                 return
 
-            for pos_waited, label, additionalInformation in self.pos_waited_list:
+            for pos_waited, label, additionalInformation, trace in self.pos_waited_list:
                 if pos >= pos_waited:
+                    self.tracer.stamp(trace, 'pos_reached')
                     self.pos_reached.emit(pos_waited, label, additionalInformation)
+                    self.nb_reached.inc()
             self.pos_waited_list = [
                 pos_waited for pos_waited in self.pos_waited_list if pos < pos_waited[0]]
+            self.nb_waited.set(len(self.pos_waited_list))
+
 
 
+class EpochRejector:
+    """Artifact criteria of one label, evaluated on each epoch.
 
-class EpocherMultiLabel(Node,  QtCore.QObject):
+    All criteria are optional and checked per channel, an epoch is rejected
+    if any channel fails one of them:
+
+    - **ptp_max** : peak-to-peak amplitude above this value
+    - **abs_max** : absolute amplitude above this value (saturation)
+    - **flat_min** : peak-to-peak amplitude below this value (flat channel)
+    - **zscore_max** : variance z-score above this value, against the
+      accepted epochs of the label. Checked once `zscore_warmup` (at least
+      2) epochs have been accepted.
+
+    Rejections are counted per criterion and per channel.
+    """
+    criteria = ('ptp_max', 'abs_max', 'flat_min', 'zscore_max')
+
+    def __init__(self, nb_channel, ptp_max=None, abs_max=None, flat_min=None,
+                 zscore_max=None, zscore_warmup=5):
+        if zscore_warmup < 2:
+            # the std of the variances needs two accepted epochs
+            raise ValueError('zscore_warmup must be >= 2')
+        self.ptp_max = ptp_max
+        self.abs_max = abs_max
+        self.flat_min = flat_min
+        self.zscore_max = zscore_max
+        self.zscore_warmup = zscore_warmup
+
+        self.nb_accepted = 0
+        self.nb_rejected = 0
+        self.criteria_counts = {name: 0 for name in self.criteria}
+        self.channel_counts = np.zeros(nb_channel, dtype='int64')
+        # running mean and sum of squared deviations of the channel variances
+        self._var_mean = np.zeros(nb_channel)
+        self._var_m2 = np.zeros(nb_channel)
+
+    def accept(self, epoch):
+        """Return False if `epoch` (nb_channel, size) has to be rejected"""
+        bad_channels = np.zeros(epoch.shape[0], dtype=bool)
+
+        def check(name, bad):
+            if bad.any():
+                self.criteria_counts[name] += 1
+                bad_channels[:] |= bad
+
+        if self.ptp_max is not None or self.abs_max is not None or self.flat_min is not None:
+            mx = epoch.max(axis=1)
+            mn = epoch.min(axis=1)
+            if self.ptp_max is not None:
+                check('ptp_max', mx - mn > self.ptp_max)
+            if self.abs_max is not None:
+                check('abs_max', np.maximum(mx, -mn) > self.abs_max)
+            if self.flat_min is not None:
+                check('flat_min', mx - mn < self.flat_min)
+
+        if self.zscore_max is not None:
+            var = epoch.var(axis=1)
+            if self.nb_accepted >= self.zscore_warmup:
+                std = np.sqrt(self._var_m2 / (self.nb_accepted - 1))
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    zscore = np.abs(var - self._var_mean) / std
+                check('zscore_max', zscore > self.zscore_max)
+
+        if bad_channels.any():
+            self.nb_rejected += 1
+            self.channel_counts += bad_channels
+            return False
+
+        self.nb_accepted += 1
+        if self.zscore_max is not None:
+            delta = var - self._var_mean
+            self._var_mean += delta / self.nb_accepted
+            self._var_m2 += delta * (var - self._var_mean)
+        return True
+
+    def get_counts(self):
+        return {
+            'accepted': self.nb_accepted,
+            'rejected': self.nb_rejected,
+            'criteria': dict(self.criteria_counts),
+            'channels': self.channel_counts.copy(),
+        }
+
+
+class EpocherMultiLabel(Node,  QObject):
     """Node that accumulate in a ring buffer chunk of a multi signals on trigger events configurable.
 
     This Node have no output.
@@ -47,6 +142,9 @@ class EpocherMultiLabel(Node,  QtCore.QObject):
     On each new chunk this new_chunk is emmited.
     Note that this do not occurs on new trigger but a bit after when the right_sweep is reached on signals stream.
 
+    Epochs overlapping a gap trigger (samples lost by the acquisition node,
+    see :func:`triggers.make_gap_trigger`) are dropped.
+
     """
     _input_specs = {'signals': dict(streamtype='signals'),
                     'triggers': dict(streamtype='events',  shape=(-1, )),
@@ -58,6 +156,7 @@ class EpocherMultiLabel(Node,  QtCore.QObject):
         'right_sweep': 0.003,
         'max_stock': 1,
     }
+    _optional_params = ('rejection', )
     _default_params = {
         'S  1': _params_ex,
         'S  2': _params_ex,
@@ -68,13 +167,13 @@ class EpocherMultiLabel(Node,  QtCore.QObject):
         'S  7': _params_ex,
     }
 
-    new_chunk = QtCore.pyqtSignal(str, str, np.ndarray)
+    new_chunk = pyqtSignal(str, str, np.ndarray)
 
     def __init__(self, parent=None, **kargs):
-        QtCore.QObject.__init__(self, parent)
+        QObject.__init__(self, parent)
         Node.__init__(self, **kargs)
 
-    def _configure(self, parameters, max_xsize=2.):
+    def _configure(self, parameters, max_xsize=2., reject_gaps=True):
         """Parameters
         ----------
         parameters : dict
@@ -84,15 +183,21 @@ class EpocherMultiLabel(Node,  QtCore.QObject):
                     left_sweep -- the left shift (float),
                     right_sweep -- the left shift (float),
                     max_stock -- the stack maximum (int),
+                    rejection -- optional artifact criteria (dict), see
+                                 EpochRejector, rejected epochs do not
+                                 take a stock slot
                 }
                 ...
             } 
         max_xsize: int, optional
             The maximum sample chunk size
+        reject_gaps: bool, optional
+            Drop the epochs overlapping a gap trigger. Default is True.
 
         """
         self.parameters = parameters
         self.max_xsize = max_xsize
+        self.reject_gaps = reject_gaps
 
         self._dict_format()
 
@@ -108,16 +213,30 @@ class EpocherMultiLabel(Node,  QtCore.QObject):
     def _initialize(self):
         buf_size = int(
             self.inputs['signals'].params['sample_rate'] * self.max_xsize)
-        self.inputs['signals'].set_buffer(
-            size=buf_size, axisorder=[1, 0], double=True)
+        # a sharedmemory input already exposes the output ring buffer,
+        # epochs are read from it instead of a local copy
+        ring = getattr(self.inputs['signals'], 'buffer', None)
+        if ring is None:
+            self.inputs['signals'].set_buffer(
+                size=buf_size, axisorder=[1, 0], double=True)
+        elif ring.shape[0] < buf_size:
+            raise ValueError('Shared memory buffer_size of signals must be at least {}'.format(buf_size))
 
         self.trig_poller = ThreadPollInput(
             self.inputs['triggers'], return_data=True)
         self.trig_poller.new_data.connect(self.on_new_trig)
 
-        self.pos_waiter = ThreadPollInputUntilPosWaited(self.inputs['signals'])
+        node = node_label(self)
+        self.pos_waiter = ThreadPollInputUntilPosWaited(self.inputs['signals'], node=node)
         self.pos_waiter.pos_reached.connect(self.on_pos_reached)
 
+        registry = get_registry()
+        self.nb_epoch = registry.counter('pyacq_ext_epocher_epochs_total', node=node)
+        self.nb_stock = registry.counter('pyacq_ext_epocher_stocks_total', node=node)
+        self.epoch_latency = registry.histogram('pyacq_ext_epocher_epoch_seconds', node=node)
+        self.nb_gap_rejected = registry.counter('pyacq_ext_epocher_gap_rejected_total', node=node)
+        self.tracer = get_tracer()
+
         self.initialize_storage()
 
     def _start(self):
@@ -135,28 +254,54 @@ class EpocherMultiLabel(Node,  QtCore.QObject):
         pass
 
     def on_new_trig(self, trig_num, trig_indexes):
-        for pos, pts, channel, description, label, additionalInformation in trig_indexes:
-            label = label.decode()
-            additionalInformation = additionalInformation.decode()
+        # accept any trigger layout, triggers from older producers are converted
+        trig_indexes = convert_triggers(trig_indexes)
+        for pos, points, type_, label, additionalInformation in zip(trig_indexes['pos'],
+                                                                    trig_indexes['points'],
+                                                                    trig_indexes['type'],
+                                                                    trig_indexes['description'],
+                                                                    trig_indexes['additionalInformation']):
+            if type_ == GAP_TYPE:
+                self.gaps.append((pos, pos + points))
+                continue
+            # a producer may have cut a character
+            label = label.decode(errors='replace')
+            additionalInformation = additionalInformation.decode(errors='replace')
             if label in self.parameters.keys():
+                trace = self.tracer.find(pos, label)
+                self.tracer.stamp(trace, 'epocher')
                 pos_waited = pos + self.parameters[label]['right_limit']
-                self.pos_waiter.append_limit(pos_waited, label, additionalInformation)
+                self.pos_waiter.append_limit(pos_waited, label, additionalInformation, trace)
 
     def on_pos_reached(self, pos, label, additionalInformation):
+        t0 = perf_counter_ns()
         size_stock = self.parameters[label]['size']
         epoch = self.inputs['signals'].get_data(
             pos - size_stock, pos).transpose()
 
-        if epoch is not None:
+        if epoch is not None and self.reject_gaps and self.overlaps_gap(pos - size_stock, pos):
+            self.nb_gap_rejected.inc()
+            epoch = None
+
+        rejector = self.rejectors.get(label)
+        if epoch is not None and (rejector is None or rejector.accept(epoch)):
             weight = self.epoch_storage[label]['weight']
 
             self.epoch_storage[label]['stock'][weight, :, :] = epoch
             self.epoch_storage[label]['weight'] += 1
+            self.nb_epoch.inc()
+
+            trace = self.tracer.find(pos - self.parameters[label]['right_limit'], label)
+            self.tracer.stamp(trace, 'epoch')
+            self.epoch_storage[label]['traces'].append(trace)
 
         for label in self.epoch_storage.keys():
             if self.epoch_storage[label]['weight'] >= self.parameters[label]['max_stock']:
+                self.tracer.wait_result(self.epoch_storage[label]['traces'])
                 self.new_chunk.emit(label, additionalInformation, self.epoch_storage[label]['stock'])
                 self.reset_stock(label)
+                self.nb_stock.inc()
+        self.epoch_latency.record_since(t0)
 
     def configure_triggers_parameters(self):
         for trigger_parameter in self.parameters.values():
@@ -168,7 +313,22 @@ class EpocherMultiLabel(Node,  QtCore.QObject):
             trigger_parameter['size'] = trigger_parameter['right_limit'] - \
                 trigger_parameter['left_limit']
 
+    def overlaps_gap(self, start, stop):
+        for gap_start, gap_stop in list(self.gaps):
+            if gap_start < stop and start < gap_stop:
+                return True
+        return False
+
+    def get_rejection_counts(self):
+        """Return the accepted/rejected counts of each label with rejection"""
+        return {label: rejector.get_counts() for label, rejector in self.rejectors.items()}
+
     def initialize_storage(self):
+        self.rejectors = {label: EpochRejector(self.nb_channel, **params['rejection'])
+                          for label, params in self.parameters.items()
+                          if params.get('rejection')}
+        # last gaps received, older ones are out of the ring buffer anyway
+        self.gaps = deque(maxlen=64)
         self.epoch_storage = {}
         for label in self.parameters.keys():
             self.epoch_storage[label] = {}
@@ -180,11 +340,15 @@ class EpocherMultiLabel(Node,  QtCore.QObject):
         self.epoch_storage[label]['stock'] = np.zeros(
             (parameter['max_stock'], self.nb_channel, parameter['size']), dtype=self.inputs['signals'].params['dtype'])
         self.epoch_storage[label]['weight'] = 0
+        self.epoch_storage[label]['traces'] = []
 
     def _dict_format(self):
         if type(self.parameters) is not dict:
             raise TypeError('Argument :parameters: has to be type `dict`')
 
         for params in self.parameters.values():
-            if params.keys() != self._params_ex.keys():
+            keys = set(params.keys()) - set(self._optional_params)
+            if keys != self._params_ex.keys():
                 raise ValueError('Argument: parameters wrong format')
+            if not set(params.get('rejection') or {}) <= set(EpochRejector.criteria + ('zscore_warmup', )):
+                raise ValueError('Argument: parameters wrong rejection criteria')
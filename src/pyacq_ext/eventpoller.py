@@ -1,30 +1,103 @@
+import asyncio
+import logging
 import time
+from collections import deque
 
 import numpy as np
 import zmq
-from PyQt5 import QtCore
-from pyqtgraph.util.mutex import Mutex
+import zmq.asyncio
 
-from pyacq.core import Node, ThreadPollInput
+from pyacq.core import Node
 
 from datetime import datetime
 
+from . import commandbus
 from .helper import Helper
+from .metrics import get_registry, node_label, perf_counter_ns
+from .runtime import AsyncTask, Mutex, QThread, ThreadPollInput, pyqtSignal
+from .tracing import get_tracer
+from .triggers import dtype_trigger, empty_triggers, fit_text, trigger_output_spec
 
-_dtype_trigger = [('pos', 'int64'),
-                ('points', 'int64'),
-                ('channel', 'int64'),
-                ('type', 'S16'),  # TODO check size
-                ('description', 'S100'),  # TODO check size
-                  ('additionalInformation', 'S100'),
-                ]
+logger = logging.getLogger(__name__)
 
 
-class EventPollerThread(QtCore.QThread):
+class ResultQueue:
+    """Bounded queue of result frames waiting to be sent to the game.
+
+    The pipeline thread puts frames and the poll thread pops them, so the
+    classification path never touches the game socket. ``put`` never blocks,
+    when the queue is full ``policy`` decides which frame is lost:
+
+    - **drop_oldest** : the oldest pending frame is discarded
+    - **drop_newest** : the frame being put is discarded
+    - **coalesce** : only the most recent frame is kept
+
+    ``deque.append`` and ``deque.popleft`` are atomic so no lock is taken.
+    """
+    policies = ('drop_oldest', 'drop_newest', 'coalesce')
+
+    def __init__(self, maxsize=8, policy='drop_oldest'):
+        if policy not in self.policies:
+            raise ValueError('Unknown result policy {}'.format(policy))
+        if maxsize < 1:
+            raise ValueError('maxsize must be >= 1')
+        self.policy = policy
+        self.maxsize = 1 if policy == 'coalesce' else maxsize
+        self._frames = deque(maxlen=self.maxsize)
+        self.nb_dropped = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, frame):
+        """Queue ``frame``, return False if it was dropped."""
+        if len(self._frames) >= self.maxsize:
+            self.nb_dropped += 1
+            if self.policy == 'drop_newest':
+                return False
+        # a full deque discards its oldest item on append
+        self._frames.append(frame)
+        return True
+
+    def pop(self):
+        """Return the oldest pending frame or None."""
+        try:
+            return self._frames.popleft()
+        except IndexError:
+            return None
+
+    def clear(self):
+        self._frames.clear()
+
+
+class GameSession:
+    """State of one game connected to the EventPoller.
+
+    In 'pair' mode there is a single session whose identity is None, in
+    'router' mode there is one session per client identity.
+    """
+    def __init__(self, identity, index, result_queue_size=8, result_policy='drop_oldest'):
+        self.identity = identity
+        self.index = index
+        self.envelope = [identity]
+        self.isConnected = False
+        self.trigger_setup = None
+        self.setting = None
+        self.results = ResultQueue(result_queue_size, result_policy)
+        # RESULT_ZMQ requests not answered yet
+        self.nb_waiting = 0
+
+
+class EventPollerThread(QThread):
     """Communicate with the MYB via ZeroMQ.
 
     This is a thread of communication beetween the myb game and pyacq.
     The communication architecture is request-response.
+
+    In 'pair' mode a single game connects with a PAIR socket. In 'router'
+    mode several games connect with DEALER (or REQ) sockets, each client
+    identity gets its own :class:`GameSession` and its triggers are tagged
+    with the session index in the `channel` field.
     
     """
     QUIT_ZMQ = "QUIT_ZMQ"
@@ -39,44 +112,85 @@ class EventPollerThread(QtCore.QThread):
     TRIGGER_SETUP_ZMQ = "TRIGGER_SETUP_ZMQ"
     SETTING_ZMQ = "SETTING_ZMQ"
 
+    modes = ('pair', 'router')
 
+    stop_communicate = pyqtSignal()
 
-    stop_communicate = QtCore.pyqtSignal()
-
-    def __init__(self, outputs, host, port, helper, parent=None):
+    def __init__(self, outputs, host, port, bus, mode='pair', result_queue_size=8,
+                 result_policy='drop_oldest', poll_timeout=1, parent=None):
         """Initialize the socket"""
-        QtCore.QThread.__init__(self)
+        QThread.__init__(self)
+        if mode not in self.modes:
+            raise ValueError('Unknown EventPoller mode {}'.format(mode))
         self.outputs = outputs
         self.addr = "tcp://{}:{}".format(host, port)
+        self.mode = mode
 
-        self.context = zmq.Context()
-        #self.socket = self.context.socket(zmq.REP)
-        self.socket = self.context.socket(zmq.PAIR)
-        self.socket.bind(self.addr)
+        self.socket = self.open_socket()
         
         self.mutex = Mutex()
 
         # thread and zmq state
         self.running = False 
-        self.isConnected = False
-        self.result_frame = None
-
+        self.result_queue_size = result_queue_size
+        self.result_policy = result_policy
+        self.poll_timeout = poll_timeout
+
+        # identity -> GameSession, the single pair session has identity None
+        self.sessions = {}
+        self._nb_session = 0
+        # 'router' mode: sessions which sent RESULT_ZMQ, oldest first, an
+        # entry is stale once its session has no request waiting
+        self.waiting_result = deque()
+        self.nb_waiting = 0
+        if mode == 'pair':
+            self.session = self.get_session(None)
+
+        self._handlers = {
+            self.QUIT_ZMQ: self.on_quit,
+            self.START_ZMQ: self.on_start,
+            self.EVENT_ZMQ: self.on_event,
+            self.RESULT_ZMQ: self.on_result,
+            self.START_SESSION: self.on_start_session,
+            self.RESET_ZMQ: self.on_reset,
+            self.TRIGGER_SETUP_ZMQ: self.on_trigger_setup,
+            self.SETTING_ZMQ: self.on_setting,
+        }
+        # requests handled before START_ZMQ
+        self._unconnected_requests = (self.QUIT_ZMQ, self.START_ZMQ)
+
+        self.request, self.content = None, None
         self.current_pos = 0
-        self.reset()
         
         self.posXTime0 = 0
         self.samplingRate = 0
 
-        #now = datetime.now()
-        #dt_string = now.strftime("%Y.%m.%d-%H.%M.%S")
-        #filename  = "C:/Users/AlexM/Documents/Projets/Python/pybart/log/Trig-" +  dt_string + ".txt"
-        #self.TrigFile = open(filename, "a+")
-
         self.calibrationMode = False
-        self.helper = helper
+        self.bus = bus
 
         self.pingSent = False
 
+        registry = get_registry()
+        node = node_label(parent)
+        self.request_counters = {request: registry.counter('pyacq_ext_eventpoller_requests_total',
+                                                           node=node, request=request)
+                                 for request in self._handlers}
+        self.handler_latency = registry.histogram('pyacq_ext_eventpoller_handler_seconds', node=node)
+        self.nb_result_sent = registry.counter('pyacq_ext_eventpoller_results_sent_total', node=node)
+        self.waiting_result_depth = registry.gauge('pyacq_ext_eventpoller_waiting_result', node=node)
+        self.nb_truncated = registry.counter('pyacq_ext_eventpoller_truncated_total', node=node)
+        self.tracer = get_tracer()
+        self.t_recv = 0
+
+    def open_socket(self):
+        self.context = zmq.Context()
+        socket = self.context.socket(zmq.ROUTER if self.mode == 'router' else zmq.PAIR)
+        socket.bind(self.addr)
+        return socket
+
+    @property
+    def isConnected(self):
+        return any(session.isConnected for session in self.sessions.values())
 
     def run(self):
         """The thread core wait request from the game and send back response
@@ -113,150 +227,215 @@ class EventPollerThread(QtCore.QThread):
                     break
 
             try:
-                if self.pingSent is False:
+                if self.mode == 'pair' and self.pingSent is False:
                     self.pingSent = True
-                    self.socket.send_string(self.OK_ZMQ + "|")  # Ping sent to let Unity know that framework is started
+                    self.send(self.session, self.OK_ZMQ + "|")  # Ping sent to let Unity know that framework is started
 
+                self.send_pending_results()
 
-                msg = self.socket.recv(zmq.NOBLOCK)
-                
-                self.request, self.content = msg.decode().split("|")
-
-                if (self.request == self.QUIT_ZMQ):
-                    response = self.request + "|" + self.content
-                    self.socket.send_string(response)
-                    self.isConnected = False
-                    self.reset()
-                    self.helper.stopSignal.emit(True)
-                    print("Stop acquiring")
-
-                elif (self.request == self.START_ZMQ):
-                    response = self.request + "|" + self.content
-                    self.socket.send_string(response)
-                    self.isConnected = True
-                    print("Acquiring on : ", self.addr)
-
-                elif (self.request == self.EVENT_ZMQ and self.isConnected):
-                    response = self.request + "|" + self.content
-                    self.socket.send_string(response)
-                    self.new_event()
-
-                elif (self.request == self.RESULT_ZMQ and self.isConnected):
-                    self.helper.resultSignal.emit()
-                    #self.wait_result()
-                    #if not (self.result_frame == None):
-                        #print("Sending result")
-                        #self.socket.send_string(self.result_frame)
-                    #else:
-                        #print("No Result")
-                        #self.socket.send_string(self.QUIT_ZMQ)
-                    #self.reset()
-
-                elif (self.request == self.START_SESSION and self.isConnected):
-                    response = self.request + "|" + self.content
-                    self.socket.send_string(response)
-                    self.helper.startSessionSignal.emit(self.content)
-
-
-                elif(self.request == self.RESET_ZMQ and self.isConnected):
-                    response = self.request + "|" + self.content
-                    self.socket.send_string(response)
-                    self.helper.resetSignal.emit()
-
-                # elif(self.request == self.CALIBRATION_CHECK and self.isConnected):
-                #     if(not self.calibrationMode):
-                #         response = self.request + "|" + self.content
-                #         self.socket.send_string(response)
-                #     else:
-                #         self.socket.send_string("-1") # TODO : ce message déconnectera unity et python, ce qui n'est pas forcément ce qu'on veut, faire en sorte qu'il indique seulement un fail de calibration
-
-                elif(self.request == self.TRIGGER_SETUP_ZMQ and self.isConnected):
-                    response = self.request + "|" + self.content
-                    self.socket.send_string(response)
-                    self.helper.triggerSetupSignal.emit(self.content)
-
-                elif(self.request == self.SETTING_ZMQ and self.isConnected):
-                    response = self.request + "|" + self.content
-                    self.socket.send_string(response)
-                    self.helper.settingSignal.emit(self.content)
+                # wait at most poll_timeout ms so pending results are not delayed
+                if not self.socket.poll(self.poll_timeout):
+                    continue
+
+                self.handle(self.socket.recv_multipart(zmq.NOBLOCK))
 
             except zmq.ZMQError:
                 pass
-            
-
 
-    def new_event(self):
+    def handle(self, frames):
+        """Dispatch one request received as zmq frames"""
+        t0 = self.t_recv = perf_counter_ns()
+        session, msg = self.parse(frames)
+        self.request, self.content = msg.decode().split("|")
+
+        handler = self._handlers.get(self.request)
+        if handler is not None and (session.isConnected or
+                                    self.request in self._unconnected_requests):
+            handler(session, self.content)
+            self.request_counters[self.request].inc()
+            self.handler_latency.record_since(t0)
+            self.waiting_result_depth.set(self.nb_waiting)
+
+    def parse(self, frames):
+        """Return the session and the raw message of a request"""
+        if self.mode == 'pair':
+            return self.session, frames[-1]
+
+        # [identity, msg] from DEALER, [identity, b'', msg] from REQ
+        session = self.get_session(frames[0])
+        session.envelope = frames[:-1]
+        return session, frames[-1]
+
+    def send(self, session, frame):
+        """Send a frame to the game of `session`"""
+        if self.mode == 'pair':
+            self.socket.send_string(frame)
+        else:
+            self.socket.send_multipart(session.envelope + [frame.encode()])
+
+    def reply(self, session):
+        """Echo the current request, which acknowledge it"""
+        self.send(session, self.request + "|" + self.content)
+
+    def get_session(self, identity):
+        """Return the session of `identity`, created on first request"""
+        session = self.sessions.get(identity)
+        if session is None:
+            session = GameSession(identity, self._nb_session,
+                                  self.result_queue_size, self.result_policy)
+            self._nb_session += 1
+            self.sessions[identity] = session
+        return session
+
+    def on_quit(self, session, content):
+        self.reply(session)
+        session.isConnected = False
+        session.results.clear()
+        self.tracer.forget(session.identity)
+        # a result set later must not be queued for this game
+        with self.mutex:
+            self.nb_waiting -= session.nb_waiting
+            session.nb_waiting = 0
+        if self.mode == 'router':
+            del self.sessions[session.identity]
+        self.bus.publish(commandbus.Stop(session.identity))
+        print("Stop acquiring")
+
+    def on_start(self, session, content):
+        self.reply(session)
+        session.isConnected = True
+        print("Acquiring on : ", self.addr)
+
+    def on_event(self, session, content):
+        self.reply(session)
+        self.new_event(session, content)
+
+    def on_result(self, session, content):
+        # queued first, a subscriber may set the result before publish returns
+        with self.mutex:
+            session.nb_waiting += 1
+            self.nb_waiting += 1
+            if self.mode == 'router':
+                self.waiting_result.append(session)
+                if len(self.waiting_result) > 2 * self.nb_waiting + 16:
+                    # drop the stale entries, left by the results sent to an identity
+                    self.waiting_result = deque(self._live_entries())
+        if not self.bus.publish(commandbus.ResultRequest(session.identity)):
+            # the request is lost, the next result must not answer it
+            with self.mutex:
+                self._answered(session)
+
+    def _live_entries(self):
+        """Entries of waiting_result matching a waiting request, in order"""
+        remaining = {}
+        for session in self.waiting_result:
+            n = remaining.setdefault(session, session.nb_waiting)
+            if n > 0:
+                remaining[session] = n - 1
+                yield session
+
+    def _answered(self, session):
+        """One request of `session` is answered, with the mutex held"""
+        if session.nb_waiting > 0:
+            session.nb_waiting -= 1
+            self.nb_waiting -= 1
+
+    def on_start_session(self, session, content):
+        self.reply(session)
+        self.bus.publish(commandbus.StartSession(session.identity, content))
+
+    def on_reset(self, session, content):
+        self.reply(session)
+        self.bus.publish(commandbus.Reset(session.identity))
+
+    def on_trigger_setup(self, session, content):
+        self.reply(session)
+        session.trigger_setup = content
+        self.bus.publish(commandbus.TriggerSetup(session.identity, content))
+
+    def on_setting(self, session, content):
+        self.reply(session)
+        session.setting = content
+        self.bus.publish(commandbus.Setting(session.identity, content))
+
+    def new_event(self, session, content):
         """Call when event is sended by the game"""
-        # check latency
-        msg_data = self.content.split("/")
+        msg_data = content.split("/")
 
         eventTime = (float)(msg_data[0].replace(',','.'))
 
         msg_dataTab = msg_data[1].split(';')
         label = msg_dataTab[0]
-        additionalInformation = ""
-        for i in range(1, len(msg_dataTab)):
-            if additionalInformation is not "":
-                additionalInformation += ";"
-            additionalInformation += msg_dataTab[i]
-        posixtime = time.time() * 1000
-        latency = posixtime - eventTime
-        #print("EventTime : ", eventTime )
-        #print("EventId : ", eventId )
-
-        # print( "time : {}, eventId : {} -> latency({}ms)".format(eventTime,
-        #     eventId, int(latency)))
-    
+        additionalInformation = ";".join(msg_dataTab[1:])
+
         nb_marker = 1
-        markers = np.empty((nb_marker,), dtype=_dtype_trigger)
-        #markers['pos'][0] = self.current_pos
-        #print("posXTime0 : ", self.posXTime0 )
+        markers = empty_triggers(nb_marker)
         pos_curr = round(((eventTime - self.posXTime0) * self.samplingRate) / 1000)
         
-        
-        #self.TrigFile.write(str(pos_curr)  + '\n')
-        
         markers['pos'][0] = pos_curr
         markers['points'][0] = 0
-        markers['channel'][0] = 0
+        markers['channel'][0] = session.index
         markers['type'][0] = b'Stimulus'
-        markers['description'][0] = "{}".format(label).encode("utf-8")
-        markers['additionalInformation'][0] = "{}".format(additionalInformation).encode("utf-8")
-
-        #print(markers, "latency : ", latency)
-
+        description = "{}".format(label).encode("utf-8")
+        information = "{}".format(additionalInformation).encode("utf-8")
+        if (len(description) > dtype_trigger['description'].itemsize or
+                len(information) > dtype_trigger['additionalInformation'].itemsize):
+            # numpy would cut the bytes silently, maybe inside a character
+            self.nb_truncated.inc()
+            logger.warning("EventPoller: event %r truncated to the trigger fields", content)
+        markers['description'][0] = fit_text(description, dtype_trigger['description'].itemsize)
+        markers['additionalInformation'][0] = fit_text(
+            information, dtype_trigger['additionalInformation'].itemsize)
+
+        trace = self.tracer.begin(pos_curr, label, t0=self.t_recv, session=session.identity)
         self.outputs['triggers'].send(markers, index=nb_marker)
+        self.tracer.stamp(trace, 'trigger')
+
+    def send_pending_results(self):
+        """Send the queued result frames, only called by the poll thread"""
+        for session in self.sessions.values():
+            frame = session.results.pop()
+            while frame is not None:
+                self.send(session, frame)
+                self.nb_result_sent.inc()
+                self.tracer.result_sent(session.identity)
+                frame = session.results.pop()
 
-    def wait_result(self, repeat=10, counter=0, shift=100):
-        """Call when result is waited by the game
-
-        This function pause the thread when the result is processed.
-        and check if no result has ready to send during a period of time.
-        """
-        
-        while(self.result_frame == None and counter < 10):
-            print("sleep {}ms until new result check" \
-                    "({}/{})".format(shift,counter+1,repeat))
-            self.msleep(shift)
-            counter += 1
-
-    
     def set_current_pos(self, ptr):
         """Use to syncronise the EEG stream with game event"""
         with self.mutex:
             self.current_pos = ptr
 
-    def set_result_frame(self, frame):
-        """Use to set the result when it's ready to send"""
+    def set_result_frame(self, frame, identity=None):
+        """Use to set the result when it's ready to send
+
+        The frame is queued and sent by the poll thread, this never blocks.
+        A None frame sends QUIT_ZMQ. In 'router' mode the frame goes to
+        `identity`, or by default to the oldest game waiting a result.
+        Return False if the frame was dropped because the game is falling
+        behind or no game is waiting it.
+        """
+        if frame is None:
+            frame = self.QUIT_ZMQ
         with self.mutex:
-            self.result_frame = frame
-            if not (self.result_frame == None):
-                print("Sending result")
-                self.socket.send_string(self.result_frame)
+            if self.mode == 'pair':
+                session = self.session
+            elif identity is not None:
+                session = self.sessions.get(identity)
             else:
-                print("No Result")
-                self.socket.send_string(self.QUIT_ZMQ)
-            self.reset()
+                session = None
+                while self.waiting_result:
+                    candidate = self.waiting_result.popleft()
+                    # skip the stale entries
+                    if candidate.nb_waiting > 0:
+                        session = candidate
+                        break
+            if session is not None:
+                self._answered(session)
+        if session is None or (self.mode == 'router' and not session.isConnected):
+            return False
+        self.tracer.result_set(session.identity)
+        return session.results.put(frame)
     
     def get_request(self):
         """Get the current request sender by the game"""
@@ -264,16 +443,97 @@ class EventPollerThread(QtCore.QThread):
             return self.request, self.content
 
     def reset(self):
-        """Use to reset the result frame"""
-        self.result_frame = None
+        """Use to drop the pending result frames"""
+        # the poll thread adds and removes sessions meanwhile
+        with self.mutex:
+            for session in list(self.sessions.values()):
+                session.results.clear()
+                session.nb_waiting = 0
+            self.waiting_result.clear()
+            self.nb_waiting = 0
 
     def stop(self):
         """Stop the thread"""
         with self.mutex:
-            #self.TrigFile.close()
             self.running = False
             self.socket.disconnect(self.addr)
 
+    def close(self):
+        """Close the socket, once stopped"""
+        self.socket.close(linger=0)
+
+
+class AsyncEventPoller(AsyncTask, EventPollerThread):
+    """The EventPollerThread protocol served by the shared asyncio loop.
+
+    The socket is a `zmq.asyncio` socket awaited on the loop of
+    :func:`runtime.get_event_loop_thread`, which serves all the asyncio
+    transports of the process. A result is sent as soon as it is set
+    instead of at the next poll. It has the start, stop and wait methods
+    of the thread, the socket stays open until :meth:`close` so the poller
+    can be started again.
+
+    The frames are sent in order by a coroutine awaiting each send, a send
+    error is logged and counted in `nb_send_error`.
+    """
+    def __init__(self, *args, **kargs):
+        EventPollerThread.__init__(self, *args, **kargs)
+        AsyncTask.__init__(self)
+        # (session, frame) to send, only touched in the loop thread
+        self.outgoing = deque()
+        self.outgoing_event = None
+        self.nb_send_error = 0
+
+    def open_socket(self):
+        self.context = zmq.asyncio.Context()
+        socket = self.context.socket(zmq.ROUTER if self.mode == 'router' else zmq.PAIR)
+        socket.bind(self.addr)
+        return socket
+
+    async def serve(self):
+        self.running = True
+        self.outgoing_event = asyncio.Event()
+        sender = asyncio.ensure_future(self.send_frames())
+        try:
+            if self.mode == 'pair' and self.pingSent is False:
+                self.pingSent = True
+                self.send(self.session, self.OK_ZMQ + "|")
+
+            while True:
+                self.handle(await self.socket.recv_multipart())
+        finally:
+            self.running = False
+            sender.cancel()
+            self.outgoing_event = None
+
+    def send(self, session, frame):
+        """Queue a frame for the game of `session`, called in the loop thread"""
+        self.outgoing.append((session, frame))
+        if self.outgoing_event is not None:
+            self.outgoing_event.set()
+
+    async def send_frames(self):
+        while True:
+            if not self.outgoing:
+                self.outgoing_event.clear()
+                await self.outgoing_event.wait()
+                continue
+            session, frame = self.outgoing.popleft()
+            try:
+                if self.mode == 'pair':
+                    await self.socket.send_string(frame)
+                else:
+                    await self.socket.send_multipart(session.envelope + [frame.encode()])
+            except zmq.ZMQError as e:
+                self.nb_send_error += 1
+                logger.warning("EventPoller: sending to %r failed (%s)", session.identity, e)
+
+    def set_result_frame(self, frame, identity=None):
+        queued = EventPollerThread.set_result_frame(self, frame, identity=identity)
+        self.loop_thread.call_soon(self.send_pending_results)
+        return queued
+
+
 class EventPoller(Node):
     """This node is use to communicate with MYB games
 
@@ -282,13 +542,17 @@ class EventPoller(Node):
     and convert them to pyacq event stream.
     The node have two poller: the first wait a signal and the second listen
     a tcp address to etablish communication with MYB game.
+
+    With `mode='router'` several games can connect to the same node, the
+    triggers of each game carry its session index in the `channel` field.
+
+    Control requests of the game are published as commands on `bus`
+    (see :mod:`commandbus`), `helper` re-emits them as Qt signals.
     
     """
     _input_specs = {'signals': dict(streamtype='signals')}
     
-    _output_specs = {'triggers': dict(streamtype = 'event', dtype = _dtype_trigger,
-                                                shape = (-1,)),
-                                }
+    _output_specs = {'triggers': trigger_output_spec()}
                                 
     
     
@@ -296,13 +560,55 @@ class EventPoller(Node):
         Node.__init__(self, **kargs)
         
 
-    def _configure(self, host="127.0.0.1", port=5555):
+    def _configure(self, host="127.0.0.1", port=5555, mode='pair', result_queue_size=8,
+                   result_policy='drop_oldest', transport='thread', bus_maxsize=256, bus_nb_worker=1):
+        """
+        Parameters
+        ----------
+        host : str
+            Address the game connects to. Default is '127.0.0.1'.
+        port : int
+            Port the game connects to. Default is 5555.
+        mode : str
+            'pair' for a single game or 'router' for several games, each
+            using a DEALER socket. Default is 'pair'.
+        result_queue_size : int
+            Maximum number of result frames waiting for the game.
+        result_policy : str
+            What to do when the game falls behind: 'drop_oldest',
+            'drop_newest' or 'coalesce'. See :class:`ResultQueue`.
+        transport : str
+            'thread' polls the socket in a thread of the node, 'asyncio'
+            serves it on the event loop shared by the asyncio transports of
+            the process, see :class:`AsyncEventPoller`. Default is 'thread'.
+        bus_maxsize : int
+            Maximum number of commands waiting on `bus`, the requests
+            published when it is full are dropped. Default is 256.
+        bus_nb_worker : int
+            Number of threads calling the subscribers of `bus`. Only one
+            keeps the commands in order. Default is 1.
+        """
+        assert transport in ('thread', 'asyncio'), 'Unknown transport {}'.format(transport)
+        assert bus_maxsize >= 1 and bus_nb_worker >= 1, 'The bus needs a queue and a worker'
+        self.bus_maxsize = bus_maxsize
+        self.bus_nb_worker = bus_nb_worker
         self.host = host
         self.port = port
+        self.mode = mode
+        self.result_queue_size = result_queue_size
+        self.result_policy = result_policy
+        self.transport = transport
 
     def _initialize(self):
+        self.bus = commandbus.CommandBus(maxsize=self.bus_maxsize, nb_worker=self.bus_nb_worker)
         self.helper = Helper()
-        self.sender_poller = EventPollerThread(self.outputs, self.host, self.port, self.helper, parent=self)
+        self.helper.connect_bus(self.bus)
+        poller_class = AsyncEventPoller if self.transport == 'asyncio' else EventPollerThread
+        self.sender_poller = poller_class(self.outputs, self.host, self.port, self.bus,
+                                          mode=self.mode,
+                                          result_queue_size=self.result_queue_size,
+                                          result_policy=self.result_policy,
+                                          parent=self)
 
         self._poller = ThreadPollInput(self.inputs['signals'], return_data=True)
         self._poller.new_data.connect(self.on_new_chunk)
@@ -316,6 +622,7 @@ class EventPoller(Node):
         self.sender_poller.samplingRate = self._poller.input_stream().params['sample_rate']
 
     def _start(self):
+        self.bus.start()
         self._poller.start()
         self.sender_poller.start()
 
@@ -325,10 +632,12 @@ class EventPoller(Node):
 
         self._poller.stop()
         self._poller.wait()
+
+        self.bus.stop()
         #self.dataFile.close()
         #self.posXDataFile.close()
     def _close(self):
-        pass
+        self.sender_poller.close()
 
     def on_new_chunk(self, ptr, data):
         self.sender_poller.set_current_pos(ptr)
@@ -369,14 +678,16 @@ class EventPoller(Node):
         #print("time : \n", str(time.time() * 1000))
         #self.posXDataFile.write(str(time.time() * 1000)  + '\n')
 
-    def send_result(self, frame):
+    def send_result(self, frame, identity=None):
         """Set the formatted result ready to send
 
         You can set the result to send with this method.
-        If the game is asking a result the node will send this 
-        result then this result will be reset.
+        The result is queued and sent to the game by the poll thread,
+        return False if it was dropped (see `result_policy`).
+        In 'router' mode the result goes to the game `identity`, by default
+        to the oldest game waiting a result.
         """
-        self.sender_poller.set_result_frame(frame)
+        return self.sender_poller.set_result_frame(frame, identity=identity)
     
     def get_current_request(self):
         """Get the current request send by the MYB game"""
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Filter bank node
+
+Applies in one node, and one pass over each chunk, what would otherwise be a
+chain of nodes: a re-reference (CAR, bipolar or any matrix), a cascade of
+IIR stages, an FIR stage and a decimation. The IIR stages are fused into a
+single second order sections array and the FIR stages into a single kernel,
+their states are kept for all channels between chunks.
+
+"""
+import numpy as np
+
+from pyacq.core import Node, register_node_type
+
+from .metrics import get_registry, node_label, perf_counter_ns
+from .runtime import ThreadPollInput
+
+
+def car_matrix(nb_channel):
+    """Common average reference matrix"""
+    return np.eye(nb_channel) - 1. / nb_channel
+
+
+def bipolar_matrix(pairs, nb_channel):
+    """Re-reference matrix giving channel a minus channel b for each (a, b)"""
+    matrix = np.zeros((len(pairs), nb_channel))
+    for i, (a, b) in enumerate(pairs):
+        matrix[i, a] = 1.
+        matrix[i, b] = -1.
+    return matrix
+
+
+class ThreadPollInputFilter(ThreadPollInput):
+    """Thread filtering each chunk as soon as it is received."""
+    def __init__(self, input_stream, filterbank, **kargs):
+        ThreadPollInput.__init__(self, input_stream, return_data=True, **kargs)
+        self.filterbank = filterbank
+
+    def process_data(self, pos, data):
+        self.filterbank.process(pos, data)
+
+
+class FilterBank(Node):
+    """Node filtering a signals stream with a fused chain of stages.
+
+    Stages are applied in this order: re-reference, IIR, FIR, decimation.
+
+    Only the re-reference is computed in a preallocated buffer. `sosfilt`
+    and `lfilter` allocate their result, and each chunk sent is a new array,
+    as the output may still hold the previous one (zmq sends it without a
+    copy).
+    """
+    _input_specs = {'signals': dict(streamtype='signals')}
+    _output_specs = {'signals': dict(streamtype='analogsignal', dtype='float32',
+                                     shape=(-1, 1), compression='')}
+
+    def __init__(self, **kargs):
+        Node.__init__(self, **kargs)
+
+    def _configure(self, stages=(), reference=None, decimate=1):
+        """
+        Parameters
+        ----------
+        stages : list
+            Filters applied in cascade. Each one is either an IIR filter as
+            second order sections, shape (nb_section, 6) as returned by
+            `scipy.signal.iirfilter(..., output='sos')`, or an FIR filter
+            as a 1D array of taps.
+        reference : None, 'car' or array
+            Re-reference applied first, 'car' for common average reference
+            or a matrix of shape (nb_output_channel, nb_channel), see
+            :func:`bipolar_matrix`.
+        decimate : int
+            Keep one sample out of `decimate`. The stages have to low-pass
+            the signal accordingly.
+        """
+        sos, fir = [], np.array([1.])
+        for stage in stages:
+            stage = np.asarray(stage, dtype='float64')
+            if stage.ndim == 2 and stage.shape[1] == 6:
+                sos.append(stage)
+            elif stage.ndim == 1:
+                fir = np.convolve(fir, stage)
+            else:
+                raise ValueError('A stage must be sos (nb_section, 6) or FIR taps')
+        self.sos = np.concatenate(sos, axis=0) if sos else None
+        self.fir = fir if fir.size > 1 else None
+
+        self.reference = reference
+        self.decimate = int(decimate)
+        if self.decimate < 1:
+            raise ValueError('decimate must be >= 1')
+
+    def after_input_connect(self, inputname):
+        params = self.inputs['signals'].params
+        nb_channel = params['shape'][1]
+        channel_info = params.get('channel_info')
+
+        if self.reference is None:
+            self.matrix = None
+        elif isinstance(self.reference, str):
+            if self.reference != 'car':
+                raise ValueError('Unknown reference {}'.format(self.reference))
+            self.matrix = car_matrix(nb_channel)
+        else:
+            self.matrix = np.asarray(self.reference, dtype='float64')
+            if self.matrix.shape[1] != nb_channel:
+                raise ValueError('reference matrix must have {} columns'.format(nb_channel))
+            channel_info = None
+        self.nb_channel = nb_channel if self.matrix is None else self.matrix.shape[0]
+        if channel_info is None:
+            channel_info = [{'name': 'ch{}'.format(c)} for c in range(self.nb_channel)]
+        self.channel_info = channel_info
+
+        self.outputs['signals'].spec['shape'] = (-1, self.nb_channel)
+        self.outputs['signals'].spec['sample_rate'] = params['sample_rate'] / self.decimate
+        self.outputs['signals'].spec['nb_channel'] = self.nb_channel
+
+    def after_output_configure(self, outputname):
+        if outputname == 'signals':
+            self.outputs[outputname].params['channel_info'] = self.channel_info
+
+    def _initialize(self):
+        import scipy.signal
+        self._signal = scipy.signal
+        self.dtype = np.dtype(self.outputs['signals'].params['dtype'])
+        if self.matrix is not None:
+            self.matrix_t = np.ascontiguousarray(self.matrix.T)
+        self.zi_sos = None
+        self.zi_fir = None
+        self.head = 0
+        # preallocated, grown to the largest chunk received
+        self._ref_buffer = np.empty((0, self.nb_channel), dtype='float64')
+
+        registry = get_registry()
+        node = node_label(self)
+        self.nb_chunk = registry.counter('pyacq_ext_filterbank_chunks_total', node=node)
+        self.chunk_latency = registry.histogram('pyacq_ext_filterbank_chunk_seconds', node=node)
+
+        self.poller = ThreadPollInputFilter(self.inputs['signals'], self)
+
+    def _start(self):
+        self.poller.start()
+
+    def _stop(self):
+        self.poller.stop()
+        self.poller.wait()
+
+    def _close(self):
+        pass
+
+    def _buffer(self, name, size):
+        buf = getattr(self, name)
+        if buf.shape[0] < size:
+            buf = np.empty((size, self.nb_channel), dtype=buf.dtype)
+            setattr(self, name, buf)
+        return buf[:size]
+
+    def process(self, pos, data):
+        size = data.shape[0]
+        if size == 0:
+            return
+        t0 = perf_counter_ns()
+        self.nb_chunk.inc()
+        x = data
+        if self.matrix is not None:
+            x = np.matmul(data, self.matrix_t, out=self._buffer('_ref_buffer', size))
+
+        if self.sos is not None:
+            if self.zi_sos is None:
+                # start in steady state of the first sample to avoid a step
+                self.zi_sos = self._signal.sosfilt_zi(self.sos)[:, :, np.newaxis] * x[0]
+            x, self.zi_sos = self._signal.sosfilt(self.sos, x, axis=0, zi=self.zi_sos)
+
+        if self.fir is not None:
+            if self.zi_fir is None:
+                self.zi_fir = self._signal.lfilter_zi(self.fir, [1.])[:, np.newaxis] * x[0]
+            x, self.zi_fir = self._signal.lfilter(self.fir, [1.], x, axis=0, zi=self.zi_fir)
+
+        if self.decimate > 1:
+            # keep the samples whose input position is a multiple of decimate
+            first = (size - pos) % self.decimate
+            x = x[first::self.decimate]
+            if x.shape[0] == 0:
+                return
+
+        out = x.astype(self.dtype)
+        self.head += out.shape[0]
+        self.outputs['signals'].send(out, index=self.head)
+        self.chunk_latency.record_since(t0)
+
+
+register_node_type(FilterBank)
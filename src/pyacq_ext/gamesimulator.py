@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Headless game simulator
+
+Python client speaking the EventPoller protocol, used in place of the MYB
+game to test and benchmark the pipeline. It only depends on zmq so it can
+run in its own process or thread without Qt.
+
+"""
+import time
+
+import numpy as np
+import zmq
+
+
+class GameSimulator:
+    """Simulate a MYB game connected to an EventPoller.
+
+    Every request is timestamped when sent and when its reply arrives, a
+    request without reply after `timeout` ms is counted as dropped.
+
+    Each event carries its sequence number as additional information so the
+    trigger it produces can be matched with :meth:`event_times`.
+    """
+    QUIT_ZMQ = "QUIT_ZMQ"
+    START_ZMQ = "START_ZMQ"
+    EVENT_ZMQ = "EVENT_ZMQ"
+    RESULT_ZMQ = "RESULT_ZMQ"
+    OK_ZMQ = "OK_ZMQ"
+    TRIGGER_SETUP_ZMQ = "TRIGGER_SETUP_ZMQ"
+    SETTING_ZMQ = "SETTING_ZMQ"
+
+    _dtype_exchange = [('request', 'S32'),
+                       ('seq', 'int64'),
+                       ('posixtime', 'float64'),
+                       ('sent', 'float64'),
+                       ('replied', 'float64'),
+                       ]
+
+    def __init__(self, host='127.0.0.1', port=5555, mode='pair', identity=None, timeout=1000.):
+        """
+        Parameters
+        ----------
+        host, port :
+            Address of the EventPoller.
+        mode : str
+            'pair' or 'router', must match the EventPoller mode.
+        identity : bytes, optional
+            Client identity in 'router' mode.
+        timeout : float
+            Time in ms to wait a reply before counting the request as dropped.
+        """
+        self.addr = "tcp://{}:{}".format(host, port)
+        self.mode = mode
+        self.timeout = timeout
+
+        self.context = zmq.Context.instance()
+        if mode == 'router':
+            self.socket = self.context.socket(zmq.DEALER)
+            if identity is not None:
+                self.socket.setsockopt(zmq.IDENTITY, identity)
+        else:
+            self.socket = self.context.socket(zmq.PAIR)
+        self.socket.setsockopt(zmq.LINGER, 0)
+
+        self.exchanges = []
+        self.nb_late = 0
+        self.nb_event = 0
+
+    def connect(self):
+        """Connect and, in 'pair' mode, wait for the ready ping"""
+        self.socket.connect(self.addr)
+        if self.mode == 'pair':
+            return self._recv(lambda reply: reply.startswith(self.OK_ZMQ)) is not None
+        return True
+
+    def close(self):
+        self.socket.close()
+
+    def request(self, request, content='', seq=-1, expected=None):
+        """Send a request and wait for its reply.
+
+        Returns the reply or None if it did not come before the timeout.
+        The echo of the request is expected unless `expected` is given.
+        """
+        frame = request + "|" + content
+        if expected is None:
+            expected = frame.__eq__
+        posixtime = time.time() * 1000
+        sent = time.perf_counter()
+        self.socket.send_string(frame)
+        reply = self._recv(expected)
+        replied = time.perf_counter() if reply is not None else np.nan
+        self.exchanges.append((request, seq, posixtime, sent, replied))
+        return reply
+
+    def _recv(self, expected):
+        deadline = time.perf_counter() + self.timeout / 1000.
+        while True:
+            remaining = (deadline - time.perf_counter()) * 1000
+            if remaining <= 0 or not self.socket.poll(remaining):
+                return None
+            reply = self.socket.recv_string()
+            if expected(reply):
+                return reply
+            # reply of a request which already timed out
+            self.nb_late += 1
+
+    def start(self):
+        return self.request(self.START_ZMQ)
+
+    def trigger_setup(self, content):
+        return self.request(self.TRIGGER_SETUP_ZMQ, content)
+
+    def setting(self, content):
+        return self.request(self.SETTING_ZMQ, content)
+
+    def event(self, label):
+        """Send an event stamped now, return its sequence number"""
+        seq = self.nb_event
+        self.nb_event += 1
+        content = "{}/{};{}".format(time.time() * 1000, label, seq)
+        self.request(self.EVENT_ZMQ, content, seq=seq)
+        return seq
+
+    def result(self):
+        """Ask a result, any frame which is not an echo is the result"""
+        return self.request(self.RESULT_ZMQ, str(self.nb_event),
+                            expected=lambda reply: not reply.startswith(self.EVENT_ZMQ))
+
+    def quit(self):
+        return self.request(self.QUIT_ZMQ)
+
+    def run(self, nb_event, rate, labels=('S  1',), result_every=None):
+        """Send `nb_event` events at `rate` Hz.
+
+        Labels are cycled and a result is asked every `result_every` events.
+        Events are scheduled on absolute times so a slow reply does not
+        lower the average rate.
+        """
+        period = 1. / rate
+        t0 = time.perf_counter()
+        for i in range(nb_event):
+            delay = t0 + i * period - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.event(labels[i % len(labels)])
+            if result_every is not None and (i + 1) % result_every == 0:
+                self.result()
+
+    def get_exchanges(self):
+        """Return every exchange as a structured array"""
+        return np.array(self.exchanges, dtype=self._dtype_exchange)
+
+    def event_times(self):
+        """Return the posix time in ms of each event, indexed by sequence number"""
+        exchanges = self.get_exchanges()
+        events = exchanges[exchanges['request'] == self.EVENT_ZMQ.encode()]
+        times = np.full(self.nb_event, np.nan)
+        times[events['seq']] = events['posixtime']
+        return times
+
+    def stats(self):
+        """Return round-trip times (ms) and dropped counts per request type"""
+        exchanges = self.get_exchanges()
+        stats = {}
+        for request in np.unique(exchanges['request']):
+            ex = exchanges[exchanges['request'] == request]
+            rtt = (ex['replied'] - ex['sent']) * 1000
+            replied = rtt[~np.isnan(rtt)]
+            stats[request.decode()] = {
+                'nb_sent': ex.size,
+                'nb_dropped': int(np.isnan(rtt).sum()),
+                'rtt_mean': replied.mean() if replied.size else np.nan,
+                'rtt_p50': np.percentile(replied, 50) if replied.size else np.nan,
+                'rtt_p99': np.percentile(replied, 99) if replied.size else np.nan,
+                'rtt_max': replied.max() if replied.size else np.nan,
+            }
+        return stats
@@ -1,7 +1,8 @@
 # This class is used to create event that can be triggered by eventpoller, and listenned by mybpipeline
 
-from PyQt5 import QtCore
-from PyQt5.QtCore import QObject, pyqtSignal
+from . import commandbus
+from .runtime import QObject, pyqtSignal
+
 
 class Helper(QObject):
     resetSignal = pyqtSignal()
@@ -11,3 +12,14 @@ class Helper(QObject):
     settingSignal = pyqtSignal(str)
     stopSignal = pyqtSignal(bool)
 
+    def connect_bus(self, bus):
+        """Re-emit the commands published on `bus` as Qt signals"""
+        bus.subscribe(commandbus.Reset, lambda command: self.resetSignal.emit())
+        bus.subscribe(commandbus.StartSession,
+                      lambda command: self.startSessionSignal.emit(command.content))
+        bus.subscribe(commandbus.TriggerSetup,
+                      lambda command: self.triggerSetupSignal.emit(command.content))
+        bus.subscribe(commandbus.ResultRequest, lambda command: self.resultSignal.emit())
+        bus.subscribe(commandbus.Setting,
+                      lambda command: self.settingSignal.emit(command.content))
+        bus.subscribe(commandbus.Stop, lambda command: self.stopSignal.emit(True))
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Metrics of the nodes
+
+Counters, gauges (queue depths) and latency histograms recorded from the hot
+paths of the nodes. Recording is a few integer operations on preallocated
+storage, timestamps come from `time.perf_counter_ns`. Each metric has a
+single writer, the thread of its node, and is read by the exporters:
+
+- :class:`MetricsServer` serves the Prometheus text format on `/metrics`
+  and JSON on `/metrics.json`
+- :class:`MetricsDumper` writes the JSON to a file periodically
+
+All nodes record in the default registry, see :func:`get_registry`.
+
+"""
+import http.server
+import json
+import os
+import threading
+import time
+
+perf_counter_ns = time.perf_counter_ns
+
+
+class Counter:
+    """Monotonic count of events"""
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def to_dict(self):
+        return self.value
+
+
+class Gauge:
+    """Last value of a level, a queue depth for instance"""
+    kind = 'gauge'
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def to_dict(self):
+        return self.value
+
+
+class Histogram:
+    """Latency histogram with HDR-like log-linear buckets.
+
+    Values are recorded in ns. Each power of two is split in
+    `2 ** (precision - 1)` linear buckets, so a value is known within
+    `2 ** -(precision - 1)` relative error (3% with the default). Values above
+    `2 ** max_bits` ns (18 minutes) are clamped.
+    """
+    kind = 'histogram'
+
+    def __init__(self, precision=6, max_bits=40):
+        self.precision = precision
+        self.max_bits = max_bits
+        self.sub_count = 1 << precision
+        self.half_count = self.sub_count >> 1
+        self.max_value = (1 << max_bits) - 1
+        self.counts = [0] * (self.sub_count + (max_bits - precision) * self.half_count)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def _value(self, index):
+        """Highest value of a bucket"""
+        if index < self.sub_count:
+            return index
+        shift = (index - self.sub_count) // self.half_count + 1
+        mantissa = (index - self.sub_count) % self.half_count + self.half_count
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value):
+        """Record a value in ns, an int"""
+        if value >= self.sub_count:
+            if value > self.max_value:
+                value = self.max_value
+            shift = value.bit_length() - self.precision
+            index = self.sub_count + (shift - 1) * self.half_count + (value >> shift) - self.half_count
+        elif value > 0:
+            index = value
+        else:
+            value = index = 0
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def record_since(self, t0):
+        """Record the time elapsed since `t0` (from `perf_counter_ns`)"""
+        self.record(perf_counter_ns() - t0)
+
+    def percentile(self, q):
+        """Value in ns below which `q` % of the values are"""
+        if self.count == 0:
+            return 0
+        target = q / 100. * self.count
+        cumulated = 0
+        for index, n in enumerate(self.counts):
+            cumulated += n
+            if n and cumulated >= target:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count * 1e-9 if self.count else 0.,
+            'p50': self.percentile(50) * 1e-9,
+            'p90': self.percentile(90) * 1e-9,
+            'p99': self.percentile(99) * 1e-9,
+            'p999': self.percentile(99.9) * 1e-9,
+            'max': self.max * 1e-9,
+        }
+
+
+class MetricsRegistry:
+    """Metrics indexed by name and labels"""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(key, cls())
+        if not isinstance(metric, cls):
+            raise TypeError('{} is a {}'.format(name, metric.kind))
+        return metric
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name, **labels):
+        return self._get(Histogram, name, labels)
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def items(self):
+        with self._lock:
+            return sorted(self._metrics.items())
+
+    def to_dict(self):
+        """Metrics as {name: [{'labels': ..., 'value': ...}]}, latencies in s"""
+        out = {}
+        for (name, labels), metric in self.items():
+            out.setdefault(name, []).append({'labels': dict(labels), 'value': metric.to_dict()})
+        return out
+
+    def to_prometheus(self):
+        """Metrics in the Prometheus text format, histograms as summaries in s"""
+        lines = []
+        kinds = {}
+        for (name, labels), metric in self.items():
+            if name not in kinds:
+                kinds[name] = metric.kind
+                kind = 'summary' if metric.kind == 'histogram' else metric.kind
+                lines.append('# TYPE {} {}'.format(name, kind))
+            if metric.kind == 'histogram':
+                for q in (0.5, 0.9, 0.99, 0.999):
+                    lines.append('{}{} {:.9f}'.format(
+                        name, _format_labels(labels + (('quantile', str(q)), )),
+                        metric.percentile(q * 100) * 1e-9))
+                lines.append('{}_sum{} {:.9f}'.format(name, _format_labels(labels), metric.total * 1e-9))
+                lines.append('{}_count{} {}'.format(name, _format_labels(labels), metric.count))
+            else:
+                lines.append('{}{} {}'.format(name, _format_labels(labels), metric.value))
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in labels) + '}'
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    """The registry used by all the nodes"""
+    return _registry
+
+
+def node_label(node):
+    """Label identifying `node` in the metrics"""
+    name = getattr(node, 'name', None)
+    return name if name else '{}_{:x}'.format(type(node).__name__, id(node))
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        registry = self.server.registry
+        if self.path.startswith('/metrics.json'):
+            body = json.dumps(registry.to_dict()).encode()
+            content_type = 'application/json'
+        elif self.path.startswith('/metrics'):
+            body = registry.to_prometheus().encode()
+            content_type = 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """HTTP endpoint of a registry, to be scraped by Prometheus.
+
+    Only bound on localhost by default.
+    """
+    def __init__(self, registry=None, host='127.0.0.1', port=9100):
+        self.registry = get_registry() if registry is None else registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        self._server = http.server.ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._server.daemon_threads = True
+        self._server.registry = self.registry
+        # port 0 picks a free port
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MetricsServer',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+
+class MetricsDumper:
+    """Write the JSON of a registry to `filename` every `interval` s.
+
+    The file is replaced atomically so a reader never sees a partial dump.
+    """
+    def __init__(self, filename, interval=10., registry=None):
+        self.filename = filename
+        self.interval = interval
+        self.registry = get_registry() if registry is None else registry
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='MetricsDumper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        self.dump()
+
+    def dump(self):
+        data = {'time': time.time(), 'metrics': self.registry.to_dict()}
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.filename)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.dump()
@@ -4,47 +4,180 @@
 """
 Noise generator node
 
-Simple example of a custom Node class that generates a stream of random
-values. 
+Synthetic signal source used to test and benchmark the pipeline. It streams
+white, pink or brown noise on any number of channels and can inject ERP
+templates at known positions, announced on its `triggers` output.
 
 """
 import numpy as np
 
 from pyacq.core import Node, register_node_type
-from pyqtgraph.Qt import QtCore, QtGui
+
+from .metrics import get_registry, node_label, perf_counter_ns
+from .pacing import Pacer
+from .triggers import make_triggers, trigger_output_spec
+
+# IIR approximations of colored noise, normalized to unit variance at configure
+_noise_filters = {
+    # Paul Kellet's 4 poles pink noise approximation
+    'pink': ([0.049922035, -0.095993537, 0.050612699, -0.004408786],
+             [1., -2.494956002, 2.017265875, -0.522189400]),
+    # leaky integrator
+    'brown': ([1.], [1., -0.995]),
+}
 
 
 class NoiseGenerator(Node):
-    """A simple example node that generates gaussian noise.
+    """A node that generates multichannel noise.
+
+    Samples are drawn in float32 directly into a new chunk at each tick, as
+    the output may still hold the previous one (zmq sends it without a
+    copy). When `templates` are given, one of them is added to the signal every
+    `trigger_interval` and a trigger is sent at its first sample.
     """
     _output_specs = {'signals': dict(streamtype='analogsignal', dtype='float32',
-                                     shape=(-1, 1), compression='')}
+                                     shape=(-1, 1), compression=''),
+                     'triggers': trigger_output_spec(),
+                     }
 
     def __init__(self, **kargs):
         Node.__init__(self, **kargs)
-        self.timer = QtCore.QTimer(singleShot=False)
-        self.timer.timeout.connect(self.send_data)
 
-    def _configure(self, chunksize=100, sample_rate=1000.):
+    def _configure(self, chunksize=100, sample_rate=1000., nb_channel=1, color='white',
+                   amplitude=1., seed=None, templates=None, trigger_interval=1., speed=1.):
+        """
+        Parameters
+        ----------
+        chunksize : int
+            Number of samples sent at each tick.
+        sample_rate : float
+            Sample rate in Hz.
+        nb_channel : int
+            Number of channels.
+        color : str
+            'white', 'pink' or 'brown'.
+        amplitude : float
+            Standard deviation of the noise.
+        seed : int, optional
+            Seed of the random generator.
+        templates : dict, optional
+            {label (str): template} where template has shape (size,) or
+            (size, nb_channel). Templates are injected one after the other
+            and announced on the `triggers` output if it is configured.
+        trigger_interval : float
+            Time in s between two injected templates.
+        speed : float or None
+            1. for realtime, N for N times faster, None to generate as fast
+            as possible.
+        """
+        if color != 'white' and color not in _noise_filters:
+            raise ValueError('Unknown noise color {}'.format(color))
+
         self.chunksize = chunksize
         self.sample_rate = sample_rate
-        
-        self.output.spec['shape'] = (-1, 1)
-        self.output.spec['sample_rate'] = sample_rate
-        self.output.spec['buffer_size'] = 1000
+        self.nb_channel = nb_channel
+        self.color = color
+        self.amplitude = amplitude
+        self.seed = seed
+        self.speed = speed
+
+        self.templates = []
+        for label, template in (templates or {}).items():
+            template = np.asarray(template, dtype='float32')
+            if template.ndim == 1:
+                template = template[:, np.newaxis]
+            if template.shape[1] not in (1, nb_channel):
+                raise ValueError('Template {} has a wrong number of channels'.format(label))
+            self.templates.append((label.encode(), template))
+        self.trigger_step = int(round(trigger_interval * sample_rate))
+        if self.templates and self.trigger_step < 1:
+            raise ValueError('trigger_interval must be at least one sample')
+
+        self.outputs['signals'].spec['shape'] = (-1, nb_channel)
+        self.outputs['signals'].spec['sample_rate'] = sample_rate
+        self.outputs['signals'].spec['nb_channel'] = nb_channel
+        self.outputs['signals'].spec['buffer_size'] = 1000
+
+    def after_output_configure(self, outputname):
+        if outputname == 'signals':
+            channel_info = [{'name': 'ch{}'.format(c)} for c in range(self.nb_channel)]
+            self.outputs[outputname].params['channel_info'] = channel_info
 
     def _initialize(self):
+        self.rng = np.random.default_rng(self.seed)
+
+        if self.color != 'white':
+            import scipy.signal
+            self._lfilter = scipy.signal.lfilter
+            b, a = _noise_filters[self.color]
+            # scale b so the filtered noise has unit variance
+            impulse = np.zeros(100000)
+            impulse[0] = 1.
+            gain = np.sqrt(np.sum(self._lfilter(b, a, impulse)**2))
+            self.coefficients = (np.array(b) / gain, np.array(a))
+            self.zi = np.zeros((max(len(a), len(b)) - 1, self.nb_channel))
+
         self.head = 0
-        
+        self.next_trigger = self.trigger_step
+        self.nb_trigger = 0
+        self.send_triggers = self.outputs['triggers'].configured
+        # (pos, template) of templates not fully sent yet
+        self.injections = []
+
+        registry = get_registry()
+        node = node_label(self)
+        self.nb_chunk = registry.counter('pyacq_ext_noise_chunks_total', node=node)
+        self.nb_injected = registry.counter('pyacq_ext_noise_triggers_total', node=node)
+        self.chunk_latency = registry.histogram('pyacq_ext_noise_chunk_seconds', node=node)
+
+        self.pacer = Pacer(self.sample_rate, self.chunksize, self.send_data, speed=self.speed)
+
     def _start(self):
-        self.timer.start(int(1000 * self.chunksize / self.sample_rate))
+        self.pacer.start()
 
     def _stop(self):
-        self.timer.stop()
-    
+        self.pacer.stop()
+
     def _close(self):
         pass
-    
+
     def send_data(self):
+        t0 = perf_counter_ns()
+        chunk = self.rng.standard_normal((self.chunksize, self.nb_channel), dtype=np.float32)
+        if self.color != 'white':
+            b, a = self.coefficients
+            chunk[:], self.zi = self._lfilter(b, a, chunk, axis=0, zi=self.zi)
+        chunk *= self.amplitude
+
+        i1 = self.head
         self.head += self.chunksize
-        self.output.send(np.random.normal(size=(self.chunksize, 1)).astype('float32'), index=self.head)
+        if self.templates:
+            self.inject(chunk, i1, self.head)
+
+        self.outputs['signals'].send(chunk, index=self.head)
+        self.nb_chunk.inc()
+        self.chunk_latency.record_since(t0)
+
+    def inject(self, chunk, i1, i2):
+        """Add the templates overlapping [i1, i2) to `chunk` and send the new triggers"""
+        pos, labels = [], []
+        while self.next_trigger < i2:
+            label, template = self.templates[self.nb_trigger % len(self.templates)]
+            self.injections.append((self.next_trigger, template))
+            pos.append(self.next_trigger)
+            labels.append(label)
+            self.nb_trigger += 1
+            self.next_trigger += self.trigger_step
+
+        for start, template in self.injections:
+            t1 = max(i1 - start, 0)
+            t2 = min(i2 - start, template.shape[0])
+            chunk[start + t1 - i1:start + t2 - i1] += template[t1:t2]
+        self.injections = [(start, template) for start, template in self.injections
+                           if start + template.shape[0] > i2]
+
+        if pos:
+            self.nb_injected.inc(len(pos))
+            if self.send_triggers:
+                triggers = make_triggers(pos, description=labels)
+                self.outputs['triggers'].send(triggers, index=self.nb_trigger)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+OpenBCI board emulator
+
+Virtual serial port (a pty) speaking the OpenBCI board protocol, used in
+place of a board to test and benchmark OpenBCIListener. It answers the
+'v' (reset, banner ending with '$$$'), 'b' (start), 's' (stop), '~N'
+(sample rate), 0xF0 N (baud rate) and '?' commands, and streams packets
+framed as the board does. Corrupted end bytes, dropped bytes and sample ID
+gaps can be injected at given rates. POSIX only.
+
+"""
+import logging
+import os
+import select
+import threading
+import time
+import tty
+
+import numpy as np
+
+from .eeg_openBCIListener import (_BAUD_CODES, _END_BYTE, _PACKET_SIZE, _START_BYTE,
+                                  board_profiles)
+
+logger = logging.getLogger(__name__)
+
+
+class OpenBCIEmulator:
+    """Emulate an OpenBCI board behind a pty.
+
+    Open `port` (the slave side of the pty) as the serial device. Each
+    channel streams a sine of `amplitude` uV, the channel c at c + 1 Hz.
+    A packet which does not fit in the pty buffer is lost, as with a board
+    whose reader is too slow.
+    """
+    def __init__(self, board='cyton', corrupt_rate=0., drop_byte_rate=0., id_gap_rate=0.,
+                 amplitude=100., seed=None):
+        """
+        Parameters
+        ----------
+        board : str
+            Profile of the board, see `eeg_openBCIListener.board_profiles`.
+        corrupt_rate : float
+            Probability of a packet to be sent with a wrong end byte.
+        drop_byte_rate : float
+            Probability of a packet to be sent with one byte missing.
+        id_gap_rate : float
+            Probability of a packet not to be sent, which makes a gap in
+            the sample IDs.
+        amplitude : float
+            Amplitude in uV of the sines.
+        seed : int, optional
+            Seed of the random generator.
+        """
+        self.profile = board_profiles[board]
+        self.corrupt_rate = corrupt_rate
+        self.drop_byte_rate = drop_byte_rate
+        self.id_gap_rate = id_gap_rate
+        self.amplitude = amplitude
+        self.rng = np.random.default_rng(seed)
+
+        self.packet_rate = self.profile.packet_rate
+        self.baud = 115200
+        self.streaming = False
+        self.running = False
+        self._thread = None
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.nb_packet = 0
+        self.nb_skipped = 0
+        self.nb_corrupted = 0
+        self.nb_dropped_byte = 0
+        self.nb_overflow_packet = 0
+
+    def stats(self):
+        """Counts of the packets generated and of the errors injected"""
+        return {
+            'packets': self.nb_packet,
+            'skipped': self.nb_skipped,
+            'corrupted': self.nb_corrupted,
+            'dropped_bytes': self.nb_dropped_byte,
+            'overflow': self.nb_overflow_packet,
+        }
+
+    def start(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='OpenBCIEmulator', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        self._thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def banner(self):
+        lines = ['OpenBCI V3 8-16 channel', 'On Board ADS1299 Device ID: 0x3E']
+        if self.profile.daisy:
+            lines.append('On Daisy ADS1299 Device ID: 0x3E')
+        lines += ['LIS3DH Device ID: 0x33', 'Firmware: v3.1.2', '$$$']
+        return '\n'.join(lines)
+
+    def reply(self, message):
+        self._write(message.encode('utf-8'))
+
+    def handle_commands(self, data):
+        i = 0
+        while i < len(data):
+            command = data[i:i + 1]
+            i += 1
+            if command == b'v':
+                self.streaming = False
+                self.packet_rate = self.profile.packet_rate
+                self.reply(self.banner())
+            elif command == b'b':
+                self.streaming = True
+                self.sample_index = 0
+                self.sample_id = 0
+                self.t_start = time.perf_counter()
+            elif command == b's':
+                self.streaming = False
+            elif command == b'?':
+                self.reply('Board ADS Registers\n$$$')
+            elif command in (b'~', b'\xf0'):
+                if i >= len(data):
+                    data += os.read(self.master, 1)
+                code = data[i:i + 1]
+                i += 1
+                if command == b'~':
+                    self.set_sample_rate(code.decode('utf-8', 'replace'))
+                else:
+                    self.set_baud(code)
+            # channel settings and the other commands are accepted silently
+
+    def set_sample_rate(self, code):
+        rates = {c: rate for rate, c in self.profile.rate_codes.items()}
+        if code == '~':
+            self.reply('Sample rate is {}Hz$$$'.format(int(self.packet_rate)))
+        elif code in rates:
+            self.packet_rate = rates[code]
+            self.reply('Success: Sample rate is {}Hz$$$'.format(int(self.packet_rate)))
+        else:
+            self.reply('Failure: invalid sample rate$$$')
+
+    def set_baud(self, code):
+        bauds = {c: baud for baud, c in _BAUD_CODES.items()}
+        baud = bauds.get(b'\xf0' + code)
+        if baud is None:
+            self.reply('Failure: invalid baud rate$$$')
+        else:
+            self.baud = baud
+            self.reply('Success: Switch your baud rate to {}$$$'.format(baud))
+
+    def make_packets(self, nb_packet):
+        """Build `nb_packet` packets (nb_packet, 33) following the last sent"""
+        profile = self.profile
+        index = self.sample_index + np.arange(nb_packet)
+        sample_ids = (self.sample_id + np.arange(nb_packet)) % 256
+        packets = np.zeros((nb_packet, _PACKET_SIZE), dtype=np.uint8)
+        packets[:, 0] = _START_BYTE
+        packets[:, 1] = sample_ids
+        packets[:, -1] = _END_BYTE
+
+        t = (index // profile.packets_per_sample) / (self.packet_rate / profile.packets_per_sample)
+        channel = np.arange(profile.packet_channel)
+        if profile.daisy:
+            # odd sample IDs carry the channels 1-8, even the channels 9-16
+            channel = channel + np.where(sample_ids % 2 == 1, 0, profile.packet_channel)[:, np.newaxis]
+        values = self.amplitude * np.sin(2 * np.pi * (channel + 1) * t[:, np.newaxis])
+        counts = np.round(values / profile.scale).astype(np.int32) & 0xFFFFFF
+        slots = packets[:, 2:2 + 3 * profile.packet_channel].reshape(nb_packet, -1, 3)
+        slots[:, :, 0] = counts >> 16
+        slots[:, :, 1] = (counts >> 8) & 0xFF
+        slots[:, :, 2] = counts & 0xFF
+        # accelerometer at rest, 1 g on z
+        packets[:, 26:32] = np.array([0, 0, 0, 0, 16384 >> 8 & 0xFF, 0], dtype=np.uint8)
+
+        self.sample_index += nb_packet
+        self.sample_id = (self.sample_id + nb_packet) % 256
+        return packets
+
+    def inject(self, packets):
+        """Apply the errors and return the bytes to send"""
+        nb_packet = packets.shape[0]
+        self.nb_packet += nb_packet
+        draws = self.rng.random((3, nb_packet))
+        corrupted = draws[0] < self.corrupt_rate
+        packets[corrupted, -1] = 0x00
+        kept = draws[1] >= self.id_gap_rate
+        # a skipped packet is never seen by the reader
+        self.nb_corrupted += int((corrupted & kept).sum())
+        self.nb_skipped += int(nb_packet - kept.sum())
+
+        data = packets[kept].ravel()
+        dropped = np.flatnonzero(draws[2][kept] < self.drop_byte_rate)
+        if dropped.size:
+            offsets = self.rng.integers(0, _PACKET_SIZE, dropped.size)
+            data = np.delete(data, dropped * _PACKET_SIZE + offsets)
+            self.nb_dropped_byte += dropped.size
+        return data.tobytes()
+
+    def _write(self, data):
+        try:
+            sent = os.write(self.master, data)
+        except BlockingIOError:
+            sent = 0
+        return sent
+
+    def _run(self):
+        tick = 0.005
+        while self.running:
+            ready, _, _ = select.select([self.master], [], [], tick)
+            if ready:
+                try:
+                    self.handle_commands(os.read(self.master, 1024))
+                except OSError:
+                    pass
+            if not self.streaming:
+                continue
+
+            due = int((time.perf_counter() - self.t_start) * self.packet_rate) - self.sample_index
+            if due > 0:
+                data = self.inject(self.make_packets(due))
+                sent = self._write(data)
+                if sent < len(data):
+                    # the reader is too slow, what does not fit is lost
+                    self.nb_overflow_packet += -(-(len(data) - sent) // _PACKET_SIZE)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Pacing engine for timer driven source nodes
+
+A QTimer interval is a whole number of ms, so a source sending
+`chunksize` samples per tick drifts as soon as `chunksize / sample_rate` is
+not an integer number of ms. :class:`Pacer` instead counts the samples due
+since start on a monotonic clock and sends as many chunks as needed at each
+wakeup. It runs its own thread, no Qt event loop is needed.
+
+"""
+import threading
+import time
+
+
+class Pacer:
+    """Call `callback()` once per chunk at the pace of `sample_rate`.
+
+    Parameters
+    ----------
+    sample_rate : float
+        Nominal sample rate in Hz.
+    chunksize : int
+        Number of samples sent by each call of `callback`.
+    callback : callable
+        Called without argument from the pacer thread.
+    speed : float or None
+        1. for realtime, N for N times faster, None to send as fast as
+        possible.
+    """
+    def __init__(self, sample_rate, chunksize, callback, speed=1.):
+        if speed is not None and speed <= 0:
+            raise ValueError('speed must be > 0 or None')
+        self.sample_rate = sample_rate
+        self.chunksize = chunksize
+        self.callback = callback
+        self.speed = speed
+
+        self._thread = None
+        self._stop_event = threading.Event()
+        self.t0 = None
+        self.t_stop = None
+        self.nb_sample = 0
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self._stop_event.clear()
+        self.nb_sample = 0
+        self.t0 = time.perf_counter()
+        self.t_stop = None
+        self._thread = threading.Thread(target=self._run, name='Pacer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop_event.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        self.t_stop = time.perf_counter()
+
+    def elapsed(self):
+        t = self.t_stop if self.t_stop is not None else time.perf_counter()
+        return t - self.t0
+
+    def samples_due(self):
+        """Number of samples which should have been sent but are not yet"""
+        if self.speed is None:
+            return self.chunksize
+        return int(self.elapsed() * self.sample_rate * self.speed) - self.nb_sample
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            due = self.samples_due()
+            while due >= self.chunksize and not self._stop_event.is_set():
+                self.callback()
+                self.nb_sample += self.chunksize
+                due -= self.chunksize
+
+            if self.speed is not None:
+                next_time = (self.nb_sample + self.chunksize) / (self.sample_rate * self.speed)
+                self._stop_event.wait(max(next_time - self.elapsed(), 0.))
+
+    def get_stats(self):
+        """Return the nominal and the actual rate in samples per second"""
+        elapsed = self.elapsed() if self.t0 is not None else 0.
+        nominal = None if self.speed is None else self.sample_rate * self.speed
+        return {
+            'nominal_rate': nominal,
+            'actual_rate': self.nb_sample / elapsed if elapsed > 0 else 0.,
+            'nb_sample': self.nb_sample,
+            'elapsed': elapsed,
+        }
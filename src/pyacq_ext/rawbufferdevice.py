@@ -2,25 +2,170 @@
 # Copyright (c) 2016, French National Center for Scientific Research (CNRS)
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
+import logging
 import os.path
-import mne
+import threading
+
 import numpy as np
-from pyqtgraph.Qt import QtCore, QtGui
 
 from pyacq.core import Node, register_node_type
 
-_dtype_trigger = [('pos', 'int64'),
-                  ('points', 'int64'),
-                  ('channel', 'int64'),
-                  ('type', 'S16'),  # TODO check size
-                  ('description', 'S16'),  # TODO check size
-                  ]
+from .metrics import get_registry, node_label, perf_counter_ns
+from .pacing import Pacer
+from .recorder import positions_to_rows
+from .triggers import convert_triggers, make_triggers, trigger_output_spec
+
+logger = logging.getLogger(__name__)
+
+
+class RawSource:
+    """Lazy reader of a recorded file.
+
+    Samples are read from disk by blocks of `block_size` and served as
+    slices, so replaying a segment only reads the blocks it covers.
+    Subclasses set `nb_channel`, `sample_rate`, `channel_names`, `length`,
+    `dtype`, `markers` (sorted by pos, in samples from the file start) and
+    implement `_read`.
+    """
+    block_size = 1024
+
+    def __init__(self):
+        self._block = None
+        self._block_start = 0
+
+    def read(self, i1, i2):
+        """Return the samples [i1, i2) with shape (i2 - i1, nb_channel)"""
+        block = self._block
+        if block is None or i1 < self._block_start or i2 > self._block_start + block.shape[0]:
+            stop = min(max(i2, i1 + self.block_size), self.length)
+            self._block = block = self._read(i1, stop)
+            self._block_start = i1
+        return block[i1 - self._block_start:i2 - self._block_start]
+
+    def marker_positions(self, label):
+        """Sorted positions of the markers of `label`"""
+        if isinstance(label, str):
+            label = label.encode()
+        return self.markers['pos'][self.markers['description'] == label]
+
+    def close(self):
+        pass
+
+
+class BrainVisionSource(RawSource):
+    """BrainVision file (.vhdr) read with mne."""
+    def __init__(self, filename):
+        RawSource.__init__(self)
+        import mne
+        self.raw = mne.io.read_raw_brainvision(filename, scale=1e6, preload=False, verbose=False)
+
+        self.nb_channel = self.raw.info['nchan']
+        self.sample_rate = self.raw.info['sfreq']
+        self.channel_names = self.raw.info['ch_names']
+        self.length = self.raw.n_times
+        self.dtype = np.dtype('float64')
+        self.block_size = int(self.sample_rate)
+        self.markers = self.load_markers(self.raw)
+
+    def load_markers(self, raw):
+        pos, types, labels = [], [], []
+
+        for m in raw.annotations:
+            description, label = m['description'].split('/')
+            pos.append(int(round(m['onset'] * self.sample_rate)))
+            types.append(description.encode())
+            labels.append(label.encode())
+
+        # first annotation is the "New Segment" marker
+        markers = make_triggers(pos[1:], type=types[1:], description=labels[1:])
+
+        return markers[np.argsort(markers['pos'], kind='stable')]
+
+    def _read(self, i1, i2):
+        return self.raw.get_data(start=i1, stop=i2).T
+
+
+class RecorderSource(RawSource):
+    """HDF5 file written by :class:`recorder.Recorder`.
+
+    Its marker index is used for the positions of a label. The stream
+    positions of the markers are mapped to rows with the segments of the
+    file, the markers of samples not recorded are dropped.
+    """
+    def __init__(self, filename):
+        RawSource.__init__(self)
+        try:
+            # registers the 'blosc' and 'lz4' filters of the Recorder
+            import hdf5plugin
+        except ImportError:
+            pass
+        import h5py
+        self.file = h5py.File(filename, 'r')
+        self.signals = self.file['signals']
+        attrs = self.signals.attrs
+
+        self.length, self.nb_channel = self.signals.shape
+        self.sample_rate = float(attrs['sample_rate'])
+        if 'channel_names' in attrs:
+            self.channel_names = [name.decode() for name in attrs['channel_names']]
+        else:
+            self.channel_names = ['ch{}'.format(c) for c in range(self.nb_channel)]
+        self.dtype = self.signals.dtype
+        if self.signals.chunks is not None:
+            self.block_size = self.signals.chunks[0]
+
+        if 'segments' in self.file:
+            self.segments = self.file['segments'][:]
+        else:
+            # older files, a single segment from start_pos
+            self.segments = np.array([[0, int(attrs.get('start_pos', 0))]], dtype='int64')
+        markers = convert_triggers(self.file['triggers'][:])
+        markers['pos'] = self.rows(markers['pos'])
+        self.markers = markers[markers['pos'] >= 0]
+        if self.markers.shape[0] < markers.shape[0]:
+            logger.warning("%s: %i markers out of the recorded samples dropped", filename,
+                           markers.shape[0] - self.markers.shape[0])
+        order = np.argsort(self.markers['pos'], kind='stable')
+        self.markers = self.markers[order]
+
+    def rows(self, pos):
+        """Rows of stream positions, -1 if not recorded"""
+        return positions_to_rows(self.segments, self.length, pos)
+
+    def marker_positions(self, label):
+        if isinstance(label, bytes):
+            label = label.decode()
+        index = self.file.get('marker_index')
+        if index is None or label.replace('/', '_') not in index:
+            return RawSource.marker_positions(self, label)
+        rows = self.rows(index[label.replace('/', '_')][:])
+        return np.sort(rows[rows >= 0])
+
+    def _read(self, i1, i2):
+        return self.signals[i1:i2]
+
+    def close(self):
+        self.file.close()
+
+
+_sources = {
+    '.vhdr': BrainVisionSource,
+    '.h5': RecorderSource,
+    '.hdf5': RecorderSource,
+}
 
 
 class RawDeviceBuffer(Node):
     """A fake analogsignal device.
 
-    This node streams data from a predefined buffer in an endless loop.
+    This node replays a recorded file, a BrainVision file or a Recorder
+    HDF5 file, in an endless loop. The replay can be restricted to a
+    `[start, stop)` segment or to windows around labeled markers, and moved
+    with :meth:`seek` and :meth:`seek_marker`. Only the needed parts of the
+    file are read.
+
+    The `signals` output can be configured with `transfermode='sharedmemory'`
+    so local consumers read the ring buffer without a copy per consumer.
     """
     _output_specs = {
         'signals': dict(
@@ -28,10 +173,7 @@ class RawDeviceBuffer(Node):
             shape=(-1, 16),
             compression='',
             sample_rate=30.),
-        'triggers': dict(
-            streamtype='event',
-            dtype=_dtype_trigger,
-            shape=(-1,)),
+        'triggers': trigger_output_spec(),
     }
 
     def __init__(self, **kargs):
@@ -41,67 +183,85 @@ class RawDeviceBuffer(Node):
         """
         Parameters
         ----------
-        nb_channel: int
-            Number of output channels.
-        sample_interval: float
-            Time duration of a single data sample. This determines the rate at
-            which data is sent.
+        raw_file: str
+            Path of a BrainVision (.vhdr) or Recorder (.h5) file.
         chunksize: int
             Length of chunks to send.
-        buffer: array
-            Data to send. Must have `buffer.shape[0] == nb_channel`.
+        speed: float or None
+            1. to replay in realtime, N for N times faster, None to replay
+            as fast as possible.
+        buffer_duration: float
+            Duration in s of the shared memory ring buffer of `signals`.
+        start, stop: int, optional
+            Replay only the samples [start, stop) of the file.
+        windows: dict, optional
+            {label (str): (left_sweep, right_sweep)} replay only the
+            windows [pos - left_sweep, pos + right_sweep) (in s) around the
+            markers of these labels.
+        loop: bool
+            Replay endlessly, else stop at the end. Default is True.
         """
         return Node.configure(self, *args, **kwargs)
 
-    def _configure(self, raw_file, chunksize=10):
+    def _configure(self, raw_file, chunksize=10, speed=1., buffer_duration=10.,
+                   start=None, stop=None, windows=None, loop=True):
 
         if not os.path.isfile(raw_file):
             raise ValueError("{} don't exist!".format(raw_file))
 
         extension = os.path.splitext(raw_file)[1]
-        if extension == '.vhdr':
-            raw = mne.io.read_raw_brainvision(raw_file, scale=1e6, verbose=False)
-        else:
+        if extension not in _sources:
             raise ValueError("{} file not supported".format(raw_file))
+        self.source = _sources[extension](raw_file)
 
-        self.nb_channel = raw.info['nchan']
-        self.sample_interval = 1./raw.info['sfreq']
+        self.nb_channel = self.source.nb_channel
+        self.sample_interval = 1. / self.source.sample_rate
         self.chunksize = chunksize
+        self.speed = speed
+        self.loop = loop
 
-        self.channel_names = raw.info['ch_names']
+        self.channel_names = self.source.channel_names
+        self.markers = self.source.markers
+        self.length = self.source.length
+        self.segments = self.make_segments(start, stop, windows)
 
         self.outputs['signals'].spec['shape'] = (-1, self.nb_channel)
         self.outputs['signals'].spec['sample_rate'] = 1. / self.sample_interval
+        self.outputs['signals'].spec['buffer_size'] = int(buffer_duration / self.sample_interval)
+        self.outputs['signals'].spec['double'] = True
+        self.outputs['signals'].spec['dtype'] = self.source.dtype.name
 
-        self.buffer = np.transpose(raw.get_data())
-        # TODO raise exception
-        assert self.buffer.shape[1] == self.nb_channel, 'Wrong nb_channel'
-        assert self.buffer.shape[0] % chunksize == 0, 'Wrong buffer.shape[0] not multiple chunksize'
-
-        # chan = 0
-        # for sensor in raw.info['chs']:
-        #     self.buffer[:, chan] /= sensor['cal']*1e6
-        #     chan += 1
-
-        self.markers = self.load_markers(raw)
-
-        self.length = self.buffer.shape[0]
-
-        self.outputs['signals'].spec['dtype'] = self.buffer.dtype.name
-
-    def load_markers(self, raw):
-        markers_list = list()
-
-        for m in raw.annotations:
-            pos = int(m['onset']*1000)
-            description, label = m['description'].split('/')
-
-            markers_list.append(
-                (pos, 0, 0, description.encode(), label.encode()))
+    def make_segments(self, start=None, stop=None, windows=None):
+        """Return the sorted, non overlapping [start, stop) segments to replay"""
+        start = 0 if start is None else max(start, 0)
+        stop = self.length if stop is None else min(stop, self.length)
 
-        del markers_list[0]
-
-        return markers_list
+        if windows is None:
+            segments = np.array([[start, stop]], dtype='int64')
+        else:
+            bounds = []
+            for label, (left_sweep, right_sweep) in windows.items():
+                pos = self.source.marker_positions(label)
+                left = int(left_sweep / self.sample_interval)
+                right = int(right_sweep / self.sample_interval)
+                bounds.append(np.stack([pos - left, pos + right], axis=1))
+            segments = np.concatenate(bounds).astype('int64')
+            segments = np.clip(segments, start, stop)
+            segments = segments[np.argsort(segments[:, 0], kind='stable')]
+
+            # merge overlapping windows
+            merged = [segments[0].copy()] if segments.shape[0] else []
+            for seg_start, seg_stop in segments[1:]:
+                if seg_start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], seg_stop)
+                else:
+                    merged.append(np.array([seg_start, seg_stop]))
+            segments = np.array(merged, dtype='int64').reshape(-1, 2)
+
+        segments = segments[segments[:, 1] > segments[:, 0]]
+        if segments.shape[0] == 0:
+            raise ValueError('Nothing to replay')
+        return segments
 
     def after_output_configure(self, outputname):
         if outputname == 'signals':
@@ -111,37 +271,93 @@ class RawDeviceBuffer(Node):
 
     def _initialize(self):
         self.head = 0
-        ival = int(self.chunksize * self.sample_interval * 1000)
-        self.timer = QtCore.QTimer(singleShot=False, interval=ival)
-        self.timer.timeout.connect(self.send_data)
+        self.nb_marker = 0
+        self.lock = threading.Lock()
+        self.segment = 0
+        self.cursor = self.segments[0, 0]
+        self.pacer = Pacer(1. / self.sample_interval, self.chunksize, self.send_data,
+                           speed=self.speed)
+
+        registry = get_registry()
+        node = node_label(self)
+        self.nb_chunk = registry.counter('pyacq_ext_rawbuffer_chunks_total', node=node)
+        self.nb_marker_sent = registry.counter('pyacq_ext_rawbuffer_markers_total', node=node)
+        self.chunk_latency = registry.histogram('pyacq_ext_rawbuffer_chunk_seconds', node=node)
 
     def _start(self):
         self.head = 0
-        self.timer.start()
+        self.pacer.start()
 
     def _stop(self):
-        self.timer.stop()
+        self.pacer.stop()
 
     def _close(self):
-        pass
+        self.source.close()
 
-    def send_data(self):
-        i1 = self.head % self.length
-        self.head += self.chunksize
-        i2 = i1 + self.chunksize
-        self.outputs['signals'].send(self.buffer[i1:i2, :], index=self.head)
-
-        markers_to_send = [mrk for mrk in self.markers if i1 < mrk[0] <= i2]
-
-        # TODO Comm between epocher had to be improve useless data sended
-        nb_marker = len(markers_to_send)
+    def seek(self, pos):
+        """Continue the replay at sample `pos` of the file.
 
-        markers = np.empty((nb_marker,), dtype=_dtype_trigger)
-        for m in range(nb_marker):
-            markers['pos'][m], markers['points'][m], markers['channel'][m] = markers_to_send[m][0], 0, 0
-            markers['type'][m], markers['description'][m] = markers_to_send[m][3], markers_to_send[m][4]
+        If `pos` is outside the replayed segments the replay continues at
+        the start of the next one.
+        """
+        with self.lock:
+            segment = np.searchsorted(self.segments[:, 1], pos, side='right')
+            if segment >= self.segments.shape[0]:
+                raise ValueError('{} is after the last replayed sample'.format(pos))
+            self.segment = segment
+            self.cursor = max(pos, self.segments[segment, 0])
+
+    def seek_marker(self, label, num=0, left_sweep=0.):
+        """Continue the replay `left_sweep` s before the `num`-th marker of `label`"""
+        pos = self.source.marker_positions(label)[num]
+        self.seek(pos - int(left_sweep / self.sample_interval))
 
-        self.outputs['triggers'].send(markers, index=nb_marker)
+    def send_data(self):
+        t0 = perf_counter_ns()
+        pieces, markers = [], []
+        n = 0
+        with self.lock:
+            while n < self.chunksize:
+                if self.segment >= self.segments.shape[0]:
+                    if not self.loop:
+                        break
+                    self.segment = 0
+                    self.cursor = self.segments[0, 0]
+
+                i1 = self.cursor
+                i2 = min(i1 + self.chunksize - n, self.segments[self.segment, 1])
+                pieces.append(self.source.read(i1, i2))
+
+                # markers are sorted by pos so the piece is a contiguous slice
+                m1, m2 = np.searchsorted(self.markers['pos'], [i1, i2], side='left')
+                if m2 > m1:
+                    piece_markers = self.markers[m1:m2].copy()
+                    piece_markers['pos'] += self.head + n - i1
+                    markers.append(piece_markers)
+
+                n += i2 - i1
+                self.cursor = i2
+                if i2 >= self.segments[self.segment, 1]:
+                    self.segment += 1
+                    if self.segment < self.segments.shape[0]:
+                        self.cursor = self.segments[self.segment, 0]
+
+        if n == 0:
+            # end of the replay
+            self.pacer.stop()
+            return
+
+        self.head += n
+        sigs = pieces[0] if len(pieces) == 1 else np.concatenate(pieces, axis=0)
+        self.outputs['signals'].send(sigs, index=self.head)
+
+        if markers:
+            markers = markers[0] if len(markers) == 1 else np.concatenate(markers)
+            self.nb_marker += markers.shape[0]
+            self.outputs['triggers'].send(markers, index=self.nb_marker)
+            self.nb_marker_sent.inc(markers.shape[0])
+        self.nb_chunk.inc()
+        self.chunk_latency.record_since(t0)
 
 
 register_node_type(RawDeviceBuffer)
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Recorder node
+
+Writes a signals/triggers pair to an HDF5 file. Chunks are handed to a
+background writer thread through a bounded queue and written in batches to
+chunked, optionally compressed datasets. On close, the marker positions are
+indexed per label for fast random access.
+
+File layout::
+
+    /signals                (nb_sample, nb_channel), attrs sample_rate,
+                            channel_names and start_pos, the stream position
+                            of the first sample
+    /segments               (nb_segment, 2) int64, the (row, stream position)
+                            of the first sample of each continuous run
+    /triggers               triggers sorted by pos, in the shared trigger dtype
+    /marker_index/<label>   sorted stream positions of the triggers of <label>
+
+The signals are appended as received: after a gap or a restart of the
+stream a new segment starts, use :func:`positions_to_rows` to find the rows
+of stream positions.
+
+"""
+import importlib.util
+import logging
+import queue
+import threading
+
+import numpy as np
+
+from pyacq.core import Node, register_node_type
+
+from .metrics import get_registry, node_label, perf_counter_ns
+from .runtime import ThreadPollInput
+from .triggers import TRIGGER_VERSION, convert_triggers, dtype_trigger
+
+logger = logging.getLogger(__name__)
+
+# h5py is imported by the writer, not to slow down the import of the module
+HAVE_H5PY = importlib.util.find_spec('h5py') is not None
+
+
+def compression_options(compression, level=5):
+    """Return the h5py create_dataset options of a compression name.
+
+    'gzip' and 'lzf' are built in h5py, 'blosc' (blosc + lz4) and 'lz4'
+    need the `hdf5plugin` package.
+    """
+    if compression is None or compression == '':
+        return {}
+    if compression == 'gzip':
+        return dict(compression='gzip', compression_opts=level)
+    if compression == 'lzf':
+        return dict(compression='lzf')
+    if compression in ('blosc', 'lz4'):
+        try:
+            import hdf5plugin
+        except ImportError:
+            raise ImportError("{} compression depends on the `hdf5plugin` package, "
+                              "but it could not be imported.".format(compression))
+        if compression == 'lz4':
+            return dict(hdf5plugin.LZ4())
+        return dict(hdf5plugin.Blosc(cname='lz4', clevel=level, shuffle=hdf5plugin.Blosc.SHUFFLE))
+    raise ValueError('Unknown compression {}'.format(compression))
+
+
+def positions_to_rows(segments, length, pos):
+    """Rows of the stream positions `pos` in a file of `length` rows.
+
+    `segments` is the /segments table. A position not recorded gives -1,
+    a position recorded twice (a stream restarted) the row of the last
+    segment.
+    """
+    pos = np.asarray(pos, dtype='int64')
+    rows = np.full(pos.shape, -1, dtype='int64')
+    segments = np.asarray(segments, dtype='int64').reshape(-1, 2)
+    ends = np.append(segments[1:, 0], length)
+    for (row, start), end in zip(segments, ends):
+        inside = (pos >= start) & (pos < start + end - row)
+        rows[inside] = row + pos[inside] - start
+    return rows
+
+
+class RecorderWriter:
+    """Append signals and triggers to an HDF5 file from a background thread.
+
+    :meth:`put` blocks when `max_pending` chunks are waiting, which bounds
+    the memory and never loses data. The writer drains every pending chunk
+    before writing so batches grow when it falls behind.
+
+    A chunk which does not follow the previous one starts a new segment,
+    see :func:`positions_to_rows`.
+
+    If writing fails the error is kept, the following chunks are dropped
+    and counted in `nb_dropped`, and :meth:`stop` raises it. After
+    :meth:`stop` the writer can be started again, it appends to the same
+    file.
+
+    The metrics are labelled with `node`, the writer itself by default.
+    """
+    _stop_item = ('stop', None, None)
+
+    def __init__(self, filename, nb_channel, dtype='float32', sample_rate=1., channel_names=None,
+                 compression=None, compression_level=5, chunk_duration=1., max_pending=256,
+                 node=None):
+        assert HAVE_H5PY, "Recorder depends on the `h5py` package, but it could not be imported."
+        self.filename = filename
+        self.nb_channel = nb_channel
+        self.sample_rate = sample_rate
+
+        import h5py
+        self.file = h5py.File(filename, 'w')
+        options = compression_options(compression, compression_level)
+        chunk_rows = max(int(chunk_duration * sample_rate), 1)
+        self.signals = self.file.create_dataset(
+            'signals', shape=(0, nb_channel), maxshape=(None, nb_channel), dtype=dtype,
+            chunks=(chunk_rows, nb_channel), **options)
+        self.signals.attrs['sample_rate'] = sample_rate
+        if channel_names is not None:
+            self.signals.attrs['channel_names'] = [name.encode() for name in channel_names]
+        self.triggers = self.file.create_dataset(
+            'triggers', shape=(0,), maxshape=(None,), dtype=dtype_trigger,
+            chunks=(1024,), **options)
+        self.triggers.attrs['trigger_version'] = TRIGGER_VERSION
+        self.segments = self.file.create_dataset(
+            'segments', shape=(0, 2), maxshape=(None, 2), dtype='int64', chunks=(256, 2))
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self.start_pos = None
+        self.last_pos = None
+        self.nb_sample = 0
+        self.nb_trigger = 0
+        self.nb_gap = 0
+        self.nb_dropped = 0
+        self.error = None
+
+        registry = get_registry()
+        node = node_label(self) if node is None else node
+        self.nb_batch = registry.counter('pyacq_ext_recorder_batches_total', node=node)
+        self.nb_written = registry.counter('pyacq_ext_recorder_samples_total', node=node)
+        self.nb_gap_metric = registry.counter('pyacq_ext_recorder_gaps_total', node=node)
+        self.nb_dropped_metric = registry.counter('pyacq_ext_recorder_dropped_total', node=node)
+        self.nb_pending = registry.gauge('pyacq_ext_recorder_pending', node=node)
+        self.write_latency = registry.histogram('pyacq_ext_recorder_write_seconds', node=node)
+
+    def start(self):
+        if not self.file:
+            # closed by a previous stop
+            import h5py
+            self.file = h5py.File(self.filename, 'r+')
+            self.signals = self.file['signals']
+            self.triggers = self.file['triggers']
+            self.segments = self.file['segments']
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name='RecorderWriter', daemon=True)
+        self._thread.start()
+
+    def put(self, kind, pos, data):
+        """Queue a 'signals' or 'triggers' chunk ending at stream position `pos`"""
+        if self.error is not None:
+            self.nb_dropped += 1
+            self.nb_dropped_metric.inc()
+            return
+        self._queue.put((kind, pos, data))
+
+    def stop(self):
+        """Write the pending chunks, the marker index and close the file.
+
+        Raise the error of the writer thread, if any.
+        """
+        if self._thread is not None:
+            self._queue.put(self._stop_item)
+            self._thread.join()
+            self._thread = None
+        try:
+            if self.error is None:
+                self.write_index()
+        finally:
+            self.file.close()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        running = True
+        while running:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            running = not any(item is self._stop_item for item in items)
+            self.nb_pending.set(len(items))
+            if self.error is not None:
+                # keep draining so put never blocks on a dead writer
+                self.nb_dropped += len(items) - (not running)
+                self.nb_dropped_metric.inc(len(items) - (not running))
+                continue
+            t0 = perf_counter_ns()
+            try:
+                self._write(items)
+                self.nb_batch.inc()
+                self.write_latency.record_since(t0)
+            except Exception as e:
+                logger.exception("Recorder: writing %s failed, the next chunks are dropped",
+                                 self.filename)
+                self.error = e
+
+    def _write(self, items):
+        sigs, trigs = [], []
+        row = self.signals.shape[0]
+        for kind, pos, data in items:
+            if kind == 'signals':
+                self._check_continuity(pos, data.shape[0], row)
+                row += data.shape[0]
+                sigs.append(data)
+            elif kind == 'triggers':
+                trigs.append(data)
+
+        if sigs:
+            data = np.concatenate(sigs, axis=0)
+            self._append(self.signals, data)
+            self.nb_sample = self.signals.shape[0]
+            self.nb_written.inc(data.shape[0])
+        if trigs:
+            self._append(self.triggers, convert_triggers(np.concatenate(trigs)))
+            self.nb_trigger = self.triggers.shape[0]
+        self.file.flush()
+
+    def _check_continuity(self, pos, size, row):
+        if self.start_pos is None:
+            self.start_pos = pos - size
+            self.signals.attrs['start_pos'] = self.start_pos
+            self._append(self.segments, np.array([[row, pos - size]]))
+        elif pos - size != self.last_pos:
+            self.nb_gap += 1
+            self.nb_gap_metric.inc()
+            logger.warning("Recorder: signals not continuous at pos %i, new segment at row %i",
+                           pos, row)
+            self._append(self.segments, np.array([[row, pos - size]]))
+        # the chunks after a gap, a restart for instance, are checked from it
+        self.last_pos = pos
+
+    def _append(self, dataset, data):
+        n = dataset.shape[0]
+        dataset.resize(n + data.shape[0], axis=0)
+        dataset[n:] = data
+
+    def write_index(self):
+        """Sort the triggers by pos and index their positions per label"""
+        triggers = self.triggers[:]
+        order = np.argsort(triggers['pos'], kind='stable')
+        if np.any(order != np.arange(order.size)):
+            triggers = triggers[order]
+            self.triggers[:] = triggers
+
+        index = self.file.require_group('marker_index')
+        for label in np.unique(triggers['description']):
+            name = label.decode().replace('/', '_')
+            if name in index:
+                del index[name]
+            index.create_dataset(name, data=triggers['pos'][triggers['description'] == label])
+
+
+class ThreadPollInputToWriter(ThreadPollInput):
+    """Thread handing every chunk of a stream to a RecorderWriter."""
+    def __init__(self, input_stream, kind, writer, **kargs):
+        ThreadPollInput.__init__(self, input_stream, return_data=True, **kargs)
+        self.kind = kind
+        self.writer = writer
+        # sharedmemory chunks are views of the ring buffer
+        self.copy = input_stream.params.get('transfermode') == 'sharedmemory'
+
+    def process_data(self, pos, data):
+        if self.copy:
+            data = data.copy()
+        self.writer.put(self.kind, pos, data)
+
+
+class Recorder(Node):
+    """Node recording a signals/triggers pair to an HDF5 file.
+
+    This Node have no output. See :mod:`recorder` for the file layout.
+    """
+    _input_specs = {'signals': dict(streamtype='signals'),
+                    'triggers': dict(streamtype='events', shape=(-1, )),
+                    }
+    _output_specs = {}
+
+    def __init__(self, **kargs):
+        Node.__init__(self, **kargs)
+        assert HAVE_H5PY, "Recorder depends on the `h5py` package, but it could not be imported."
+
+    def _configure(self, filename, compression=None, compression_level=5, chunk_duration=1.,
+                   max_pending=256):
+        """
+        Parameters
+        ----------
+        filename : str
+            Path of the HDF5 file, overwritten if it exists.
+        compression : str, optional
+            None, 'gzip', 'lzf', 'blosc' or 'lz4'. See :func:`compression_options`.
+        compression_level : int
+            Level for 'gzip' and 'blosc'.
+        chunk_duration : float
+            Duration in s of one HDF5 chunk of signals.
+        max_pending : int
+            Maximum number of chunks waiting to be written.
+        """
+        self.filename = filename
+        self.compression = compression
+        self.compression_level = compression_level
+        self.chunk_duration = chunk_duration
+        self.max_pending = max_pending
+
+    def _initialize(self):
+        params = self.inputs['signals'].params
+        channel_info = params.get('channel_info')
+        channel_names = None if channel_info is None else [ch['name'] for ch in channel_info]
+        self.writer = RecorderWriter(
+            self.filename, params['shape'][1], dtype=params['dtype'],
+            sample_rate=params['sample_rate'], channel_names=channel_names,
+            compression=self.compression, compression_level=self.compression_level,
+            chunk_duration=self.chunk_duration, max_pending=self.max_pending,
+            node=node_label(self))
+
+        self.pollers = [ThreadPollInputToWriter(self.inputs[kind], kind, self.writer)
+                        for kind in ('signals', 'triggers')]
+
+    def _start(self):
+        self.writer.start()
+        for poller in self.pollers:
+            poller.start()
+
+    def _stop(self):
+        for poller in self.pollers:
+            poller.stop()
+            poller.wait()
+        self.writer.stop()
+
+    def _close(self):
+        pass
+
+
+register_node_type(Recorder)
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Runtime backend of the nodes
+
+The nodes take their threads, signals and locks from this module. Two
+backends provide the same API:
+
+- **qt** (default) : QThread, pyqtSignal and pyacq's ThreadPollInput. A
+  signal connected across threads is queued to the Qt event loop of the
+  receiver, so the application has to run one.
+- **thread** : plain `threading` threads and :class:`Signal`, whose
+  callbacks are called directly in the thread emitting it. No Qt event loop
+  is needed, a pipeline runs headless and saves the queued hops.
+
+Nodes import `QObject`, `QThread`, `pyqtSignal`, `Mutex` and
+`ThreadPollInput` from here. The backend is chosen with the
+`PYACQ_EXT_BACKEND` environment variable, or :func:`set_backend`, before
+the nodes are imported. With the 'thread' backend the slots run in the poll
+threads of the nodes instead of the main thread, they must not touch Qt
+widgets. pyacq itself still imports its Qt bindings, but needs no display
+nor event loop.
+
+Whatever the backend, the asyncio transports of the nodes
+(`transport='asyncio'`) run as :class:`AsyncTask` on the single event loop
+of :func:`get_event_loop_thread`.
+
+"""
+import asyncio
+import logging
+import os
+import threading
+import weakref
+
+logger = logging.getLogger(__name__)
+
+backends = ('qt', 'thread')
+_backend = os.environ.get('PYACQ_EXT_BACKEND', 'qt')
+if _backend not in backends:
+    raise ValueError('Unknown PYACQ_EXT_BACKEND {}'.format(_backend))
+
+
+def get_backend():
+    return _backend
+
+
+def set_backend(backend):
+    """Select the backend, to call before importing the nodes"""
+    global _backend
+    if backend not in backends:
+        raise ValueError('Unknown backend {}'.format(backend))
+    _backend = backend
+    _load(backend)
+
+
+class BoundSignal:
+    """Signal of one object, see :class:`Signal`"""
+    def __init__(self):
+        self._slots = []
+        self._lock = threading.Lock()
+
+    def connect(self, slot, *args, **kargs):
+        with self._lock:
+            self._slots = self._slots + [slot]
+
+    def disconnect(self, slot=None):
+        with self._lock:
+            if slot is None:
+                self._slots = []
+            else:
+                self._slots = [s for s in self._slots if s != slot]
+
+    def emit(self, *args):
+        # the list is replaced on connect, iterating it needs no lock
+        for slot in self._slots:
+            slot(*args)
+
+
+class Signal:
+    """Qt-free replacement of pyqtSignal.
+
+    Declared as a class attribute like pyqtSignal, each instance gets its own
+    :class:`BoundSignal`. `emit` calls the slots directly, in the emitting
+    thread. The argument types are only informative.
+    """
+    def __init__(self, *types):
+        self.types = types
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        bound = instance.__dict__.get(self.name)
+        if bound is None:
+            bound = instance.__dict__.setdefault(self.name, BoundSignal())
+        return bound
+
+
+class Object:
+    """Qt-free replacement of QObject"""
+    def __init__(self, parent=None):
+        pass
+
+
+class Thread:
+    """Qt-free replacement of QThread, on `threading.Thread`"""
+    def __init__(self, parent=None):
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    def run(self):
+        pass
+
+    def wait(self, timeout=None):
+        """Join the thread, `timeout` in ms as QThread.wait"""
+        if self._thread is None or self._thread is threading.current_thread():
+            return True
+        self._thread.join(None if timeout is None else timeout / 1000.)
+        return not self._thread.is_alive()
+
+    def isRunning(self):
+        return self._thread is not None and self._thread.is_alive()
+
+
+class PollThread(Thread):
+    """Qt-free replacement of pyacq's ThreadPollInput.
+
+    Poll an InputStream in a thread and call :meth:`process_data` for each
+    chunk, which by default emits `new_data(pos, data)`.
+    """
+    new_data = Signal(int, object)
+
+    def __init__(self, input_stream, timeout=200, return_data=None, parent=None):
+        Thread.__init__(self, parent)
+        self.input_stream = weakref.ref(input_stream)
+        self.timeout = timeout
+        self.return_data = return_data
+        if self.return_data is None:
+            self.return_data = getattr(input_stream, '_own_buffer', False)
+        self.running = False
+        self.running_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self._pos = None
+
+    def run(self):
+        with self.running_lock:
+            self.running = True
+        while True:
+            with self.running_lock:
+                if not self.running:
+                    break
+            input_stream = self.input_stream()
+            if input_stream is None:
+                logger.info("PollThread has lost InputStream")
+                break
+            if not input_stream.poll(timeout=self.timeout):
+                continue
+            with self.running_lock:
+                if not self.running:
+                    break
+            with self.lock:
+                self._pos, data = input_stream.recv(return_data=self.return_data)
+            self.process_data(self._pos, data)
+
+    def process_data(self, pos, data):
+        self.new_data.emit(pos, data)
+
+    def stop(self):
+        with self.running_lock:
+            self.running = False
+
+    def pos(self):
+        with self.lock:
+            return self._pos
+
+
+class EventLoopThread:
+    """An asyncio event loop running in its own thread.
+
+    The asyncio transports of a process share the loop of
+    :func:`get_event_loop_thread`, so all their network I/O runs in one
+    thread whatever the number of nodes.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='EventLoopThread',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedule `coro` on the loop, return a concurrent.futures.Future"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call_soon(self, callback, *args):
+        """Call `callback(*args)` in the loop thread"""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def in_loop(self):
+        return self._thread is threading.current_thread()
+
+
+_event_loop_thread = EventLoopThread()
+
+
+def get_event_loop_thread():
+    """The event loop shared by the asyncio transports of the process"""
+    return _event_loop_thread
+
+
+class AsyncTask:
+    """Coroutine on the shared loop with the start/stop/wait API of a thread.
+
+    Subclasses implement the coroutine `serve`, :meth:`stop` cancels it.
+    """
+    def __init__(self):
+        self.loop_thread = get_event_loop_thread()
+        self._future = None
+        self._task = None
+        self._stopping = False
+
+    def start(self):
+        self._stopping = False
+        self._future = self.loop_thread.submit(self._serve())
+
+    async def _serve(self):
+        if self._stopping:
+            return
+        self._task = asyncio.current_task()
+        try:
+            await self.serve()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._task = None
+
+    async def serve(self):
+        pass
+
+    def stop(self):
+        if self._future is not None:
+            self._stopping = True
+            self.loop_thread.call_soon(self._cancel)
+
+    def _cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def wait(self, timeout=None):
+        """Wait the end of `serve`, `timeout` in ms as QThread.wait"""
+        if self._future is None or self.loop_thread.in_loop():
+            return True
+        try:
+            self._future.result(None if timeout is None else timeout / 1000.)
+        except Exception:
+            if not self._future.done():
+                return False
+            logger.exception("%s ended with an error", type(self).__name__)
+        return True
+
+    def isRunning(self):
+        return self._future is not None and not self._future.done()
+
+
+def _load(backend):
+    # names imported by the nodes
+    global QObject, QThread, pyqtSignal, Mutex, ThreadPollInput
+    if backend == 'qt':
+        from pyqtgraph.Qt import QtCore
+        from pyqtgraph.util.mutex import Mutex
+        from pyacq.core import ThreadPollInput
+        QObject, QThread, pyqtSignal = QtCore.QObject, QtCore.QThread, QtCore.pyqtSignal
+    else:
+        QObject, QThread, pyqtSignal = Object, Thread, Signal
+        Mutex, ThreadPollInput = threading.RLock, PollThread
+
+
+_load(_backend)
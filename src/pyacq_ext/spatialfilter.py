@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Spatial filter node
+
+Projects the stocks emitted by :class:`epochermultilabel.EpocherMultiLabel`
+onto a few xDAWN spatial components, decimates them and vectorizes each
+epoch, so a classifier receives (nb_component * nb_time) features per epoch
+instead of (nb_channel * size). The whole stock is projected with one
+batched matmul.
+
+The filters are estimated from the epochs themselves: the sums needed for
+the xDAWN covariances are accumulated for every stock received, and the
+filters are refitted every `refit_every` epochs.
+
+"""
+import numpy as np
+
+from pyacq.core import Node, register_node_type
+
+from .metrics import get_registry, node_label, perf_counter_ns
+from .runtime import QObject, pyqtSignal
+
+
+def xdawn_filters(evoked, signal_cov, nb_component):
+    """Return the xDAWN spatial filters, shape (nb_channel, nb_component).
+
+    Parameters
+    ----------
+    evoked : array (nb_channel, size)
+        Average epoch of the target label.
+    signal_cov : array (nb_channel, nb_channel)
+        Covariance of the signal, all labels together.
+    nb_component : int
+        Number of filters kept, the ones maximizing the evoked to signal
+        ratio.
+    """
+    import scipy.linalg
+    evoked_cov = evoked @ evoked.T
+    # regularize so a flat or duplicated channel keeps signal_cov invertible
+    reg = 1e-9 * np.trace(signal_cov) / signal_cov.shape[0]
+    evals, evecs = scipy.linalg.eigh(evoked_cov, signal_cov + reg * np.eye(signal_cov.shape[0]))
+    order = np.argsort(evals)[::-1][:nb_component]
+    return evecs[:, order]
+
+
+def project_epochs(stock, filters, decimate=1):
+    """Project, decimate and vectorize a stock of epochs.
+
+    `stock` has shape (nb_epoch, nb_channel, size), the result has shape
+    (nb_epoch, nb_component * (size // decimate)). Decimation averages
+    `decimate` consecutive samples.
+    """
+    # (nb_component, nb_channel) @ (nb_epoch, nb_channel, size) for all epochs at once
+    projected = np.matmul(filters.T.astype(stock.dtype, copy=False), stock)
+    if decimate > 1:
+        nb_epoch, nb_component, size = projected.shape
+        size -= size % decimate
+        projected = projected[:, :, :size].reshape(nb_epoch, nb_component, -1, decimate).mean(axis=3)
+    return projected.reshape(projected.shape[0], -1)
+
+
+class SpatialFilter(Node, QObject):
+    """Node turning the stocks of an EpocherMultiLabel into feature vectors.
+
+    This Node have no stream input or output, connect it to an epocher with
+    :meth:`connect_epocher`. For each stock, `new_features` is emitted with
+    the label, the additionalInformation and an array of shape
+    (max_stock, nb_component * nb_time). Nothing is emitted until filters are
+    given or fitted.
+    """
+    _input_specs = {}
+    _output_specs = {}
+
+    new_features = pyqtSignal(str, str, np.ndarray)
+
+    def __init__(self, parent=None, **kargs):
+        QObject.__init__(self, parent)
+        Node.__init__(self, **kargs)
+
+    def _configure(self, target_labels, nb_component=4, decimate=1, filters=None,
+                   refit_every=0, forget=None):
+        """
+        Parameters
+        ----------
+        target_labels : list of str
+            Labels whose average epoch is enhanced by the filters.
+        nb_component : int
+            Number of spatial components kept.
+        decimate : int
+            Average this number of consecutive samples after projection.
+        filters : array (nb_channel, nb_component), optional
+            Fitted filters to start with.
+        refit_every : int
+            Refit the filters every `refit_every` epochs received, 0 to
+            never refit.
+        forget : float, optional
+            Factor in ]0, 1] applied to the accumulated sums before adding a
+            new stock, to slowly forget the old epochs. None keeps them all.
+        """
+        self.target_labels = list(target_labels)
+        self.nb_component = nb_component
+        self.decimate = int(decimate)
+        if self.decimate < 1:
+            raise ValueError('decimate must be >= 1')
+        self.filters = None if filters is None else np.asarray(filters, dtype='float64')
+        self.refit_every = refit_every
+        self.forget = forget
+
+    def _initialize(self):
+        self.reset_fit()
+
+        registry = get_registry()
+        node = node_label(self)
+        self.nb_stock = registry.counter('pyacq_ext_spatialfilter_stocks_total', node=node)
+        self.nb_fit = registry.counter('pyacq_ext_spatialfilter_fits_total', node=node)
+        self.stock_latency = registry.histogram('pyacq_ext_spatialfilter_stock_seconds', node=node)
+
+    def _start(self):
+        pass
+
+    def _stop(self):
+        pass
+
+    def _close(self):
+        pass
+
+    def connect_epocher(self, epocher):
+        epocher.new_chunk.connect(self.on_new_chunk)
+
+    def reset_fit(self):
+        """Forget the accumulated epochs, the current filters are kept"""
+        self.signal_sum = None
+        self.nb_sample = 0.
+        self.target_sum = None
+        self.nb_target = 0.
+        self.nb_since_fit = 0
+
+    def partial_fit(self, label, stock):
+        """Accumulate the covariance sums of a stock of epochs"""
+        stock = np.asarray(stock, dtype='float64')
+        if self.signal_sum is None:
+            nb_channel, size = stock.shape[1:]
+            self.signal_sum = np.zeros((nb_channel, nb_channel))
+            self.target_sum = np.zeros((nb_channel, size))
+        if self.forget is not None:
+            self.signal_sum *= self.forget
+            self.nb_sample *= self.forget
+            self.target_sum *= self.forget
+            self.nb_target *= self.forget
+
+        # sum of X X^T over the epochs of the stock
+        self.signal_sum += np.einsum('ecs,eds->cd', stock, stock)
+        self.nb_sample += stock.shape[0] * stock.shape[2]
+        if label in self.target_labels and stock.shape[2] == self.target_sum.shape[1]:
+            self.target_sum += stock.sum(axis=0)
+            self.nb_target += stock.shape[0]
+        self.nb_since_fit += stock.shape[0]
+
+    def fit(self):
+        """Compute the filters from the accumulated epochs"""
+        if self.nb_target == 0:
+            return False
+        self.filters = xdawn_filters(self.target_sum / self.nb_target,
+                                     self.signal_sum / self.nb_sample, self.nb_component)
+        self.nb_since_fit = 0
+        return True
+
+    def transform(self, stock):
+        """Return the feature vectors of a stock, see :func:`project_epochs`"""
+        return project_epochs(stock, self.filters, self.decimate)
+
+    def on_new_chunk(self, label, additionalInformation, stock):
+        t0 = perf_counter_ns()
+        self.nb_stock.inc()
+        if self.refit_every:
+            self.partial_fit(label, stock)
+            if self.nb_since_fit >= self.refit_every and self.fit():
+                self.nb_fit.inc()
+        if self.filters is None:
+            return
+        features = self.transform(stock)
+        self.stock_latency.record_since(t0)
+        self.new_features.emit(label, additionalInformation, features)
+
+
+register_node_type(SpatialFilter)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Parallel startup of the nodes
+
+The handshakes of the acquisition nodes (connection and header of the
+Vision recorder, reset of an OpenBCI board) mostly wait for the devices.
+:func:`configure_nodes` and :func:`initialize_nodes` run them in a thread
+per node instead of one after the other, so a pipeline starts in the time
+of its slowest node. The time of each node is returned and recorded in the
+`pyacq_ext_node_startup_seconds` gauge of the metrics, labelled with the
+node and the phase::
+
+    configure_nodes({dev: dict(brainamp_port=51244), obci: dict(board='daisy')})
+    for node in (dev, obci):
+        node.outputs['signals'].configure(protocol='tcp', transfermode='plaindata')
+    initialize_nodes([dev, obci])
+
+Only for the nodes of the calling process. With the 'qt' backend the
+QObjects created by a node in a worker thread are moved to the calling
+thread, so their queued signals reach its event loop.
+
+"""
+import concurrent.futures
+import logging
+
+from .metrics import get_registry, node_label, perf_counter_ns
+from .runtime import get_backend
+
+logger = logging.getLogger(__name__)
+
+
+def configure_nodes(nodes, max_workers=None):
+    """Configure the nodes in parallel.
+
+    Parameters
+    ----------
+    nodes : dict
+        {node: kargs of `node.configure`}
+    max_workers : int or None
+        Number of threads, one per node by default.
+
+    Returns {node label: duration in s}. The first error raised by a node
+    is raised again once all nodes are done.
+    """
+    return _run_parallel('configure', list(nodes.items()), max_workers)
+
+
+def initialize_nodes(nodes, max_workers=None):
+    """Initialize the nodes in parallel, see :func:`configure_nodes`.
+
+    Parameters
+    ----------
+    nodes : list
+        Nodes whose outputs are configured.
+    max_workers : int or None
+        Number of threads, one per node by default.
+    """
+    return _run_parallel('initialize', [(node, {}) for node in nodes], max_workers)
+
+
+def _current_qt_thread():
+    if get_backend() != 'qt':
+        return None
+    from pyqtgraph.Qt import QtCore
+    return QtCore.QThread.currentThread()
+
+
+def _move_qobjects(node, thread):
+    from pyqtgraph.Qt import QtCore
+    current = QtCore.QThread.currentThread()
+    for obj in [node] + list(vars(node).values()):
+        if isinstance(obj, QtCore.QObject) and obj.parent() is None and obj.thread() == current:
+            obj.moveToThread(thread)
+
+
+def _run_parallel(method, calls, max_workers):
+    if not calls:
+        return {}
+    owner = _current_qt_thread()
+
+    def run(node, kargs):
+        t0 = perf_counter_ns()
+        getattr(node, method)(**kargs)
+        duration = (perf_counter_ns() - t0) * 1e-9
+        if owner is not None:
+            _move_qobjects(node, owner)
+        return duration
+
+    registry = get_registry()
+    durations = {}
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or len(calls),
+                                               thread_name_prefix='startup') as executor:
+        futures = {executor.submit(run, node, kargs): node for node, kargs in calls}
+        for future in concurrent.futures.as_completed(futures):
+            label = node_label(futures[future])
+            try:
+                duration = future.result()
+            except Exception as e:
+                logger.error("%s: %s failed (%s)", label, method, e)
+                errors.append(e)
+                continue
+            durations[label] = duration
+            registry.gauge('pyacq_ext_node_startup_seconds', node=label, phase=method).set(duration)
+            logger.info("%s: %s in %.3f s", label, method, duration)
+    if errors:
+        raise errors[0]
+    return durations
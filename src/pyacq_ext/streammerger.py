@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Stream merger node
+
+Merges the signals of several amplifiers (BrainVisionListener,
+OpenBCIListener, ...) each with its own sample counter and clock into one
+stream. The first stream is the master clock: the output samples are
+evenly spaced on it. For each stream the sample index is fitted online
+against the host clock, which gives its drift relative to the master, and
+its samples are resampled at the output times with a 4-tap (cubic Lagrange)
+fractional-delay interpolation, vectorized over samples and channels.
+
+The fits use the arrival time of the chunks, so the offset between two
+amplifiers is only known within the jitter of their transports; the drift
+(slope) converges over `drift_tau` s.
+
+"""
+import logging
+import math
+import time
+
+import numpy as np
+
+from pyacq.core import InputStream, Node, register_node_type
+
+from .metrics import get_registry, node_label, perf_counter_ns
+from .runtime import Mutex, ThreadPollInput
+from .triggers import convert_triggers, trigger_output_spec
+
+logger = logging.getLogger(__name__)
+
+
+def lagrange_weights(frac):
+    """Weights of the samples at -1, 0, 1, 2 for the fractional positions `frac` in [0, 1)"""
+    fm1 = frac - 1.
+    fm2 = frac - 2.
+    fp1 = frac + 1.
+    return np.stack([-frac * fm1 * fm2 / 6., fp1 * fm1 * fm2 / 2.,
+                     -fp1 * frac * fm2 / 2., fp1 * frac * fm1 / 6.], axis=1)
+
+
+def interpolate(data, x):
+    """Values of `data` (nb_sample, nb_channel) at the fractional indexes `x`.
+
+    `x` must be in [1, nb_sample - 3].
+    """
+    index = np.floor(x).astype('int64')
+    weights = lagrange_weights(x - index)
+    rows = data[index[:, np.newaxis] + np.arange(-1, 3)]
+    return np.einsum('nk,nkc->nc', weights, rows)
+
+
+class ClockFit:
+    """Online fit of the sample index of a stream against the host clock.
+
+    Exponentially weighted least squares of `pos = offset + rate * t` over
+    about `tau` s. The nominal rate is used until `warmup` s of chunks were
+    received.
+    """
+    def __init__(self, sample_rate, tau=30., warmup=2.):
+        self.nominal_rate = sample_rate
+        self.tau = tau
+        self.warmup = warmup
+        self.t_first = None
+        self.pos_first = None
+        self.t_last = None
+        # weighted sums of 1, t, pos, t * t, t * pos, relative to the first
+        # chunk to keep the precision
+        self.sums = np.zeros(5)
+
+    def update(self, t, pos):
+        if self.t_first is None:
+            self.t_first = t
+            self.pos_first = pos
+        else:
+            self.sums *= math.exp(-(t - self.t_last) / self.tau)
+        self.t_last = t
+        t = t - self.t_first
+        pos = pos - self.pos_first
+        self.sums += (1., t, pos, t * t, t * pos)
+
+    @property
+    def ready(self):
+        return self.t_last is not None
+
+    @property
+    def rate(self):
+        w, st, sp, stt, stp = self.sums
+        var = stt / w - (st / w) ** 2
+        if self.t_last - self.t_first < self.warmup or var <= 0:
+            return self.nominal_rate
+        return (stp / w - st * sp / w ** 2) / var
+
+    def position(self, t):
+        """Fractional sample index at the host time `t`"""
+        w, st, sp = self.sums[:3]
+        return self.pos_first + sp / w + self.rate * (t - self.t_first - st / w)
+
+    def time(self, pos):
+        """Host time of the fractional sample index `pos`"""
+        w, st, sp = self.sums[:3]
+        return self.t_first + st / w + (pos - self.pos_first - sp / w) / self.rate
+
+
+class SampleBuffer:
+    """Last samples of a stream, indexed by their absolute position"""
+    def __init__(self, size, nb_channel, dtype='float32'):
+        self.size = size
+        self.data = np.zeros((2 * size, nb_channel), dtype=dtype)
+        self.start = None
+        self.stop = None
+
+    def append(self, pos, chunk):
+        """Append the samples of `chunk`, the last one at position `pos` - 1.
+
+        A chunk larger than `size` grows the buffer. The positions missing
+        before a chunk are filled with NaN (0 for ints). The buffer restarts
+        at the chunk if it goes back or jumps further than `size`.
+        """
+        n = chunk.shape[0]
+        if n > self.size:
+            self.grow(n)
+        if self.start is not None and pos - n != self.stop:
+            missing = pos - n - self.stop
+            if 0 < missing <= self.size:
+                fill = np.nan if self.data.dtype.kind == 'f' else 0
+                self.append(pos - n, np.full((missing, self.data.shape[1]), fill,
+                                             dtype=self.data.dtype))
+            else:
+                logger.warning("StreamMerger: samples %i to %i after %i, buffer restarted",
+                               pos - n, pos, self.stop)
+                self.start = None
+        if self.start is None:
+            self.start = self.stop = pos - n
+        length = self.stop - self.start
+        if length + n > self.data.shape[0]:
+            keep = min(length, self.size)
+            self.data[:keep] = self.data[length - keep:length]
+            self.start = self.stop - keep
+            length = keep
+        self.data[length:length + n] = chunk
+        self.stop = pos
+
+    def grow(self, size):
+        """Keep at least the last `size` samples"""
+        data = np.zeros((2 * size, self.data.shape[1]), dtype=self.data.dtype)
+        if self.start is not None:
+            length = self.stop - self.start
+            data[:length] = self.data[:length]
+        self.size = size
+        self.data = data
+
+    def interpolate(self, x):
+        return interpolate(self.data, x - self.start)
+
+
+class ThreadPollInputMerge(ThreadPollInput):
+    """Thread giving the chunks of one input to the merger."""
+    def __init__(self, input_stream, callback, index, **kargs):
+        ThreadPollInput.__init__(self, input_stream, return_data=True, **kargs)
+        self.callback = callback
+        self.index = index
+
+    def process_data(self, pos, data):
+        self.callback(self.index, pos, data)
+
+
+class StreamMerger(Node):
+    """Node merging several signals streams on the clock of the first one.
+
+    The inputs are `signals0`, `signals1`, ... and the optional `triggers0`,
+    `triggers1`, ... created by :meth:`configure`. The `signals` output
+    concatenates the channels of all inputs, the `triggers` output gets the
+    triggers of all inputs with their pos moved to the output clock and
+    their `channel` set to the index of their input.
+
+    The first output sample is the first instant covered by all the inputs.
+    An input late by more than `max_delay` s is not waited for, its channels
+    are filled with NaN until it catches up.
+    """
+    _input_specs = {}
+    _output_specs = {'signals': dict(streamtype='analogsignal', dtype='float32',
+                                     shape=(-1, 1), compression=''),
+                     'triggers': trigger_output_spec()}
+
+    def __init__(self, **kargs):
+        Node.__init__(self, **kargs)
+
+    def _configure(self, nb_stream=2, sample_rate=None, drift_tau=30., warmup=2., max_delay=1.,
+                   buffer_duration=4., with_triggers=True):
+        """
+        Parameters
+        ----------
+        nb_stream : int
+            Number of signals inputs.
+        sample_rate : float or None
+            Output sample rate, by default the one of `signals0`.
+        drift_tau : float
+            Time constant in s of the clock fits.
+        warmup : float
+            Time in s before the drift estimated replaces the nominal rates.
+        max_delay : float
+            Maximum time in s an input late is waited for.
+        buffer_duration : float
+            Duration in s of the samples kept for each input, must exceed
+            max_delay plus the largest chunk.
+        with_triggers : bool
+            Create the `triggers` inputs.
+        """
+        self.nb_stream = nb_stream
+        self.sample_rate = sample_rate
+        self.drift_tau = drift_tau
+        self.warmup = warmup
+        self.max_delay = max_delay
+        self.buffer_duration = buffer_duration
+        self.with_triggers = with_triggers
+
+        for i in range(nb_stream):
+            name = 'signals{}'.format(i)
+            self.inputs[name] = InputStream(spec=dict(streamtype='signals'), node=self, name=name)
+            if with_triggers:
+                name = 'triggers{}'.format(i)
+                self.inputs[name] = InputStream(spec=dict(streamtype='events', shape=(-1, )),
+                                                node=self, name=name)
+        self.connected = set()
+
+    def after_input_connect(self, inputname):
+        self.connected.add(inputname)
+        names = ['signals{}'.format(i) for i in range(self.nb_stream)]
+        if not inputname.startswith('signals') or not self.connected.issuperset(names):
+            return
+
+        self.channel_info = []
+        for i, name in enumerate(names):
+            params = self.inputs[name].params
+            channel_info = params.get('channel_info')
+            if channel_info is None:
+                channel_info = [{'name': 'ch{}'.format(c)} for c in range(params['shape'][1])]
+            self.channel_info += [{'name': '{}:{}'.format(i, ch['name'])} for ch in channel_info]
+        if self.sample_rate is None:
+            self.sample_rate = self.inputs['signals0'].params['sample_rate']
+
+        self.outputs['signals'].spec['shape'] = (-1, len(self.channel_info))
+        self.outputs['signals'].spec['sample_rate'] = self.sample_rate
+        self.outputs['signals'].spec['nb_channel'] = len(self.channel_info)
+
+    def after_output_configure(self, outputname):
+        if outputname == 'signals':
+            self.outputs[outputname].params['channel_info'] = self.channel_info
+
+    def _initialize(self):
+        self.lock = Mutex()
+        self.dtype = np.dtype(self.outputs['signals'].params['dtype'])
+        self.fits = []
+        self.buffers = []
+        self.nb_channels = []
+        self.pollers = []
+        for i in range(self.nb_stream):
+            params = self.inputs['signals{}'.format(i)].params
+            self.fits.append(ClockFit(params['sample_rate'], tau=self.drift_tau, warmup=self.warmup))
+            self.buffers.append(SampleBuffer(int(self.buffer_duration * params['sample_rate']),
+                                             params['shape'][1]))
+            self.nb_channels.append(params['shape'][1])
+            self.pollers.append(ThreadPollInputMerge(self.inputs['signals{}'.format(i)],
+                                                     self.on_new_chunk, i))
+            if 'triggers{}'.format(i) in self.connected:
+                self.pollers.append(ThreadPollInputMerge(self.inputs['triggers{}'.format(i)],
+                                                         self.on_new_triggers, i))
+        # output sample k is at master index start + k * step
+        self.step = self.fits[0].nominal_rate / self.sample_rate
+        self.start = None
+        self.head = 0
+
+        registry = get_registry()
+        node = node_label(self)
+        self.drift_gauges = [registry.gauge('pyacq_ext_merger_drift_ppm', node=node, stream=str(i))
+                             for i in range(self.nb_stream)]
+        self.nb_missing = [registry.counter('pyacq_ext_merger_missing_samples_total', node=node,
+                                            stream=str(i))
+                           for i in range(self.nb_stream)]
+        self.nb_chunk = [registry.counter('pyacq_ext_merger_chunks_total', node=node, stream=str(i))
+                         for i in range(self.nb_stream)]
+        # one per stream, each poller thread records its own
+        self.chunk_latency = [registry.histogram('pyacq_ext_merger_chunk_seconds', node=node,
+                                                 stream=str(i))
+                              for i in range(self.nb_stream)]
+
+    def _start(self):
+        for poller in self.pollers:
+            poller.start()
+
+    def _stop(self):
+        for poller in self.pollers:
+            poller.stop()
+            poller.wait()
+
+    def _close(self):
+        pass
+
+    def master_position(self, i, pos):
+        """Master index of the index `pos` of input `i`"""
+        return self.fits[0].position(self.fits[i].time(pos))
+
+    def get_drift(self):
+        """Drift in ppm of each input clock relative to the master"""
+        master = self.fits[0].rate / self.fits[0].nominal_rate
+        return [(fit.rate / fit.nominal_rate / master - 1.) * 1e6 for fit in self.fits]
+
+    def on_new_chunk(self, i, pos, data):
+        t0 = perf_counter_ns()
+        t = time.perf_counter()
+        self.nb_chunk[i].inc()
+        with self.lock:
+            self.buffers[i].append(pos, data)
+            # the chunk arrives after its last sample, pos - 1
+            self.fits[i].update(t, pos - 1)
+            self.flush(t)
+        self.chunk_latency[i].record_since(t0)
+
+    def flush(self, t):
+        if not all(fit.ready for fit in self.fits):
+            return
+        if self.start is None:
+            # first master index covered by all the inputs, 1 sample of margin
+            # for the interpolation
+            self.start = max(self.master_position(i, buf.start + 1)
+                             for i, buf in enumerate(self.buffers))
+            self.start = math.ceil(self.start)
+
+        # inputs late by more than max_delay are not waited for
+        waited = [i for i, fit in enumerate(self.fits) if t - fit.t_last < self.max_delay]
+        if 0 not in waited:
+            return
+        end = min(self.master_position(i, self.buffers[i].stop - 3) for i in waited)
+        stop = math.floor((end - self.start) / self.step) + 1
+        if stop <= self.head:
+            return
+
+        k = np.arange(self.head, stop)
+        master = self.start + k * self.step
+        times = self.fits[0].time(master)
+        out = np.empty((k.shape[0], sum(self.nb_channels)), dtype=self.dtype)
+        col = 0
+        for i, (fit, buf) in enumerate(zip(self.fits, self.buffers)):
+            x = master if i == 0 else fit.position(times)
+            valid = (x >= buf.start + 1) & (x <= buf.stop - 3)
+            sl = slice(col, col + self.nb_channels[i])
+            if valid.all():
+                out[:, sl] = buf.interpolate(x)
+            else:
+                out[:, sl] = np.nan
+                if valid.any():
+                    out[valid, sl] = buf.interpolate(x[valid])
+                self.nb_missing[i].inc(int((~valid).sum()))
+            col += self.nb_channels[i]
+        for gauge, drift in zip(self.drift_gauges, self.get_drift()):
+            gauge.set(drift)
+
+        self.head = stop
+        self.outputs['signals'].send(out, index=self.head)
+
+    def on_new_triggers(self, i, pos, triggers):
+        triggers = convert_triggers(triggers).copy()
+        with self.lock:
+            if self.start is None:
+                logger.debug("StreamMerger: %i triggers of input %i before the output start",
+                             triggers.shape[0], i)
+                return
+            master = self.master_position(i, triggers['pos'].astype('float64'))
+            triggers['pos'] = np.round((master - self.start) / self.step).astype('int64')
+            ratio = self.sample_rate / self.fits[i].nominal_rate
+            triggers['points'] = np.round(triggers['points'] * ratio).astype('int64')
+            triggers['channel'] = i
+            triggers = triggers[triggers['pos'] >= 0]
+        if triggers.shape[0]:
+            self.outputs['triggers'].send(triggers, index=triggers.shape[0])
+
+
+register_node_type(StreamMerger)
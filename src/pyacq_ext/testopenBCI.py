@@ -2,51 +2,55 @@
 # Copyright (c) 2016, French National Center for Scientific Research (CNRS)
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
-import time
+import os
 
-from pyacq import create_manager
-from eeg_openBCIListener import OpenBCIListener, HAVE_PYSERIAL
-from pyacq.viewers import QOscilloscope
+from pyacq_ext.eeg_openBCIListener import OpenBCIListener, HAVE_PYSERIAL
+from pyacq_ext.metrics import get_registry, node_label
+from pyacq_ext.openbciemulator import OpenBCIEmulator
 
-from pyqtgraph.Qt import QtCore, QtGui
+from pyqtgraph.Qt import QtCore
 
 import pytest
 
-@pytest.mark.skip(reason="need Device")
-@pytest.mark.skipif(not HAVE_PYSERIAL, reason='no have pyserial')
-def test_eeg_OpenBCI():
-    # in main App
-    app = QtGui.QApplication([])
+
+def run_listener(emulator, duration, **kargs):
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
 
     dev = OpenBCIListener()
-    dev.configure(device_handle='/COM7')
-    dev.outputs['signals'].configure(protocol='tcp', interface='127.0.0.1',transfermode='plaindata',)
-    dev.outputs['aux'].configure(protocol='tcp', interface='127.0.0.1',transfermode='plaindata',)
+    dev.configure(device_handle=emulator.port, **kargs)
+    for name in ('signals', 'aux', 'triggers'):
+        dev.outputs[name].configure(protocol='tcp', interface='127.0.0.1', transfermode='plaindata')
     dev.initialize()
-
-    viewer = QOscilloscope()
-    viewer.configure()
-    viewer.input.connect(dev.outputs['signals'])
-    viewer.initialize()
-    viewer.show()
-
-    # dev.print_register_settings()
     dev.start()
-    viewer.start()
 
-    def terminate():
-        viewer.stop()
-        dev.stop()
-        viewer.close()
-        dev.close()
-        app.quit()
+    QtCore.QTimer.singleShot(int(duration * 1000), app.quit)
+    app.exec_()
+    dev.stop()
+    dev.close()
+    return dev
 
-    # start for a while
-    timer = QtCore.QTimer(singleShot=True, interval=100000)
-    timer.timeout.connect(terminate)
-    timer.start()
 
-    app.exec_()
+@pytest.mark.skipif(not HAVE_PYSERIAL, reason='no have pyserial')
+@pytest.mark.skipif(os.name != 'posix', reason='the emulator needs a pty')
+@pytest.mark.parametrize('board', ['cyton', 'daisy'])
+def test_eeg_OpenBCI(board):
+    emulator = OpenBCIEmulator(board=board, corrupt_rate=0.01, id_gap_rate=0.01, seed=0)
+    emulator.start()
+    dev = run_listener(emulator, 3., board=board)
+    stats = emulator.stats()
+    emulator.stop()
+
+    node = node_label(dev)
+    metrics = get_registry()
+    received = metrics.counter('pyacq_ext_openbci_packets_total', node=node).value
+    wrong = metrics.counter('pyacq_ext_openbci_wrong_packets_total', node=node).value
+    assert received + stats['skipped'] >= stats['packets'] - 5
+    # a packet lost in a pty overflow is not read if corrupted and is cut
+    # (read as wrong) otherwise, the last packets may still be in the pty
+    assert wrong <= stats['corrupted'] + stats['overflow']
+    assert wrong >= stats['corrupted'] - stats['overflow'] - 5
+    assert dev._thread.n > 0
+
 
 if __name__ == '__main__':
-    test_eeg_OpenBCI()
+    test_eeg_OpenBCI('cyton')
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Trigger to result tracing
+
+Each game event gets a trace id when the EventPoller receives it, and every
+node it goes through stamps the trace with `perf_counter_ns`. The traces
+live in a side table, so the trigger dtype is unchanged: a trigger is found
+back from its (pos, label), a stock carries the traces of its epochs and a
+result frame closes the traces of its game waiting for a result. The game
+is the session identity given to :meth:`Tracer.begin`, None in 'pair' mode.
+
+Hops, in order:
+
+- **event** : EVENT_ZMQ received by the EventPoller
+- **trigger** : trigger sent on the triggers stream
+- **epocher** : trigger received by the epocher
+- **pos_reached** : end of the epoch received on the signals stream
+- **epoch** : epoch stored by the epocher
+- **stock** : stock emitted by the epocher
+- **result_set** : result frame given to the EventPoller
+- **result_sent** : RESULT sent to the game
+
+On completion, the time between consecutive hops is recorded in the
+`pyacq_ext_trace_stage_seconds` histograms of :mod:`metrics` and the trace
+can be written to a Chrome trace / Perfetto file with
+:meth:`Tracer.write_chrome_trace`. The nodes must run in the same process.
+
+"""
+import json
+import threading
+from collections import deque
+
+import numpy as np
+
+from .metrics import get_registry, perf_counter_ns
+
+HOPS = ('event', 'trigger', 'epocher', 'pos_reached', 'epoch', 'stock', 'result_set',
+        'result_sent')
+
+
+class Tracer:
+    """Table of the traces in flight and of the last completed ones.
+
+    Trace ids are consecutive ints, the stamps of the last `size` traces are
+    kept in a preallocated array.
+    """
+    hops = HOPS
+
+    def __init__(self, size=4096, registry=None):
+        self.size = size
+        self.enabled = True
+        self.hop_index = {hop: i for i, hop in enumerate(self.hops)}
+        self.stamps = np.zeros((size, len(self.hops)), dtype='int64')
+        self.row_keys = [None] * size
+        self.row_sessions = [None] * size
+        self.keys = {}
+        # {session identity: traces}
+        self.awaiting_result = {}
+        self.completed = deque(maxlen=size)
+        self.nb_trace = 0
+        self._lock = threading.Lock()
+
+        registry = get_registry() if registry is None else registry
+        self.stage_latency = [registry.histogram('pyacq_ext_trace_stage_seconds',
+                                                 stage='{}>{}'.format(a, b))
+                              for a, b in zip(self.hops[:-1], self.hops[1:])]
+        self.total_latency = registry.histogram('pyacq_ext_trace_total_seconds')
+
+    def begin(self, pos, label, t0=None, session=None):
+        """Open the trace of the trigger (pos, label) of `session`, return its id"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            trace = self.nb_trace
+            self.nb_trace += 1
+            row = trace % self.size
+            old_key = self.row_keys[row]
+            if old_key is not None and self.keys.get(old_key) == trace - self.size:
+                del self.keys[old_key]
+            key = (int(pos), label)
+            self.keys[key] = trace
+            self.row_keys[row] = key
+            self.row_sessions[row] = session
+            self.stamps[row] = 0
+        self.stamps[row, 0] = perf_counter_ns() if t0 is None else t0
+        return trace
+
+    def find(self, pos, label):
+        """Trace id of the trigger (pos, label) or None"""
+        if not self.enabled:
+            return None
+        return self.keys.get((int(pos), label))
+
+    def stamp(self, trace, hop, t=None):
+        if trace is None or trace <= self.nb_trace - self.size - 1:
+            return
+        self.stamps[trace % self.size, self.hop_index[hop]] = perf_counter_ns() if t is None else t
+
+    def stamp_all(self, traces, hop):
+        t = perf_counter_ns()
+        for trace in traces:
+            self.stamp(trace, hop, t)
+
+    def wait_result(self, traces):
+        """Stamp the traces of an emitted stock, they end with the next result"""
+        self.stamp_all(traces, 'stock')
+        with self._lock:
+            for trace in traces:
+                if trace is None or trace <= self.nb_trace - self.size - 1:
+                    continue
+                session = self.row_sessions[trace % self.size]
+                self.awaiting_result.setdefault(session, deque()).append(trace)
+
+    def result_set(self, session=None):
+        with self._lock:
+            traces = list(self.awaiting_result.get(session, ()))
+        self.stamp_all(traces, 'result_set')
+
+    def result_sent(self, session=None):
+        """Close the traces of `session` waiting for a result"""
+        with self._lock:
+            traces = self.awaiting_result.pop(session, ())
+        self.stamp_all(traces, 'result_sent')
+        for trace in traces:
+            self._complete(trace)
+
+    def forget(self, session):
+        """Drop the traces of `session` waiting for a result, the game quit"""
+        with self._lock:
+            self.awaiting_result.pop(session, None)
+
+    def _complete(self, trace):
+        if trace <= self.nb_trace - self.size - 1:
+            return
+        row = trace % self.size
+        stamps = self.stamps[row]
+        previous = None
+        for i, t in enumerate(stamps.tolist()):
+            if t == 0:
+                continue
+            if previous is not None:
+                # a skipped hop folds into the next stage
+                self.stage_latency[i - 1].record(t - previous)
+            previous = t
+        self.total_latency.record(int(stamps[-1] - stamps[0]))
+        self.completed.append((trace, self.row_keys[row][1], stamps.copy()))
+
+    def reset(self):
+        with self._lock:
+            self.keys.clear()
+            self.awaiting_result.clear()
+            self.completed.clear()
+
+    def write_chrome_trace(self, filename):
+        """Write the completed traces in the Chrome trace event format.
+
+        The file opens in chrome://tracing or https://ui.perfetto.dev, each
+        trace is a row with one slice per stage.
+        """
+        events = []
+        for trace, label, stamps in list(self.completed):
+            hops = [(hop, t) for hop, t in zip(self.hops, stamps.tolist()) if t != 0]
+            for (hop, t), (next_hop, next_t) in zip(hops[:-1], hops[1:]):
+                events.append({
+                    'name': '{}>{}'.format(hop, next_hop), 'cat': label, 'ph': 'X',
+                    'ts': t / 1000., 'dur': (next_t - t) / 1000.,
+                    'pid': 0, 'tid': trace, 'args': {'trace': trace, 'label': label},
+                })
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    """The tracer shared by the nodes of the process"""
+    return _tracer
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Trigger stream schema shared by all pyacq_ext nodes.
+
+Every node producing or consuming a ``triggers`` stream uses ``dtype_trigger``
+and advertises ``TRIGGER_VERSION`` in the stream params under the
+``trigger_version`` key. Arrays built with an older layout can be brought to
+the current one with :func:`convert_triggers`, which copies field by field
+(no per-row re-packing).
+
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Layout used by RawDeviceBuffer and BrainVisionListener before versioning.
+dtype_trigger_v1 = np.dtype([('pos', 'int64'),
+                             ('points', 'int64'),
+                             ('channel', 'int64'),
+                             ('type', 'S16'),
+                             ('description', 'S16'),
+                             ])
+
+# Layout used by EventPoller before versioning.
+dtype_trigger_v2 = np.dtype([('pos', 'int64'),
+                             ('points', 'int64'),
+                             ('channel', 'int64'),
+                             ('type', 'S16'),
+                             ('description', 'S100'),
+                             ('additionalInformation', 'S100'),
+                             ])
+
+# Current layout: 168 bytes per trigger, every field naturally aligned.
+# additionalInformation keeps the 100 bytes of the game payloads.
+dtype_trigger_v3 = np.dtype([('pos', 'int64'),
+                             ('points', 'int32'),
+                             ('channel', 'int32'),
+                             ('type', 'S16'),
+                             ('description', 'S32'),
+                             ('additionalInformation', 'S100'),
+                             ], align=True)
+
+TRIGGER_VERSION = 3
+# `type` of the triggers marking samples lost by an acquisition node, `pos`
+# is the first lost sample and `points` the number of lost samples.
+GAP_TYPE = b'Gap'
+
+dtype_trigger = dtype_trigger_v3
+
+_dtypes_by_version = {
+    1: dtype_trigger_v1,
+    2: dtype_trigger_v2,
+    3: dtype_trigger_v3,
+}
+
+
+def trigger_output_spec():
+    """Return the output spec of a ``triggers`` stream."""
+    return dict(streamtype='event', dtype=dtype_trigger, shape=(-1,),
+                trigger_version=TRIGGER_VERSION)
+
+
+def get_trigger_version(dtype):
+    """Return the schema version matching ``dtype`` or None if unknown."""
+    dtype = np.dtype(dtype)
+    for version, dt in _dtypes_by_version.items():
+        if dt == dtype:
+            return version
+    return None
+
+
+def empty_triggers(nb_trigger):
+    """Return a zeroed trigger array of length ``nb_trigger``."""
+    return np.zeros((nb_trigger,), dtype=dtype_trigger)
+
+
+def fit_text(data, itemsize):
+    """Cut the UTF-8 bytes ``data`` to ``itemsize`` bytes on a character boundary."""
+    if len(data) <= itemsize:
+        return data
+    return data[:itemsize].decode('utf-8', errors='ignore').encode('utf-8')
+
+
+def make_triggers(pos, type=b'Stimulus', description=b'',
+                  additionalInformation=b'', points=0, channel=0):
+    """Build a trigger array from scalars or equal length sequences."""
+    pos = np.atleast_1d(np.asarray(pos, dtype='int64'))
+    triggers = empty_triggers(pos.shape[0])
+    triggers['pos'] = pos
+    triggers['points'] = points
+    triggers['channel'] = channel
+    triggers['type'] = type
+    triggers['description'] = description
+    triggers['additionalInformation'] = additionalInformation
+    return triggers
+
+
+def make_gap_trigger(pos, nb_sample, channel=0):
+    """Build the trigger of `nb_sample` samples lost from ``pos``."""
+    return make_triggers(pos, type=GAP_TYPE, description=b'gap', points=nb_sample,
+                         channel=channel)
+
+
+def convert_triggers(triggers):
+    """Convert a trigger array to the current schema.
+
+    Parameters
+    ----------
+    triggers : np.ndarray
+        Structured array using any trigger layout. Fields missing from it are
+        left zeroed.
+
+    Returns
+    -------
+    np.ndarray
+        ``triggers`` itself if already current, otherwise a new array with
+        ``dtype_trigger``. Byte fields longer than the current layout are
+        truncated on a UTF-8 character boundary, with a warning.
+    """
+    if triggers.dtype == dtype_trigger:
+        return triggers
+    if triggers.dtype.names is None:
+        raise ValueError('Unknown trigger dtype {}'.format(triggers.dtype))
+
+    converted = empty_triggers(triggers.shape[0])
+    for name in dtype_trigger.names:
+        if name in triggers.dtype.names:
+            values = triggers[name]
+            itemsize = dtype_trigger[name].itemsize
+            converted[name] = values
+            if values.dtype.kind == 'S' and values.dtype.itemsize > itemsize:
+                truncated = np.flatnonzero(np.char.str_len(values) > itemsize)
+                if truncated.size:
+                    logger.warning('%d trigger %s truncated to %d bytes', truncated.size, name, itemsize)
+                for i in truncated:
+                    converted[name][i] = fit_text(values[i], itemsize)
+    return converted
+
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import numpy as np
+import pytest
+
+from pyacq_ext.epochermultilabel import EpochRejector
+
+
+def make_epoch(nb_channel=4, size=100, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((nb_channel, size))
+
+
+def test_ptp_max():
+    rejector = EpochRejector(4, ptp_max=20.)
+    epoch = make_epoch()
+    assert rejector.accept(epoch)
+    epoch[2, 10] += 50.
+    assert not rejector.accept(epoch)
+    counts = rejector.get_counts()
+    assert counts['criteria']['ptp_max'] == 1
+    assert counts['channels'].tolist() == [0, 0, 1, 0]
+
+
+def test_abs_max():
+    rejector = EpochRejector(4, abs_max=10.)
+    epoch = make_epoch()
+    assert rejector.accept(epoch)
+    epoch[1] -= 20.
+    assert not rejector.accept(epoch)
+    assert rejector.get_counts()['criteria']['abs_max'] == 1
+
+
+def test_flat_min():
+    rejector = EpochRejector(4, flat_min=0.1)
+    epoch = make_epoch()
+    assert rejector.accept(epoch)
+    epoch[3] = 1.
+    assert not rejector.accept(epoch)
+    counts = rejector.get_counts()
+    assert counts['criteria']['flat_min'] == 1
+    assert counts['channels'].tolist() == [0, 0, 0, 1]
+
+
+def test_zscore_max():
+    rejector = EpochRejector(4, zscore_max=5., zscore_warmup=10)
+    for seed in range(10):
+        assert rejector.accept(make_epoch(seed=seed))
+    assert rejector.accept(make_epoch(seed=100))
+    epoch = make_epoch(seed=101)
+    epoch[0] *= 10.
+    assert not rejector.accept(epoch)
+    counts = rejector.get_counts()
+    assert counts == dict(counts, accepted=11, rejected=1)
+    assert counts['criteria']['zscore_max'] == 1
+
+
+def test_zscore_warmup():
+    # not checked until zscore_warmup epochs are accepted
+    rejector = EpochRejector(4, zscore_max=1., zscore_warmup=3)
+    epoch = make_epoch()
+    assert rejector.accept(epoch)
+    assert rejector.accept(epoch * 10.)
+    assert rejector.accept(epoch * 100.)
+    with pytest.raises(ValueError):
+        EpochRejector(4, zscore_max=3., zscore_warmup=1)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import pytest
+import zmq
+
+from pyacq_ext.eventpoller import AsyncEventPoller, EventPollerThread
+
+
+class Output:
+    def __init__(self):
+        self.chunks = []
+
+    def send(self, data, index=None):
+        self.chunks.append(data)
+
+
+class Bus:
+    def __init__(self, accept=True):
+        self.accept = accept
+        self.commands = []
+
+    def publish(self, command):
+        self.commands.append(command)
+        return self.accept
+
+
+@pytest.fixture
+def make_poller():
+    pollers = []
+
+    def make(mode, bus=None):
+        poller = EventPollerThread({}, '127.0.0.1', '*', Bus() if bus is None else bus, mode=mode)
+        # the replies are not checked
+        poller.send = lambda session, frame: None
+        pollers.append(poller)
+        return poller
+    yield make
+    for poller in pollers:
+        poller.socket.close(linger=0)
+
+
+def test_pair_waiting_result_bounded(make_poller):
+    poller = make_poller('pair')
+    for i in range(1000):
+        poller.on_result(poller.session, '1')
+        assert poller.set_result_frame('result')
+        poller.session.results.pop()
+    assert poller.nb_waiting == 0
+    assert len(poller.waiting_result) == 0
+
+
+def test_router_oldest_waiting(make_poller):
+    poller = make_poller('router')
+    a, b = poller.get_session(b'a'), poller.get_session(b'b')
+    a.isConnected = b.isConnected = True
+    poller.on_result(a, '1')
+    poller.on_result(b, '1')
+    assert poller.set_result_frame('to a')
+    assert poller.set_result_frame('to b')
+    assert a.results.pop() == 'to a' and b.results.pop() == 'to b'
+    assert not poller.set_result_frame('nobody')
+
+
+def test_router_stale_entries(make_poller):
+    poller = make_poller('router')
+    a, b = poller.get_session(b'a'), poller.get_session(b'b')
+    a.isConnected = b.isConnected = True
+    for i in range(1000):
+        poller.on_result(a, '1')
+        assert poller.set_result_frame('to a', identity=b'a')
+    assert len(poller.waiting_result) <= 16 + 1
+    # a game which quits is not answered any more
+    poller.on_result(b, '1')
+    poller.request, poller.content = poller.QUIT_ZMQ, ''
+    poller.on_quit(b, '')
+    assert poller.nb_waiting == 0
+    assert not poller.set_result_frame('to b')
+
+
+def test_lost_request(make_poller):
+    poller = make_poller('router', bus=Bus(accept=False))
+    a = poller.get_session(b'a')
+    a.isConnected = True
+    poller.on_result(a, '1')
+    assert poller.nb_waiting == 0
+    assert not poller.set_result_frame('lost')
+
+
+def test_event_truncated_on_character(make_poller):
+    poller = make_poller('pair')
+    poller.outputs['triggers'] = Output()
+    poller.posXTime0, poller.samplingRate = 0., 1000.
+    poller.new_event(poller.session, '10/' + 'é' * 40 + ';' + 'ü' * 60)
+    markers = poller.outputs['triggers'].chunks[0]
+    assert markers['description'][0].decode() == 'é' * 16
+    assert markers['additionalInformation'][0].decode() == 'ü' * 50
+    assert poller.nb_truncated.value == 1
+
+
+def test_async_restart():
+    poller = AsyncEventPoller({}, '127.0.0.1', '*', Bus(), mode='router')
+    addr = poller.socket.getsockopt_string(zmq.LAST_ENDPOINT)
+    context = zmq.Context.instance()
+    try:
+        for i in range(2):
+            poller.start()
+            game = context.socket(zmq.DEALER)
+            game.connect(addr)
+            game.send_string(poller.START_ZMQ + '|')
+            assert game.poll(2000)
+            assert game.recv_string() == poller.START_ZMQ + '|'
+            game.close(linger=0)
+            poller.stop()
+            poller.wait()
+        assert poller.nb_send_error == 0
+    finally:
+        poller.close()
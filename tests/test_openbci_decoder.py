@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import numpy as np
+import pytest
+
+from pyacq_ext.eeg_openBCIListener import OpenBCIThread, board_profiles
+from pyacq_ext.openbciemulator import OpenBCIEmulator
+from pyacq_ext.triggers import GAP_TYPE
+
+
+class Output:
+    def __init__(self):
+        self.chunks = []
+
+    def send(self, data, index=None):
+        self.chunks.append(data)
+
+
+def make_thread(board):
+    outputs = {name: Output() for name in ('signals', 'aux', 'triggers')}
+    thread = OpenBCIThread(outputs, None, board_profiles[board], fill_value=np.nan)
+    return thread, outputs
+
+
+def make_stream(board, nb_packet, seed, **errors):
+    emulator = OpenBCIEmulator(board=board, seed=seed, **errors)
+    emulator.sample_index = emulator.sample_id = 0
+    return emulator.inject(emulator.make_packets(nb_packet))
+
+
+def feed(thread, data, cuts):
+    for i1, i2 in zip(cuts[:-1], cuts[1:]):
+        thread.process(data[i1:i2])
+
+
+def check_gaps(outputs):
+    """The gap triggers announce exactly the filler rows, once each"""
+    sigs = np.concatenate(outputs['signals'].chunks)
+    lost = np.zeros(sigs.shape[0], dtype=int)
+    for triggers in outputs['triggers'].chunks:
+        assert triggers['type'][0] == GAP_TYPE
+        lost[triggers['pos'][0]:triggers['pos'][0] + triggers['points'][0]] += 1
+    assert lost.max(initial=0) <= 1
+    assert np.array_equal(lost == 1, np.isnan(sigs).any(axis=1))
+    return lost.sum()
+
+
+def test_daisy_pending_corrupted_packet():
+    emulator = OpenBCIEmulator(board='daisy')
+    emulator.sample_index = emulator.sample_id = 0
+    packets = emulator.make_packets(10)
+    # the odd packet 5 waits for packet 6 in the next read
+    packets[5, -1] = 0x00
+    thread, outputs = make_thread('daisy')
+    thread.process(packets[:6].tobytes())
+    thread.process(packets[6:].tobytes())
+    sigs = np.concatenate(outputs['signals'].chunks)
+    assert sigs.shape[0] == 4
+    assert np.isnan(sigs[2]).any() and not np.isnan(sigs[[0, 1, 3]]).any()
+    assert check_gaps(outputs) == 1
+
+
+@pytest.mark.parametrize('board', ['cyton', 'daisy'])
+@pytest.mark.parametrize('seed', range(5))
+def test_gaps_with_random_reads(board, seed):
+    data = make_stream(board, 2000, seed, corrupt_rate=0.02, drop_byte_rate=0.01,
+                       id_gap_rate=0.02)
+    rng = np.random.default_rng(seed)
+    cuts = np.unique(np.concatenate([[0, len(data)], rng.integers(0, len(data), 200)]))
+    thread, outputs = make_thread(board)
+    feed(thread, data, cuts)
+    assert check_gaps(outputs) > 0
+
+    # the same stream read at once gives the same samples
+    whole, whole_outputs = make_thread(board)
+    whole.process(data)
+    sigs = np.concatenate(outputs['signals'].chunks)
+    whole_sigs = np.concatenate(whole_outputs['signals'].chunks)
+    n = min(sigs.shape[0], whole_sigs.shape[0])
+    assert whole_sigs.shape[0] - n <= 1
+    np.testing.assert_array_equal(sigs[:n], whole_sigs[:n])
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import socket
+import struct
+
+import numpy as np
+import pytest
+
+from pyacq_ext.brainvisionlistener import RDADecoder, drain_rda_messages
+from pyacq_ext.triggers import GAP_TYPE
+
+NB_CHANNEL = 2
+SAMPLE_RATE = 1000.
+POINTS = 10
+
+
+class Output:
+    def __init__(self):
+        self.chunks = []
+
+    def send(self, data, index=None):
+        self.chunks.append((data, index))
+
+
+def make_decoder(**kargs):
+    outputs = {'signals': Output(), 'triggers': Output()}
+    decoder = RDADecoder()
+    decoder.init_decoder(outputs, NB_CHANNEL, np.ones(NB_CHANNEL, dtype='f'),
+                         sample_rate=SAMPLE_RATE, **kargs)
+    return decoder, outputs
+
+
+def make_block(block, value=1.):
+    sigs = np.full((POINTS, NB_CHANNEL), value, dtype='float32')
+    return struct.pack('<LLL', block, POINTS, 0) + sigs.tobytes()
+
+
+def received(outputs):
+    sigs = np.concatenate([data for data, index in outputs['signals'].chunks])
+    gaps = [data for data, index in outputs['triggers'].chunks
+            if data.shape[0] and data['type'][0] == GAP_TYPE]
+    return sigs, gaps
+
+
+def test_skipped_blocks():
+    decoder, outputs = make_decoder(gap_fill='nan')
+    for block in (0, 1, 4, 5):
+        decoder.process_message(4, make_block(block))
+    sigs, gaps = received(outputs)
+    assert sigs.shape == (6 * POINTS, NB_CHANNEL)
+    assert np.all(np.isnan(sigs[2 * POINTS:4 * POINTS]))
+    assert not np.any(np.isnan(sigs[4 * POINTS:]))
+    assert len(gaps) == 1
+    assert gaps[0]['pos'][0] == 2 * POINTS
+    assert gaps[0]['points'][0] == 2 * POINTS
+    assert outputs['signals'].chunks[-1][1] == 6 * POINTS
+
+
+def test_restarted_counter():
+    decoder, outputs = make_decoder(gap_fill='zero')
+    decoder.process_message(4, make_block(7))
+    # the recorder restarted 0.1 s later
+    decoder.t_last_block -= 0.1
+    decoder.process_message(4, make_block(0))
+    sigs, gaps = received(outputs)
+    nb_fill = int(0.1 * SAMPLE_RATE) - POINTS
+    assert abs(sigs.shape[0] - (2 * POINTS + nb_fill)) <= 1
+    assert len(gaps) == 1
+    assert gaps[0]['pos'][0] == POINTS
+    assert np.all(sigs[POINTS:-POINTS] == 0.)
+
+
+def test_long_outage_is_capped():
+    decoder, outputs = make_decoder(gap_fill='zero', max_gap=5000)
+    decoder.process_message(4, make_block(3))
+    # 10 min without block
+    decoder.t_last_block -= 600.
+    decoder.process_message(4, make_block(0))
+    sigs, gaps = received(outputs)
+    assert sigs.shape[0] == 2 * POINTS + 5000
+    assert gaps[0]['points'][0] == 5000
+    fills = [data for data, index in outputs['signals'].chunks[1:-1]]
+    assert all(data.shape[0] <= decoder.gap_chunksize for data in fills)
+    assert decoder.nb_lost_sample.value >= 600 * SAMPLE_RATE - POINTS - 1
+
+
+def make_message(msgtype, rawdata):
+    return struct.pack('<llllLL', 0, 0, 0, 0, 24 + len(rawdata), msgtype) + rawdata
+
+
+def test_drain_messages():
+    sender, receiver = socket.socketpair()
+    with sender, receiver:
+        message = make_message(4, make_block(0))
+        sender.sendall(message * 3 + message[:30])
+        sender.sendall(message[30:])
+        assert drain_rda_messages(receiver) == 4
+        # a message size of 0 would never move on
+        sender.sendall(message[:16] + struct.pack('<LL', 0, 4))
+        with pytest.raises(ValueError):
+            drain_rda_messages(receiver)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import numpy as np
+import pytest
+
+from pyacq_ext.rawbufferdevice import RecorderSource
+from pyacq_ext.recorder import HAVE_H5PY, RecorderWriter, positions_to_rows
+from pyacq_ext.triggers import make_triggers
+
+
+def ramp(i1, i2):
+    # the value of a sample is its stream position
+    return np.repeat(np.arange(i1, i2, dtype='float32')[:, np.newaxis], 2, axis=1)
+
+
+def test_positions_to_rows():
+    segments = [[0, 100], [50, 300], [80, 0]]
+    rows = positions_to_rows(segments, 120, [100, 149, 150, 299, 300, 329, 330, 0, 39, 40])
+    assert rows.tolist() == [0, 49, -1, -1, 50, 79, -1, 80, 119, -1]
+
+
+@pytest.mark.skipif(not HAVE_H5PY, reason='h5py is not installed')
+def test_round_trip_with_gaps(tmp_path):
+    filename = str(tmp_path / 'rec.h5')
+    writer = RecorderWriter(filename, 2, sample_rate=100.)
+    writer.start()
+    # starts at 1000, gap of 60 samples at 1100
+    for i in range(1000, 1200, 20):
+        if not 1100 <= i < 1160:
+            writer.put('signals', i + 20, ramp(i, i + 20))
+    writer.put('triggers', None, make_triggers([1010, 1125, 1160], description=['a', 'b', 'a']))
+    writer.stop()
+
+    # restarted stream, positions from 0 again
+    writer.start()
+    writer.put('signals', 30, ramp(0, 30))
+    writer.put('triggers', None, make_triggers([5], description=['c']))
+    writer.stop()
+
+    source = RecorderSource(filename)
+    try:
+        assert source.length == 140 + 30
+        assert source.segments.tolist() == [[0, 1000], [100, 1160], [140, 0]]
+        # the marker in the gap is dropped
+        assert source.markers['pos'].tolist() == [10, 100, 145]
+        values = [source.read(row, row + 1)[0, 0] for row in source.markers['pos']]
+        assert values == [1010., 1160., 5.]
+        assert source.marker_positions('a').tolist() == [10, 100]
+        assert source.marker_positions('c').tolist() == [145]
+    finally:
+        source.close()
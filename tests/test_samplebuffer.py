@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import numpy as np
+
+from pyacq_ext.streammerger import SampleBuffer
+
+
+def ramp(i1, i2, nb_channel=2):
+    return np.repeat(np.arange(i1, i2, dtype='float32')[:, np.newaxis], nb_channel, axis=1)
+
+
+def values(buf):
+    return buf.data[:buf.stop - buf.start, 0]
+
+
+def test_contiguous():
+    buf = SampleBuffer(100, 2)
+    for i in range(0, 1000, 30):
+        buf.append(i + 30, ramp(i, i + 30))
+    assert buf.stop == 1020
+    assert buf.stop - buf.start >= 100
+    np.testing.assert_array_equal(values(buf), np.arange(buf.start, buf.stop))
+
+
+def test_chunk_larger_than_buffer():
+    buf = SampleBuffer(100, 2)
+    buf.append(10, ramp(0, 10))
+    buf.append(260, ramp(10, 260))
+    buf.append(270, ramp(260, 270))
+    assert buf.size >= 250
+    np.testing.assert_array_equal(values(buf), np.arange(buf.start, 270))
+
+
+def test_missing_positions():
+    buf = SampleBuffer(100, 2)
+    buf.append(10, ramp(0, 10))
+    buf.append(40, ramp(30, 40))
+    assert (buf.start, buf.stop) == (0, 40)
+    assert np.isnan(values(buf)[10:30]).all()
+    np.testing.assert_array_equal(values(buf)[30:], np.arange(30, 40))
+
+
+def test_jump_restarts():
+    buf = SampleBuffer(100, 2)
+    buf.append(10, ramp(0, 10))
+    buf.append(1010, ramp(1000, 1010))
+    assert (buf.start, buf.stop) == (1000, 1010)
+    # going back, a restarted counter
+    buf.append(5, ramp(0, 5))
+    assert (buf.start, buf.stop) == (0, 5)
+    np.testing.assert_array_equal(values(buf), np.arange(5))